@@ -0,0 +1,88 @@
+'''比较视频哈希实现的吞吐与峰值内存
+
+用法：python benchmarks/bench_hash.py [样本目录] [--files 16] [--size-mb 64] [--threads 4]
+未指定样本目录时在临时目录中生成随机文件。每种实现在独立子进程中运行，
+运行前通过 posix_fadvise 丢弃样本文件的页缓存，以测量冷读取性能。
+'''
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IMPLEMENTATIONS = ('legacy', 'readinto', 'mmap')
+
+
+def legacyHash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.md5(f.read(16777216)).hexdigest().upper()
+
+
+def dropCache(file_paths):
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def runWorker(impl: str, file_paths, threads: int) -> None:
+    from DanDanPlayPython.unit import hashFileHead
+    func = {
+        'legacy': legacyHash,
+        'readinto': hashFileHead,
+        'mmap': lambda file_path: hashFileHead(file_path, use_mmap=True),
+    }[impl]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        hashes = list(executor.map(func, file_paths))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'elapsed': elapsed, 'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'digest': hashlib.md5(''.join(hashes).encode()).hexdigest()}))
+
+
+def makeSamples(folder: str, files: int, size_mb: int):
+    file_paths = []
+    for i in range(files):
+        file_path = os.path.join(folder, f'sample{i}.mkv')
+        with open(file_path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1048576))
+        file_paths.append(file_path)
+    return file_paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', nargs='?')
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--worker', choices=IMPLEMENTATIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker is not None:
+        runWorker(args.worker, json.loads(sys.stdin.read()), args.threads)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.folder is None:
+            file_paths = makeSamples(tmp, args.files, args.size_mb)
+        else:
+            file_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(args.folder) for name in names)
+        head_mb = sum(min(os.path.getsize(file_path), 16777216) for file_path in file_paths) / 1048576
+        print(f'{len(file_paths)} files, {head_mb:.0f} MiB hashed per run, {args.threads} threads')
+        digests = set()
+        for impl in IMPLEMENTATIONS:
+            dropCache(file_paths)
+            output = subprocess.run([sys.executable, __file__, '--worker', impl, '--threads', f'{args.threads}'], input=json.dumps(file_paths), capture_output=True, text=True, check=True).stdout
+            result = json.loads(output)
+            digests.add(result['digest'])
+            print(f"{impl:>9}: {head_mb / result['elapsed']:8.1f} MiB/s  peak RSS {result['maxrss_kb'] / 1024:6.1f} MiB")
+        if len(digests) != 1:
+            sys.exit('哈希结果不一致！')
+
+
+if __name__ == '__main__':
+    main()
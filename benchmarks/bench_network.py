@@ -0,0 +1,80 @@
+'''比较 thread 与 asyncio 网络引擎的弹幕下载吞吐
+
+用法：python benchmarks/bench_network.py [--requests 500] [--latency-ms 200] [--threads 8] [--concurrency 64]
+在本地启动一个模拟 DanDanPlay API（每个请求固定延迟后返回少量弹幕），
+分别用两种引擎下载同一批剧集的弹幕并输出每秒请求数。
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY = 0.2
+BODY = json.dumps({'count': 1, 'comments': [{'cid': 1, 'p': '1.00,1,16777215,[benchmark]', 'm': 'benchmark'}]}).encode()
+
+
+class mockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', f'{len(BODY)}')
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class mockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency-ms', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+    LATENCY = args.latency_ms / 1000
+
+    server = mockServer(('127.0.0.1', 0), mockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    from DanDanPlayPython.config import CONFIG
+    from DanDanPlayPython.asyncEngine import aiohttp
+    from DanDanPlayPython.dandanplayAPI import downloadDanmuFromDandanPlay
+    from DanDanPlayPython.unit import videoBindInfoTuple
+    if aiohttp is None:
+        sys.exit('未安装 aiohttp，无法测试 asyncio 引擎：pip install DanDanPlayPython[async]')
+
+    episodes = tuple(videoBindInfoTuple(i, i, f'anime{i}', f'episode{i}', 'TV', 'TV') for i in range(args.requests))
+    print(f'{args.requests} requests, {args.latency_ms} ms latency per request')
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.DANMU_PATH = tmp
+        CONFIG.DANDANPLAY_API_URL = f'http://127.0.0.1:{server.server_address[1]}'
+        CONFIG.API_RATE_LIMIT = 0
+        CONFIG.DANMU_DOWNLOAD_THREAD_NUM = args.threads
+        CONFIG.ASYNC_CONCURRENCY = args.concurrency
+        for engine, label in (('thread', f'thread x{args.threads}'), ('asyncio', f'asyncio x{args.concurrency}')):
+            CONFIG.NETWORK_ENGINE = engine
+            start = time.perf_counter()
+            ok, skips = downloadDanmuFromDandanPlay(episodes, update=True)
+            elapsed = time.perf_counter() - start
+            if not ok:
+                sys.exit(f'{engine}: {len(skips)} 个请求失败')
+            print(f'{label:>14}: {args.requests / elapsed:8.1f} req/s  ({elapsed:.2f} s, {len(os.listdir(tmp))} files)')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
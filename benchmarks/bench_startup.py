@@ -0,0 +1,64 @@
+'''测量命令行各入口的导入耗时，并检查启动预算
+
+用法：python benchmarks/bench_startup.py [--runs 5] [--scale 1.0]
+每个场景在新的解释器中以 `python -X importtime` 运行，取多次运行中的最小值，并扣除空解释器本身的导入。
+场景导入了不应导入的模块，或导入耗时超出预算（较慢的机器可用 --scale 放大预算）时以非零状态退出。
+'''
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Set, Tuple
+
+# 名称: (代码, 预算毫秒数, 不应导入的模块)
+SCENARIOS: Dict[str, Tuple[str, float, Tuple[str, ...]]] = {
+    'cli --help': (
+        "from DanDanPlayPython.cli import CLI\ntry:\n    CLI(['--help'])\nexcept SystemExit:\n    pass",
+        60, ('flask', 'requests', 'pymediainfo', 'tqdm', 'yaml', 'DanDanPlayPython.config')),
+    'config module': ('import DanDanPlayPython.config', 100, ('flask', 'requests', 'pymediainfo', 'tqdm')),
+    'add / thumbnail': ('import DanDanPlayPython.video', 160, ('flask', 'requests', 'pymediainfo')),
+    'run': ('import DanDanPlayPython.app', 500, ('pymediainfo', 'gunicorn')),
+}
+
+
+def importTimes(code: str) -> List[Tuple[int, str, int]]:
+    '''Return [(depth, module, cumulative import time in us)] of running `code` in a new interpreter'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # 顶层模块名前有一个空格，每嵌套一层多缩进两个空格
+        times.append(((len(name) - len(name.lstrip(' ')) - 1) // 2, name.strip(), int(cumulative)))
+    return times
+
+
+def measure(code: str, baseline: Set[str], runs: int) -> Tuple[float, Set[str]]:
+    '''Return (import time in ms excluding `baseline`, imported modules)'''
+    best, modules = float('inf'), set()
+    for _ in range(runs):
+        times = importTimes(code)
+        modules = {name for _, name, _ in times}
+        best = min(best, sum(cumulative for depth, name, cumulative in times if depth == 0 and name not in baseline) / 1000)
+    return best, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0)
+    args = parser.parse_args()
+
+    baseline = {name for _, name, _ in importTimes('pass')}
+    failed = False
+    for name, (code, budget, forbidden) in SCENARIOS.items():
+        elapsed, modules = measure(code, baseline, args.runs)
+        leaked = sorted(module for module in forbidden if module in modules)
+        over = elapsed > budget * args.scale
+        failed = failed or over or bool(leaked)
+        print(f'{name:>16}: {elapsed:7.1f} ms  (budget {budget * args.scale:.0f} ms)' + ('  OVER BUDGET' if over else '') + (f'  imported: {", ".join(leaked)}' if leaked else ''))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
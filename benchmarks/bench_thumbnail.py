@@ -0,0 +1,79 @@
+'''比较旧版与关键帧快速定位的缩略图生成吞吐
+
+用法：python benchmarks/bench_thumbnail.py [样本目录] [--files 8] [--duration 600] [--threads 4] [--ffmpeg-threads 1] [--sizes 800*450,200*112]
+未指定样本目录时用 ffmpeg 的 testsrc2 在临时目录中生成样本视频（关键帧间隔 10 秒）。
+分别输出每秒生成的缩略图数与 ffmpeg 子进程消耗的 CPU 时间；指定 --sizes 时新版在同一次解码中额外输出这些尺寸。
+'''
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def makeSamples(ffmpeg: str, folder: str, files: int, duration: int):
+    file_paths = []
+    for i in range(files):
+        file_path = os.path.join(folder, f'sample{i}.mp4')
+        subprocess.run([ffmpeg, '-loglevel', 'quiet', '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=24:duration={duration}', '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '240', '-y', file_path], check=True)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def legacyCommand(ffmpeg: str, video_path: str, timing: float, output_path: str, image_format: str):
+    return [ffmpeg, '-loglevel', 'quiet', '-ss', f'{timing}', '-i', video_path, '-y', '-f', image_format, '-t', '1', '-r', '1', '-s', '400*225', output_path]
+
+
+def runAll(commands, threads: int):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(subprocess.run, commands))
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return elapsed, (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', nargs='?')
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--duration', type=int, default=600)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ffmpeg-threads', type=int, default=1)
+    parser.add_argument('--sizes', default='')
+    args = parser.parse_args()
+
+    from DanDanPlayPython.config import CONFIG
+    from DanDanPlayPython.video import getVideoDuration, thumbnailCommand
+    CONFIG.THUMBNAIL_FFMPEG_THREADS = args.ffmpeg_threads
+    extra_sizes = [each.strip() for each in args.sizes.split(',') if each.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.folder is None:
+            file_paths = makeSamples(CONFIG.FFMPEG_PATH, tmp, args.files, args.duration)
+        else:
+            file_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(args.folder) for name in names)
+        if not file_paths:
+            sys.exit('没有样本视频')
+        timings = [int(float(getVideoDuration(file_path)) / 5) for file_path in file_paths]
+        print(f'{len(file_paths)} videos, {args.threads} workers, ffmpeg threads: {args.ffmpeg_threads or "auto"}')
+
+        def output(name: str, i: int) -> str:
+            return os.path.join(tmp, f'{name}{i}{CONFIG.THUMBNAIL_SUFFIX}')
+
+        runs = (
+            ('legacy', [legacyCommand(CONFIG.FFMPEG_PATH, file_path, timing, output('legacy', i), CONFIG.THUMBNAIL_FORMAT) for i, (file_path, timing) in enumerate(zip(file_paths, timings))], 1),
+            ('keyframe', [thumbnailCommand(file_path, timing, [('400*225', output('keyframe', i))] + [(size, output(f'keyframe{size.replace("*", "x")}_', i)) for size in extra_sizes]) for i, (file_path, timing) in enumerate(zip(file_paths, timings))], 1 + len(extra_sizes)),
+        )
+        for name, commands, per_video in runs:
+            elapsed, cpu = runAll(commands, args.threads)
+            missing = sum(1 for i in range(len(file_paths)) if not os.path.exists(output(name, i)) or os.path.getsize(output(name, i)) == 0)
+            print(f'{name:>9}: {len(file_paths) * per_video / elapsed:7.2f} thumbnails/s  CPU {cpu:6.2f} s' + (f'  ({missing} failed)' if missing else ''))
+
+
+if __name__ == '__main__':
+    main()
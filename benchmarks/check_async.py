@@ -0,0 +1,102 @@
+'''检查 asyncio 网络引擎
+
+用法：python benchmarks/check_async.py
+使用 check_client.py 中的模拟 DanDanPlay API（每个请求固定延迟），以 asyncio 引擎依次检查：
+弹幕下载并发执行且同时进行的请求数不超过 ASYNC_CONCURRENCY、429/5xx 被重试而重试用尽的剧集出现在 skips 中、
+服务器不可达时全部跳过而不抛出异常、限速器限制请求速率、逐个匹配时失败的视频进入待手动绑定、
+批量匹配接口失败时回退为逐个匹配。任一检查失败时以非零状态退出。
+'''
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from check_client import serveStub
+
+LATENCY = 0.05
+CONCURRENCY = 8
+EPISODES = 64
+RATE_LIMIT = 20
+RATE_REQUESTS = 40
+VIDEOS = 16
+
+
+def main():
+    from DanDanPlayPython.asyncEngine import aiohttp, asyncBindVideosIfIsMached
+    from DanDanPlayPython.config import CONFIG
+    from DanDanPlayPython.dandanplayAPI import batchBindVideosIfIsMached, downloadDanmuFromDandanPlay, getDanmuFilePath
+    from DanDanPlayPython.database import initDB
+    from DanDanPlayPython.unit import videoBaseInfoTuple, videoBindInfoTuple
+    if aiohttp is None:
+        sys.exit('未安装 aiohttp，无法检查 asyncio 引擎：pip install DanDanPlayPython[async]')
+
+    failed = False
+
+    def check(name: str, detail: str, ok: bool) -> None:
+        nonlocal failed
+        failed = failed or not ok
+        print(f'{name:>24}: {detail}' + ('' if ok else '  FAILED'))
+
+    def skipped(skips) -> list:
+        return [each.episodeId for each in skips]
+
+    server = serveStub(LATENCY)
+    episodes = tuple(videoBindInfoTuple(i, i, f'anime{i}', f'episode{i}', 'TV', 'TV') for i in range(1, EPISODES + 1))
+    videos = tuple(videoBaseInfoTuple(f'{i:032x}', f'{"error" if i == 1 else "video"}{i}.mp4', f'/videos/{i}.mp4', 1 << 20, 1440) for i in range(1, VIDEOS + 1))
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.DB_PATH = os.path.join(tmp, 'ddppy.sqlite')
+        CONFIG.DANMU_PATH = tmp
+        CONFIG.DANDANPLAY_API_URL = server.url
+        CONFIG.API_RATE_LIMIT = 0
+        CONFIG.API_MAX_RETRIES = 1
+        CONFIG.NETWORK_ENGINE = 'asyncio'
+        CONFIG.ASYNC_CONCURRENCY = CONCURRENCY
+        initDB()
+
+        server.reset()
+        start = time.perf_counter()
+        ok, skips = downloadDanmuFromDandanPlay(episodes, update=True)
+        elapsed = time.perf_counter() - start
+        serial = EPISODES * LATENCY
+        check('download', f'{EPISODES} episodes in {elapsed:.2f} s, serial {serial:.2f} s, skipped {skipped(skips)}', ok and elapsed < serial / 2)
+        check('concurrency cap', f'{server.max_inflight} requests in flight, limit {CONCURRENCY}', server.max_inflight == CONCURRENCY)
+        written = sum(os.path.exists(getDanmuFilePath(each.episodeId)) for each in episodes)
+        check('danmu files', f'{written} written, expected {EPISODES}', written == EPISODES)
+
+        server.reset({'/api/v2/comment/2': ((429, {'Retry-After': '0'}),), '/api/v2/comment/3': ((503, {}),), '/api/v2/comment/4': ((500, {}),) * 10})
+        ok, skips = downloadDanmuFromDandanPlay(episodes[:8], update=True)
+        check('errors', f'skipped {skipped(skips)}, expected [4]', not ok and skipped(skips) == [4])
+        check('retries', f'{server.attempts["/api/v2/comment/4"]} attempts for episode 4, expected {CONFIG.API_MAX_RETRIES + 1}', server.attempts['/api/v2/comment/4'] == CONFIG.API_MAX_RETRIES + 1)
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            CONFIG.DANDANPLAY_API_URL = f'http://127.0.0.1:{sock.getsockname()[1]}'
+            ok, skips = downloadDanmuFromDandanPlay(episodes[:4], update=True)
+        CONFIG.DANDANPLAY_API_URL = server.url
+        check('server unreachable', f'skipped {len(skips)} of 4', not ok and len(skips) == 4)
+
+        server.reset()
+        CONFIG.API_RATE_LIMIT = RATE_LIMIT
+        start = time.perf_counter()
+        downloadDanmuFromDandanPlay(episodes[:RATE_REQUESTS], update=True)
+        elapsed = time.perf_counter() - start
+        CONFIG.API_RATE_LIMIT = 0
+        # 令牌桶初始可突发 RATE_LIMIT 个请求，其余按速率放行
+        expected = (RATE_REQUESTS - RATE_LIMIT) / RATE_LIMIT
+        check('rate limit', f'{RATE_REQUESTS} requests in {elapsed:.2f} s at {RATE_LIMIT}/s, expected >= {expected:.2f} s', elapsed >= expected * 0.9)
+
+        server.reset()
+        video_bind_infos, _, need_manual_bind_videos = asyncBindVideosIfIsMached(videos)
+        check('match', f'{len(video_bind_infos)} matched, {len(need_manual_bind_videos)} to bind manually', len(video_bind_infos) == VIDEOS - 1 and len(need_manual_bind_videos) == 1)
+        check('match concurrency', f'{server.max_inflight} requests in flight, limit {CONCURRENCY}', 1 < server.max_inflight <= CONCURRENCY)
+
+        server.reset({'/api/v2/match/batch': ((500, {}),) * 10})
+        video_bind_infos, _, need_manual_bind_videos = batchBindVideosIfIsMached(videos)
+        check('batch fallback', f'{len(video_bind_infos)} matched, {server.attempts["/api/v2/match"]} per-file requests', len(video_bind_infos) == VIDEOS - 1 and server.attempts['/api/v2/match'] == VIDEOS + CONFIG.API_MAX_RETRIES)
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
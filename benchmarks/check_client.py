@@ -0,0 +1,187 @@
+'''检查 DanDanPlay API 客户端的重试与限速
+
+用法：python benchmarks/check_client.py
+在本地启动一个模拟 DanDanPlay API，按预设的顺序对指定路径返回 429/5xx 等错误，依次检查：
+429 与 5xx 响应被重试、Retry-After 被遵守、重试次数用尽后抛出异常、其它错误不重试、
+全局限速器限制请求速率、下载弹幕时失败的剧集出现在 skips 中。任一检查失败时以非零状态退出。
+模拟服务器也被 check_async.py 复用。
+'''
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+RATE_LIMIT = 20
+RATE_REQUESTS = 40
+
+
+def matchResult(fileHash: str) -> dict:
+    episodeId = int(fileHash[-4:], 16)
+    return {'animeId': episodeId // 100, 'episodeId': episodeId, 'animeTitle': f'anime{episodeId // 100}', 'episodeTitle': f'episode{episodeId}', 'type': 'tvseries', 'typeDescription': 'TV', 'shift': 0}
+
+
+class stubHandler(BaseHTTPRequestHandler):
+    '''GET /api/v2/comment/{id} 返回一条弹幕，POST /api/v2/match 与 /api/v2/match/batch 按 fileHash 返回匹配结果，\n
+    文件名以 error 开头的视频匹配时总是返回 500（批量接口中为该项失败）；\n
+    路径在 `server.faults` 中时，前几次请求依次返回其中预设的 (状态码, 响应头)'''
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', f'{len(body)}')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method: str) -> None:
+        server: stubServer = self.server  # type: ignore
+        path = self.path.split('?', 1)[0]
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+        with server.lock:
+            server.attempts[path] += 1
+            server.inflight += 1
+            server.max_inflight = max(server.max_inflight, server.inflight)
+            faults = server.faults.get(path, ())
+            fault = faults[server.attempts[path] - 1] if server.attempts[path] <= len(faults) else None
+        try:
+            time.sleep(server.latency)
+            if fault is not None:
+                return self._reply(fault[0], headers=fault[1])
+            if method == 'GET' and path.startswith('/api/v2/comment/'):
+                episodeId = int(path.rsplit('/', 1)[1])
+                return self._reply(200, json.dumps({'count': 1, 'comments': [{'cid': episodeId, 'p': '1.00,1,16777215,[check]', 'm': 'check'}]}).encode())
+            if method == 'POST' and path == '/api/v2/match':
+                if request['fileName'].startswith('error'):
+                    return self._reply(500)
+                return self._reply(200, json.dumps({'success': True, 'isMatched': True, 'matches': [matchResult(request['fileHash'])]}).encode())
+            if method == 'POST' and path == '/api/v2/match/batch':
+                results = [{'fileHash': each['fileHash'], 'success': True, 'matchResult': matchResult(each['fileHash'])} if not each['fileName'].startswith('error') else
+                           {'fileHash': each['fileHash'], 'success': False, 'matchResult': None} for each in request['requests']]
+                return self._reply(200, json.dumps({'success': True, 'results': results}).encode())
+            self._reply(404)
+        finally:
+            with server.lock:
+                server.inflight -= 1
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+class stubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), stubHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def reset(self, faults: Optional[Dict[str, Tuple[Tuple[int, Dict[str, str]], ...]]] = None) -> None:
+        '''faults: {path: ((status, headers), ...)}，该路径的前几次请求依次返回这些响应'''
+        with self.lock:
+            self.faults = dict(faults or {})
+            self.attempts: Counter = Counter()
+            self.inflight = self.max_inflight = 0
+
+
+def serveStub(latency: float = 0.0) -> stubServer:
+    server = stubServer(latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    import requests
+
+    from DanDanPlayPython.client import DanDanPlayClient
+    from DanDanPlayPython.config import CONFIG
+    from DanDanPlayPython.dandanplayAPI import downloadDanmuFromDandanPlay
+    from DanDanPlayPython.database import initDB
+    from DanDanPlayPython.unit import videoBindInfoTuple
+
+    failed = False
+
+    def check(name: str, detail: str, ok: bool) -> None:
+        nonlocal failed
+        failed = failed or not ok
+        print(f'{name:>24}: {detail}' + ('' if ok else '  FAILED'))
+
+    server = serveStub()
+    client = DanDanPlayClient(base_url=server.url, timeout=(1, 5), max_retries=3, rate_limit=0)
+    path = '/api/v2/comment/1'
+
+    server.reset({path: ((429, {'Retry-After': '0'}),)})
+    status = client.request('GET', path).status_code
+    check('429', f'status {status} after {server.attempts[path]} attempts', status == 200 and server.attempts[path] == 2)
+
+    server.reset({path: ((500, {}), (502, {}), (503, {}))})
+    status = client.request('GET', path).status_code
+    check('5xx', f'status {status} after {server.attempts[path]} attempts', status == 200 and server.attempts[path] == 4)
+
+    server.reset({path: ((503, {'Retry-After': '1'}),)})
+    start = time.perf_counter()
+    client.request('GET', path)
+    elapsed = time.perf_counter() - start
+    check('Retry-After', f'retried after {elapsed:.2f} s, expected >= 1 s', elapsed >= 1)
+
+    server.reset({path: ((500, {}),) * 10})
+    try:
+        client.request('GET', path)
+        raised = False
+    except requests.exceptions.HTTPError:
+        raised = True
+    check('retries exhausted', f'raised {raised} after {server.attempts[path]} attempts', raised and server.attempts[path] == client.max_retries + 1)
+
+    server.reset({path: ((404, {}),)})
+    status = client.request('GET', path).status_code
+    check('404', f'status {status} after {server.attempts[path]} attempts', status == 404 and server.attempts[path] == 1)
+
+    server.reset()
+    limited = DanDanPlayClient(base_url=server.url, timeout=(1, 5), max_retries=0, rate_limit=RATE_LIMIT)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=limited.request, args=('GET', path)) for _ in range(RATE_REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # 令牌桶初始可突发 RATE_LIMIT 个请求，其余按速率放行
+    expected = (RATE_REQUESTS - RATE_LIMIT) / RATE_LIMIT
+    check('rate limit', f'{RATE_REQUESTS} requests in {elapsed:.2f} s at {RATE_LIMIT}/s, expected >= {expected:.2f} s', elapsed >= expected * 0.9)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.DB_PATH = os.path.join(tmp, 'ddppy.sqlite')
+        CONFIG.DANMU_PATH = tmp
+        CONFIG.DANDANPLAY_API_URL = server.url
+        CONFIG.API_RATE_LIMIT = 0
+        CONFIG.API_MAX_RETRIES = 1
+        CONFIG.NETWORK_ENGINE = 'thread'
+        initDB()
+        episodes = tuple(videoBindInfoTuple(i, i, f'anime{i}', f'episode{i}', 'TV', 'TV') for i in range(1, 9))
+        server.reset({'/api/v2/comment/2': ((429, {'Retry-After': '0'}),), '/api/v2/comment/3': ((500, {}),) * 10})
+        ok, skips = downloadDanmuFromDandanPlay(episodes, update=True)
+        check('download', f'skipped {[each.episodeId for each in skips]}, expected [3]', not ok and [each.episodeId for each in skips] == [3])
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''检查增量扫描与数据库的同步
+
+用法：python benchmarks/check_scan.py
+在临时目录中建立数据库与几个视频文件，依次检查：首次扫描、重复扫描、`clearDB('video')` 后重新扫描、
+目录暂时不可用（如网络共享未挂载）时 `clearBrokenVideo()` 之后重新扫描、
+目录暂时不可用时扫描不删除视频、文件删除后扫描移除其视频。任一检查失败时以非零状态退出。
+'''
+import os
+import sys
+import tempfile
+
+FILE_COUNT = 3
+
+
+def main():
+    from DanDanPlayPython.config import CONFIG
+    from DanDanPlayPython.database import addVideosIntoDB, clearBrokenVideo, clearDB, getVideoCount, initDB, updateScanStates
+    from DanDanPlayPython.video import getVideoHash, scanLibrary
+
+    def ingest(entries) -> None:
+        # 与入库流水线写入的内容相同，省去时长解析
+        addVideosIntoDB(tuple((getVideoHash(entry.filePath), os.path.basename(entry.filePath), entry.filePath, entry.size, 0) for entry in entries))
+        updateScanStates(tuple((*entry, getVideoHash(entry.filePath)) for entry in entries))
+
+    failed = False
+
+    def check(name: str, what: str, count: int, expected: int) -> None:
+        nonlocal failed
+        ok = count == expected
+        failed = failed or not ok
+        print(f'{name:>24}: {what} {count}, expected {expected}' + ('' if ok else '  FAILED'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.DB_PATH = os.path.join(tmp, 'ddppy.sqlite')
+        initDB()
+        library = os.path.join(tmp, 'library')
+        os.makedirs(library)
+        for i in range(FILE_COUNT):
+            with open(os.path.join(library, f'{i}.mp4'), 'wb') as f:
+                f.write(bytes([i]) * 4096)
+
+        result = scanLibrary(library)
+        check('first scan', 'added', len(result.added), FILE_COUNT)
+        ingest(result.added)
+        check('rescan', 'added', len(scanLibrary(library).added), 0)
+
+        clearDB('video')
+        result = scanLibrary(library)
+        check("after clearDB('video')", 'added', len(result.added), FILE_COUNT)
+        ingest(result.added)
+
+        unmounted = f'{library}.unmounted'
+        os.rename(library, unmounted)
+        clearBrokenVideo()
+        os.rename(unmounted, library)
+        result = scanLibrary(library)
+        check('after clearBrokenVideo', 'added', len(result.added), FILE_COUNT)
+        ingest(result.added)
+
+        os.rename(library, unmounted)
+        check('folder unavailable', 'removed', len(scanLibrary(library).removed), 0)
+        check('folder unavailable', 'videos', getVideoCount(), FILE_COUNT)
+        os.rename(unmounted, library)
+
+        os.remove(os.path.join(library, '0.mp4'))
+        check('file deleted', 'removed', len(scanLibrary(library).removed), 1)
+        check('file deleted', 'videos', getVideoCount(), FILE_COUNT - 1)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
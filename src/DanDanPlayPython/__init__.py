@@ -1,3 +1,3 @@
 from .__version__ import VERSION
 
-__all__ = ['dandanplayAPI', 'auth', 'database', 'unit', 'video']
\ No newline at end of file
+__all__ = ['dandanplayAPI', 'asyncEngine', 'auth', 'client', 'danmu', 'danmuStore', 'database', 'library', 'scheduler', 'server', 'stream', 'unit', 'video', 'watch']
\ No newline at end of file
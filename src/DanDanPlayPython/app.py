@@ -1,19 +1,33 @@
+import concurrent.futures
 import functools
+import gzip
+import os
 import time
+from typing import List, Optional, Tuple
 
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
-# from var_dump import var_dump
 
-from .auth import *
+from .auth import generateToken, generateUUID, getTokenCache, vaildLogin, vaildToken
 from .config import CONFIG
-from .dandanplayAPI import *
-from .database import *
-from .unit import *
-from .video import *
+from .danmu import DANMU_MIMETYPES, getDanmuCache
+from .dandanplayAPI import getDanmuFilePath, streamDanmuRange
+from .database import (bindedVideoSortKey, getAllBindedVideos, getBindingFromDB,
+                       getSpecificBindedVideo, getVideoFromDB, queryBindedVideos)
+from .library import getLibrarySnapshot
+from .scheduler import getDanmuScheduler
+from .stream import getVideoPathCache, streamResponse
+from .unit import videoBaseInfoTuple, videoBindInfoTuple
+from .video import (getFileName, getSpritePath, getSpriteSheetPath,
+                    getThumbnailPath, getThumbnailQueue, parseThumbnailSize)
+from .watch import getWatchBuffer
 
 app = Flask(__name__)
-CORS(app, supports_credentials=True)
+# 雪碧图与 VTT 仅在重新生成时改变，由 ETag/Last-Modified 校验
+SPRITE_MAX_AGE = 86400
+# 分页请求单页条目数上限
+LIBRARY_MAX_PAGE_SIZE = 1000
+CORS(app, supports_credentials=True, expose_headers=['X-Next-Cursor'])
 
 
 def return401(*args, **kwargs):
@@ -54,14 +68,26 @@ def retuenWelcome():
     }
 
 
+@app.route('/api/v1/metrics')
+@checkAuth()
+def returnMetrics():
+    return jsonify({"tokenCache": getTokenCache().stats()})
+
+
 @app.route('/api/v1/playlist')
 @checkAuth()
 def returnPlaylist():
     return jsonify({})
 
 
-def generateLibrary(_hash: Optional[str] = None) -> List[dict]:
-    _bindings = getAllBindedVideos() if _hash is None else getSpecificBindedVideo(_hash)
+LIBRARY_FIELDS = ('AnimeId', 'EpisodeId', 'AnimeTitle', 'EpisodeTitle', 'Id', 'Hash', 'Name', 'Path', 'Size', 'Rate', 'IsStandalone', 'Created', 'LastMatch', 'LastPlay', 'LastThumbnail', 'Duration')
+LIBRARY_QUERY_ARGS = ('limit', 'cursor', 'sort', 'animeId', 'watchedAfter', 'watchedBefore', 'unwatched', 'fields')
+
+
+def generateLibrary(_hash: Optional[str] = None, _bindings: Optional[Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]] = None) -> List[dict]:
+    '''_bindings: rows returned by `database.getAllBindedVideos` etc., queried by `_hash` if not given'''
+    if _bindings is None:
+        _bindings = getAllBindedVideos() if _hash is None else getSpecificBindedVideo(_hash)
     default_time = '0001-01-01T00:00:00'
     return [{
                 "AnimeId": eachTuple[1].animeId,
@@ -70,8 +96,8 @@ def generateLibrary(_hash: Optional[str] = None) -> List[dict]:
                 "EpisodeTitle": eachTuple[1].episodeTitle,
                 "Id": eachTuple[0].hash,
                 "Hash": eachTuple[0].hash,
-                "Name": getFileName(eachTuple[0].filePath, with_extension=True),
-                "Path": f'Y:\\{eachTuple[1].animeTitle}\\{getFileName(eachTuple[0].filePath, with_extension=True)}',
+                "Name": _name,
+                "Path": f'Y:\\{eachTuple[1].animeTitle}\\{_name}',
                 "Size": eachTuple[0].fileSize,
                 "Rate": 0,
                 "IsStandalone": False,
@@ -79,43 +105,205 @@ def generateLibrary(_hash: Optional[str] = None) -> List[dict]:
                 "LastMatch": default_time,
                 "LastPlay": eachTuple[2],
                 "LastThumbnail": None,
-                "Duration": eachTuple[0].videoDuration} for eachTuple in _bindings]
+                "Duration": eachTuple[0].videoDuration} for eachTuple in _bindings for _name in (getFileName(eachTuple[0].filePath, with_extension=True),)]
+
+
+def renderLibrary() -> bytes:
+    return jsonify(generateLibrary()).get_data()
+
+
+def parseLibraryCursor(_cursor: str, _sort: str) -> tuple:
+    '''episode: "animeId.episodeId.hash", hash: "hash"，格式错误时抛出 ValueError'''
+    if _sort == 'hash':
+        return _cursor,
+    _animeId, _episodeId, _hash = _cursor.split('.')
+    return int(_animeId), int(_episodeId), _hash
+
+
+def returnLibraryPage():
+    '''limit, cursor, sort ("episode" or "hash"), animeId, watchedAfter, watchedBefore, unwatched, fields (comma separated)\n
+    下一页的 cursor 由响应头 X-Next-Cursor 给出，最后一页不含此响应头'''
+    try:
+        _sort = request.args.get('sort', 'episode')
+        if _sort not in ('episode', 'hash'):
+            raise ValueError(_sort)
+        _limit = min(int(request.args['limit']), LIBRARY_MAX_PAGE_SIZE) if 'limit' in request.args else None
+        if _limit is not None and _limit <= 0:
+            raise ValueError(_limit)
+        _cursor = request.args.get('cursor')
+        _after = parseLibraryCursor(_cursor, _sort) if _cursor else None
+        _animeId = int(request.args['animeId']) if 'animeId' in request.args else None
+        _watched_after = int(request.args['watchedAfter']) if 'watchedAfter' in request.args else None
+        _watched_before = int(request.args['watchedBefore']) if 'watchedBefore' in request.args else None
+        _unwatched = request.args.get('unwatched', 'false').lower() in ('1', 'true')
+        _fields = [each for each in request.args.get('fields', '').split(',') if each] or list(LIBRARY_FIELDS)
+        if not set(_fields) <= set(LIBRARY_FIELDS):
+            raise ValueError(_fields)
+    except ValueError:
+        return '', 400
+    _bindings = queryBindedVideos(_animeId, _watched_after, _watched_before, _unwatched, _sort, _after, _limit)
+    response = jsonify([{_field: each_item[_field] for _field in _fields} for each_item in generateLibrary(_bindings=_bindings)])
+    if _limit is not None and len(_bindings) == _limit:
+        response.headers['X-Next-Cursor'] = '.'.join(str(each) for each in bindedVideoSortKey(_bindings[-1], _sort))
+    return response
 
 
 @app.route('/api/v1/library')
 @checkAuth()
 def returnLibrary():
-    return jsonify(generateLibrary())
+    '''由内存快照返回媒体库，数据库未写入时仅需一次版本号查询；带分页或筛选参数时见 `returnLibraryPage`'''
+    if any(each_arg in request.args for each_arg in LIBRARY_QUERY_ARGS):
+        return returnLibraryPage()
+    _snapshot = getLibrarySnapshot(renderLibrary)
+    _etag = _snapshot.etag()
+    _gzip = 'gzip' in request.accept_encodings
+    # gzip 与未压缩的响应是不同的表示，各自使用不同的 ETag
+    _response_etag = f'{_etag}-gz' if _gzip else _etag
+    if request.if_none_match.contains(_response_etag):
+        response = Response(status=304)
+    else:
+        _library = _snapshot.get(_etag)
+        if _gzip:
+            response = Response(_library.gzipped_data, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(_library.data, mimetype='application/json')
+    response.set_etag(_response_etag)
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/api/v1/image/<_hash>')
 @app.route('/api/v1/image/id/<_hash>')
 def returnImage(_hash):
-    _path = os.path.join(CONFIG.DATA_PATH,CONFIG.THUMBNAIL_PATH,f'{_hash}{CONFIG.THUMBNAIL_SUFFIX}')
+    _size = request.args.get('size')
+    if _size is not None:
+        try:
+            _size = next(each_size for each_size in CONFIG.THUMBNAIL_EXTRA_SIZES if parseThumbnailSize(each_size) == parseThumbnailSize(_size))
+        except (StopIteration, ValueError):
+            return '', 404
+    _path = getThumbnailPath(_hash, _size)
+    if not os.path.exists(_path):
+        if not CONFIG.THUMBNAIL_INSTANT_CREATE:
+            return '', 404
+        _videoBaseInfoTuple = getVideoFromDB(_hash)
+        if _videoBaseInfoTuple is None:
+            return '', 404
+        # 缩略图在队列中生成，超时未完成则返回 202，由客户端稍后重试
+        try:
+            _created = getThumbnailQueue().request(_videoBaseInfoTuple, _size).result(timeout=CONFIG.THUMBNAIL_WAIT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            return '', 202, {'Retry-After': '1'}
+        except Exception:
+            _created = False
+        if not _created:
+            return '', 404
+    # 以文件是否存在为准，避免 send_file 对缺失的文件抛出异常
+    if not os.path.exists(_path):
+        return '', 404
+    return send_file(_path)
+
+
+@app.route('/api/v1/subtitle/vtt/<_hash>')
+@checkAuth()
+def returnSpriteVTT(_hash):
+    '''拖动预览的 WebVTT 缩略图轨道，雪碧图不存在时加入缩略图队列生成'''
+    _path = os.path.join(getSpritePath(_hash), 'index.vtt')
     if not os.path.exists(_path):
         if not CONFIG.THUMBNAIL_INSTANT_CREATE:
             return '', 404
         _videoBaseInfoTuple = getVideoFromDB(_hash)
         if _videoBaseInfoTuple is None:
             return '', 404
-        createThumbnail(_videoBaseInfoTuple)
-    return send_file(_path) 
+        try:
+            _created = getThumbnailQueue().requestSprite(_videoBaseInfoTuple).result(timeout=CONFIG.THUMBNAIL_WAIT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            return '', 202, {'Retry-After': '5'}
+        except Exception:
+            _created = False
+        if not _created:
+            return '', 404
+    if not CONFIG.API_TOKEN_REQUIRED:
+        return send_file(_path, mimetype='text/vtt', max_age=SPRITE_MAX_AGE)
+    # 雪碧图同样需要鉴权，播放器请求 cue 中的地址时不带 Authorization，因此在地址中加入 token；
+    # token 在重启后变化，轨道文件不允许缓存
+    with open(_path, 'r', encoding='utf-8') as f:
+        _vtt = f.read().replace('#xywh=', f'?token={CONFIG.ONCE_SECRET}#xywh=')
+    response = Response(_vtt, mimetype='text/vtt')
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/api/v1/sprite/<_hash>/<int:index>')
+@checkAuth()
+def returnSpriteSheet(_hash, index):
+    _path = getSpriteSheetPath(_hash, index)
+    if not os.path.exists(_path):
+        return '', 404
+    return send_file(_path, max_age=SPRITE_MAX_AGE)
 
 
 @app.after_request
 def after_request(response):
-    response.headers.add('Accept-Ranges', 'bytes')
+    response.headers.setdefault('Accept-Ranges', 'bytes')
     return response
 
 @app.route('/api/v1/stream/id/<_hash>')
 @app.route('/api/v1/stream/<_hash>')
 @checkAuth()
 def returnStream(_hash):
-    _videoBaseInfoTuple = getVideoFromDB(_hash)
-    if _videoBaseInfoTuple is None:
+    _resolved = getVideoPathCache().resolve(_hash)
+    if _resolved is None:
         return ('', 404)
-    updateLastWatchTime(_videoBaseInfoTuple.hash, int(time.time()))
-    return send_file(_videoBaseInfoTuple.filePath)
+    # 观看记录由写后缓冲合并写入；从头开始的请求计为一次播放，拖动产生的 Range 请求不计
+    _range = request.headers.get('Range', '').replace(' ', '')
+    getWatchBuffer().record(_hash, play=not _range or _range.startswith('bytes=0-'))
+    return streamResponse(request, *_resolved)
+
+
+def fetchDanmu(_videoBindInfoTuple: videoBindInfoTuple) -> Optional[bool]:
+    '''由后台调度器获取弹幕并最多等待 `DANMU_WAIT_TIMEOUT` 秒，同一剧集的并发请求共享同一次下载\n
+    Return None if the download is not finished in time, it keeps running in background'''
+    try:
+        return getDanmuScheduler().fetch(_videoBindInfoTuple).result(timeout=CONFIG.DANMU_WAIT_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        return None
+    except Exception:
+        return False
+
+
+def returnRenderedDanmu(_videoBindInfoTuple: videoBindInfoTuple, type: str):
+    '''type: "DanDanPlay-Android" or "Web"，由渲染缓存返回弹幕，支持 If-None-Match 与 gzip'''
+    _cache = getDanmuCache()
+    _etag = _cache.etag(_videoBindInfoTuple.episodeId, type)
+    if _etag is None:
+        if not CONFIG.DANMU_INSTANT_GET:
+            return '', 404
+        if fetchDanmu(_videoBindInfoTuple) is None:
+            return '', 202, {'Retry-After': '5'}
+        _etag = _cache.etag(_videoBindInfoTuple.episodeId, type)
+        if _etag is None:
+            return '', 404
+    # 仅凭源文件的 stat 即可判断客户端缓存是否有效，无需渲染
+    if request.if_none_match.contains(_etag):
+        response = Response(status=304)
+        response.set_etag(_etag)
+        return response
+    _rendered = _cache.lookup(_videoBindInfoTuple.episodeId, type, _etag)
+    if _rendered is None:
+        # 未命中缓存时流式返回，同时写入缓存
+        response = Response(_cache.stream(_videoBindInfoTuple.episodeId, type, _etag), mimetype=DANMU_MIMETYPES[type])
+        response.set_etag(_etag)
+        response.vary.add('Accept-Encoding')
+        return response
+    if _rendered.gzipped and 'gzip' in request.accept_encodings:
+        response = Response(_rendered.data, mimetype=_rendered.mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(_rendered.data) if _rendered.gzipped else _rendered.data, mimetype=_rendered.mimetype)
+    response.set_etag(_rendered.etag)
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/api/v1/comment/id/<_hash>')
@@ -125,12 +313,26 @@ def returnAPIComment(_hash):
     _videoBindInfoTuple = getBindingFromDB(_hash)
     if _videoBindInfoTuple is None:
         return '', 404
-    _path = os.path.join(CONFIG.DATA_PATH,CONFIG.DANMU_PATH,f'{_videoBindInfoTuple.episodeId}.json')
-    if not os.path.exists(_path):
+    return returnRenderedDanmu(_videoBindInfoTuple, 'DanDanPlay-Android')
+
+
+@app.route('/api/v1/comment/range/<_hash>')
+@checkAuth()
+def returnRangeComment(_hash):
+    '''返回 [start, end) 秒内的弹幕，格式同 `returnWebComment`，供分段加载弹幕的播放器使用'''
+    _videoBindInfoTuple = getBindingFromDB(_hash)
+    if _videoBindInfoTuple is None:
+        return '', 404
+    _start = request.args.get('start', 0.0, type=float)
+    _end = request.args.get('end', float('inf'), type=float)
+    if not os.path.exists(getDanmuFilePath(_videoBindInfoTuple.episodeId)):
         if not CONFIG.DANMU_INSTANT_GET:
             return '', 404
-        downloadDanmuFromDandanPlay(_videoBindInfoTuple)
-    return covertDanmu(_videoBindInfoTuple.episodeId, 'DanDanPlay-Android')
+        if fetchDanmu(_videoBindInfoTuple) is None:
+            return '', 202, {'Retry-After': '5'}
+        if not os.path.exists(getDanmuFilePath(_videoBindInfoTuple.episodeId)):
+            return '', 404
+    return Response(streamDanmuRange(_videoBindInfoTuple.episodeId, _start, _end), mimetype='application/json')
 
 
 @app.route('/api/v1/auth', methods=['POST'])
@@ -157,11 +359,11 @@ def dealAuth():
 @checkAuth()
 def returnPlayConfig(_hash):
     _videoInfoTuple = getSpecificBindedVideo(_hash)
-    if _videoInfoTuple[0] is None:
+    if not _videoInfoTuple:
         return '', 404
     _token_str = f"?token={CONFIG.ONCE_SECRET}"
     return jsonify({"id": _hash,
-    "video": generateLibrary(_videoInfoTuple[0][0].hash)[0],
+    "video": generateLibrary(_bindings=_videoInfoTuple)[0],
     "videoUrl": f"/api/v1/stream/id/{_hash}{_token_str}",
     "imageUrl": f"/api/v1/image/id/{_hash}{_token_str}",
     "vttUrl": f"/api/v1/subtitle/vtt/{_hash}{_token_str}",
@@ -174,7 +376,7 @@ def returnPlayConfig(_hash):
         "episodeTitle": eachTuple[1].episodeTitle,
         "fileName": getFileName(eachTuple[0].filePath, with_extension=True),
         "isCurrent": eachTuple[0].hash == _hash,
-    } for eachTuple in sorted(getSpecificAnimeBindedVideos(_videoInfoTuple[0][1].animeId), key=lambda x: x[1].episodeId)]})
+    } for eachTuple in queryBindedVideos(animeId=_videoInfoTuple[0][1].animeId)]})
 
 
 # http://127.0.0.1:4444/api/v1/dplayer/v3/?id=e90fdbfc-541a-41e1-8aac-ef2a82076ca8
@@ -184,14 +386,11 @@ def returnWebComment():
     _videoBindInfoTuple = getBindingFromDB(_hash)
     if _videoBindInfoTuple is None:
         return '', 404
-    _path = os.path.join(CONFIG.DATA_PATH,CONFIG.DANMU_PATH,f'{_videoBindInfoTuple.episodeId}.json')
-    if not os.path.exists(_path):
-        if not CONFIG.DANMU_INSTANT_GET:
-            return '', 404
-        downloadDanmuFromDandanPlay(_videoBindInfoTuple)
-    return covertDanmu(_videoBindInfoTuple.episodeId, 'Web')
+    return returnRenderedDanmu(_videoBindInfoTuple, 'Web')
 
 def run(host:str = '0.0.0.0', port:int = 5000):
+    if CONFIG.DANMU_SCHEDULER_ENABLE:
+        getDanmuScheduler().start()
     app.run(host=host, port=port, debug=False, threaded=True)
 
 if __name__ == '__main__':
@@ -0,0 +1,152 @@
+import asyncio
+import html
+import json
+import os
+import random
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple, TypeVar
+
+import tqdm
+
+from .client import _BACKOFF_BASE, _BACKOFF_CAP, _RETRY_STATUS, _parseRetryAfter
+from .config import CONFIG
+from .dandanplayAPI import classifyMatchResults, generateMatchRequest, getDanmuFilePath, getDanmuRequestFrom, parseMatchResponse, saveDanmu
+from .unit import videoBaseInfoTuple, videoBindInfoTuple
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖：pip install DanDanPlayPython[async]
+    aiohttp = None  # type: ignore
+
+_T = TypeVar('_T')
+_R = TypeVar('_R')
+
+
+def asyncEngineEnabled() -> bool:
+    '''Return True if `NETWORK_ENGINE` is asyncio and aiohttp is installed'''
+    return CONFIG.NETWORK_ENGINE == 'asyncio' and aiohttp is not None
+
+
+class asyncRateLimiter():
+    '''`client.rateLimiter` 的协程版本，rate 为每秒请求数，为 0 时不限速'''
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = max(1, int(rate)) if burst is None else burst
+        self._tokens = float(self.burst)
+        self._updated = asyncio.get_running_loop().time() if rate > 0 else 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class asyncDanDanPlayClient():
+    '''`client.DanDanPlayClient` 的协程版本，重试、退避与限速策略相同，需在事件循环中创建'''
+
+    def __init__(self, session: 'aiohttp.ClientSession', base_url: Optional[str] = None, max_retries: Optional[int] = None, rate_limit: Optional[float] = None):
+        self.session = session
+        self.base_url = (CONFIG.DANDANPLAY_API_URL if base_url is None else base_url).rstrip('/')
+        self.max_retries: int = CONFIG.API_MAX_RETRIES if max_retries is None else max_retries
+        self.limiter = asyncRateLimiter(CONFIG.API_RATE_LIMIT if rate_limit is None else rate_limit)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+
+    async def request(self, method: str, path: str, **kw) -> bytes:
+        '''Return the response body, raise `aiohttp.ClientError` or `asyncio.TimeoutError` when all retries failed'''
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                async with self.session.request(method, f'{self.base_url}{path}', **kw) as response:
+                    if response.status not in _RETRY_STATUS:
+                        return await response.read()
+                    if attempt == self.max_retries:
+                        response.raise_for_status()
+                    _retry_after = _parseRetryAfter(response.headers.get('Retry-After'))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+                _retry_after = None
+            await asyncio.sleep(min(_BACKOFF_CAP, _retry_after) if _retry_after is not None else self._backoff(attempt))
+        raise aiohttp.ClientError(f'{method} {path}')
+
+    async def requestJSON(self, method: str, path: str, **kw) -> Any:
+        '''Same as `request`, but decode the html-escaped JSON body'''
+        return json.loads(html.unescape((await self.request(method, path, **kw)).decode('utf-8')))
+
+
+async def _fanOut(items: Sequence[_T], worker: Callable[[asyncDanDanPlayClient, _T], Awaitable[_R]], describe: Callable[[_T], str], tqdm_obj: Optional[tqdm.tqdm] = None) -> List[_R]:
+    '''以 `ASYNC_CONCURRENCY` 为并发上限对 items 执行 worker，结果按 items 顺序返回，异常作为结果返回'''
+    semaphore = asyncio.Semaphore(CONFIG.ASYNC_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=CONFIG.ASYNC_CONCURRENCY, ssl=False)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONFIG.API_CONNECT_TIMEOUT, sock_read=CONFIG.API_READ_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        client = asyncDanDanPlayClient(session)
+
+        async def run(item: _T) -> _R:
+            async with semaphore:
+                try:
+                    return await worker(client, item)
+                finally:
+                    if tqdm_obj is not None:
+                        tqdm_obj.set_description(describe(item))
+                        tqdm_obj.update()
+        return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+async def _queryDandanPlay(client: asyncDanDanPlayClient, _videoBaseInfoTuple: videoBaseInfoTuple):
+    try:
+        _dict = await client.requestJSON('POST', '/api/v2/match', json=generateMatchRequest(_videoBaseInfoTuple))
+    except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError):
+        return False, None
+    return parseMatchResponse(_dict)
+
+
+def asyncBindVideosIfIsMached(each_video_baseinfo_group: Sequence[videoBaseInfoTuple], tqdm_obj: Optional[tqdm.tqdm] = None) -> Tuple[List[Tuple[str, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]]:
+    '''Returns: the same as `dandanplayAPI.multiThreadBindVideosIfIsMached`'''
+    results = asyncio.run(_fanOut(each_video_baseinfo_group, _queryDandanPlay, lambda each_video_baseinfo: each_video_baseinfo.fileName, tqdm_obj))
+    return classifyMatchResults((each_video_baseinfo, (False, None) if isinstance(result, BaseException) else result) for each_video_baseinfo, result in zip(each_video_baseinfo_group, results))
+
+
+def asyncDownloadDanmuFromDandanPlay(_videoBindInfoTuple: Sequence[videoBindInfoTuple], _from: int, with_related: bool, ch_convert: int, update: bool, show_progress: bool, incremental: bool = False) -> Tuple[bool, Tuple]:
+    '''Returns: the same as `dandanplayAPI.downloadDanmuFromDandanPlay`'''
+    tqdm_obj = tqdm.tqdm(_videoBindInfoTuple) if show_progress else None
+
+    def describe(eachVideoBindInfoTuple: videoBindInfoTuple) -> str:
+        return f'{eachVideoBindInfoTuple.animeTitle} - {eachVideoBindInfoTuple.episodeTitle}'
+
+    async def download(client: asyncDanDanPlayClient, eachVideoBindInfoTuple: videoBindInfoTuple) -> bool:
+        _request_from, merge = getDanmuRequestFrom(eachVideoBindInfoTuple, _from, incremental)
+        # aiohttp 不接受 bool 类型的参数
+        params = {'from': _request_from, 'withRelated': str(with_related), 'chConvert': ch_convert}
+        try:
+            content = await client.request('GET', f'/api/v2/comment/{eachVideoBindInfoTuple.episodeId}', params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        # 写文件放到线程池，避免阻塞事件循环
+        return await asyncio.get_running_loop().run_in_executor(None, saveDanmu, eachVideoBindInfoTuple.episodeId, content, getDanmuFilePath(eachVideoBindInfoTuple.episodeId), merge)
+
+    pending = []
+    for eachVideoBindInfoTuple in _videoBindInfoTuple:
+        if not update and os.path.exists(getDanmuFilePath(eachVideoBindInfoTuple.episodeId)):
+            if tqdm_obj is not None:
+                tqdm_obj.set_description(describe(eachVideoBindInfoTuple))
+                tqdm_obj.update()
+            continue
+        pending.append(eachVideoBindInfoTuple)
+    results = asyncio.run(_fanOut(pending, download, describe, tqdm_obj)) if pending else []
+    if tqdm_obj is not None:
+        tqdm_obj.close()
+    skips = tuple(eachVideoBindInfoTuple for eachVideoBindInfoTuple, result in zip(pending, results) if result is not True)
+    return not bool(skips), skips
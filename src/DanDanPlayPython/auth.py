@@ -1,12 +1,15 @@
 import hashlib
+import threading
 import time
 import uuid
-from typing import Optional, Tuple
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
 import jwt
 from .config import CONFIG
 
 from .database import regUser, vaildPassword, vaildUserIfExists
+from .unit import perProcess
 
 
 
@@ -29,19 +32,97 @@ def generateToken(username: str, exp: int = time.time().__int__() + 86400) -> st
     return jwt.encode({"exp": exp, "id": generateUUID(username), "name": username}, 'pas', algorithm="HS256")
 
 
+class tokenCache():
+    '''已验证 token 的 LRU 缓存：有效 token 缓存至 min(exp, 当前时间 + ttl)，验证失败的 token 缓存 negative_ttl 秒；\n
+    有效与无效条目分开计数上限，大量无效 token 不会挤出有效 token'''
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[int] = None, negative_ttl: Optional[int] = None):
+        self.max_entries: int = CONFIG.TOKEN_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl: int = CONFIG.TOKEN_CACHE_TTL if ttl is None else ttl
+        self.negative_ttl: int = CONFIG.TOKEN_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        # token -> (is_vaild, username or failed_message, expires_at)
+        self._entries: 'OrderedDict[str, Tuple[bool, str, float]]' = OrderedDict()
+        self._negative_entries: 'OrderedDict[str, Tuple[bool, str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.negative_hits = self.misses = 0
+
+    def get(self, token: str) -> Optional[Tuple[bool, str]]:
+        now = time.time()
+        with self._lock:
+            for entries in (self._entries, self._negative_entries):
+                entry = entries.get(token)
+                if entry is None:
+                    continue
+                if entry[2] <= now:
+                    del entries[token]
+                    break
+                entries.move_to_end(token)
+                if entry[0]:
+                    self.hits += 1
+                else:
+                    self.negative_hits += 1
+                return entry[:2]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, result: Tuple[bool, str], exp: Optional[float] = None) -> Tuple[bool, str]:
+        '''exp: the `exp` claim of a vaild token. Returns `result`'''
+        if self.max_entries <= 0:
+            return result
+        now = time.time()
+        if not result[0]:
+            expires_at = now + self.negative_ttl
+        else:
+            expires_at = now + self.ttl if exp is None else min(now + self.ttl, exp)
+        if expires_at <= now:
+            return result
+        entries = self._entries if result[0] else self._negative_entries
+        with self._lock:
+            entries[token] = (*result, expires_at)
+            entries.move_to_end(token)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "hits": self.hits,
+                "negativeHits": self.negative_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "negativeEntries": len(self._negative_entries),
+            }
+
+
+_token_cache = perProcess(tokenCache)
+
+
+def getTokenCache() -> tokenCache:
+    '''Return the shared token cache of the current process'''
+    return _token_cache.get()
+
+
 def vaildToken(token: Optional[str]) -> Tuple[bool, str]:
-    '''Return: is_vaild, username or failed_message'''
+    '''Return: is_vaild, username or failed_message\n
+    The results of JWT verification are cached by `tokenCache`'''
     if token is None:
         return False, 'Token required'
     if token == CONFIG.API_TOKEN:
         return True, 'valid'
+    _cache = getTokenCache()
+    _cached = _cache.get(token)
+    if _cached is not None:
+        return _cached
     try:
         decoded = jwt.decode(token, 'pas', algorithms=['HS256'])
-        return True, decoded['name']
+        return _cache.put(token, (True, decoded['name']), decoded.get('exp'))
     except jwt.ExpiredSignatureError:
-        return False, 'Token expired'
+        return _cache.put(token, (False, 'Token expired'))
     except jwt.InvalidTokenError:
-        return False, 'Token invalid'
+        return _cache.put(token, (False, 'Token invalid'))
 
 
 def addUser():
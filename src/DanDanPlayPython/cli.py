@@ -2,7 +2,6 @@ import os
 from typing import Any, Optional, Sequence, Tuple
 
 import click
-from var_dump import var_dump
 
 
 @click.group()
@@ -28,8 +27,21 @@ def init():
 @CLI.command()
 @click.option('--host', '-h', default='0.0.0.0', help='监听地址')
 @click.option('--port', '-p', default=5000, help='监听端口')
-def run(host, port):
-    '''运行 API 服务，可选参数：--host（默认为0.0.0.0），--port（默认为5000）'''
+@click.option('--production/--development', 'production', default=None, help='以多进程的生产模式或 Flask 开发服务器运行，默认由 SERVER_MODE 决定')
+@click.option('--workers', '-w', type=int, default=None, help='生产模式的工作进程数')
+@click.option('--threads', '-t', type=int, default=None, help='生产模式下每个工作进程的线程数')
+def run(host, port, production, workers, threads):
+    '''运行 API 服务，可选参数：--host（默认为0.0.0.0），--port（默认为5000），--production/--development，--workers，--threads'''
+    if production is None:
+        from .config import CONFIG
+        production = CONFIG.SERVER_MODE == 'production'
+    if production:
+        from .server import productionServerAvailable, runProduction
+        if not productionServerAvailable():
+            click.echo(click.style('生产模式需要 gunicorn，请执行 pip install DanDanPlayPython[server]', fg='red'))
+            raise SystemExit(1)
+        runProduction(host, port, workers, threads)
+        return
     from .app import run as _run
     _run(host, port)
 
@@ -49,14 +61,17 @@ def config():
 def add(path: str, show_faild:bool = False, silent:bool = False):
     '''向数据库中增加视频，参数：Path（可为单文件路径或目录路径），可选参数：--show-faild、--silent'''
     from .video import pushVideoBaseInfo2DB
-    from .database import getAllVideos
-    bf = len(getAllVideos())
+    from .database import getVideoCount
+    bf = getVideoCount()
     is_dir = os.path.isdir(path)
-    state, faileds = pushVideoBaseInfo2DB(path, show_progress=((not silent) and is_dir), is_dir=is_dir)
-    succeed = len(getAllVideos()) - bf
+    scan_results = []
+    state, faileds = pushVideoBaseInfo2DB(path, show_progress=((not silent) and is_dir), is_dir=is_dir, on_scan=scan_results.append)
+    # 目录中已删除的文件会同时从数据库中移除
+    removed = len(scan_results[0].removed) if scan_results else 0
+    succeed = getVideoCount() - bf + removed
     if silent:
         return
-    click.echo(f'\n本次成功添加 {succeed} 个视频，' + ('无失败项目。' if state else f'其中跳过 {len(faileds)} 个。') + ('' if show_faild else '\n若要查看跳过项目，请附带 --show-faild'))
+    click.echo(f'\n本次成功添加 {succeed} 个视频，' + ('无失败项目。' if state else f'其中跳过 {len(faileds)} 个。') + (f'移除 {removed} 个已不存在的视频。' if removed else '') + ('' if show_faild else '\n若要查看跳过项目，请附带 --show-faild'))
     if show_faild:
         click.echo('跳过的项目：\n'+'\n'.join(faileds)+'\n')
 
@@ -140,6 +155,18 @@ def match(silent:bool = False, show_detail:bool = False, manual:bool = False):
                             break
 
 
+@CLI.command()
+@click.option('--cover', 'cover', flag_value=True)
+@click.option('--sprite', 'sprite', flag_value=True)
+@click.option('--silent', 'silent', flag_value=True)
+def thumbnail(cover:bool = False, sprite:bool = False, silent:bool = False):
+    '''为已匹配的视频创建缩略图，可选参数：--cover（覆盖已有缩略图）、--sprite（同时创建拖动预览雪碧图）、--silent'''
+    from .video import createSprites, createThumbnail
+    createThumbnail(None, show_progress=not silent, cover=cover)
+    if sprite:
+        createSprites(show_progress=not silent, cover=cover)
+
+
 @CLI.command()
 @click.argument('sub_command')
 def db(sub_command):
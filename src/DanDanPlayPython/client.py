@@ -0,0 +1,111 @@
+import email.utils
+import html
+import json
+import random
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from .config import CONFIG
+from .unit import perProcess
+
+urllib3.disable_warnings()
+
+_RETRY_STATUS = frozenset((429, 500, 502, 503, 504))
+_BACKOFF_BASE = 0.5
+_BACKOFF_CAP = 30.0
+
+
+class rateLimiter():
+    '''令牌桶限速器，rate 为每秒请求数，为 0 时不限速'''
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = max(1, int(rate)) if burst is None else burst
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _parseRetryAfter(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class DanDanPlayClient():
+    '''DanDanPlay API 客户端：共享带连接池的 `requests.Session`，所有请求带连接/读取超时，\n
+    连接错误、超时与 429/5xx 响应按带抖动的指数退避重试（优先使用 Retry-After），并经过全局限速'''
+
+    def __init__(self, base_url: Optional[str] = None, pool_size: Optional[int] = None, timeout: Optional[Tuple[float, float]] = None, max_retries: Optional[int] = None, rate_limit: Optional[float] = None, verify: bool = False):
+        self.base_url = (CONFIG.DANDANPLAY_API_URL if base_url is None else base_url).rstrip('/')
+        self.timeout = (CONFIG.API_CONNECT_TIMEOUT, CONFIG.API_READ_TIMEOUT) if timeout is None else timeout
+        self.max_retries: int = CONFIG.API_MAX_RETRIES if max_retries is None else max_retries
+        self.verify = verify
+        self.limiter = rateLimiter(CONFIG.API_RATE_LIMIT if rate_limit is None else rate_limit)
+        pool_size = max(CONFIG.DANMU_DOWNLOAD_THREAD_NUM, CONFIG.MATCH_VIDEO_THREAD_NUM) if pool_size is None else pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+
+    def request(self, method: str, path: str, **kw) -> requests.Response:
+        '''Return the response, raise `requests.RequestException` when all retries failed'''
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, f'{self.base_url}{path}', timeout=self.timeout, verify=self.verify, **kw)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            if response.status_code not in _RETRY_STATUS:
+                return response
+            if attempt == self.max_retries:
+                response.raise_for_status()
+            _retry_after = _parseRetryAfter(response.headers.get('Retry-After'))
+            response.close()
+            time.sleep(min(_BACKOFF_CAP, _retry_after) if _retry_after is not None else self._backoff(attempt))
+        raise requests.exceptions.RetryError(f'{method} {path}')
+
+    def requestJSON(self, method: str, path: str, **kw) -> Any:
+        '''Same as `request`, but decode the html-escaped JSON body'''
+        return json.loads(html.unescape(self.request(method, path, **kw).content.decode('utf-8')))
+
+
+_client = perProcess(DanDanPlayClient)
+
+
+def getClient() -> DanDanPlayClient:
+    '''Return the shared client of the current process'''
+    return _client.get()
@@ -1,11 +1,12 @@
+import functools
 import os
 import secrets
+import threading
 from shutil import which
 from typing import Any, Optional, Tuple
 
 import click
 import yaml
-from var_dump import var_dump
 
 from .unit import *
 from .__version__ import VERSION as _VERSION
@@ -13,8 +14,14 @@ from .__version__ import VERSION as _VERSION
 CONFIG_PATH = os.path.join(os.path.expanduser('~'), '.config', 'DanDanPlay-Python', 'config.yml')
 
 
+@functools.lru_cache(maxsize=None)
+def _defaultConfigs() -> dict:
+    '''必填配置项，首次调用时才查找 ffmpeg'''
+    return {'FFMPEG_PATH': (which('ffmpeg') or '/usr/bin/ffmpeg', '`ffmpeg`可执行文件绝对路径'), **_default_configs}
+
+
+# FFMPEG_PATH 的默认值由 `_defaultConfigs` 补充
 _default_configs = {
-    'FFMPEG_PATH': ('/usr/bin/ffmpeg' if which('ffmpeg') is None else which('ffmpeg'), '`ffmpeg`可执行文件绝对路径'),
     'DATA_PATH': ('/var/DanDanPlay-Python', '数据存放根路径，绝对路径'),
     'DB_PATH': ('ddppy.sqlite', '数据库路径，相对于数据根路径'),
     'DANMU_PATH': ('danmu', '弹幕文件存放路径，相对于数据根路径'),
@@ -30,6 +37,49 @@ _default_configs = {
     'API_TOKEN_REQUIRED': (False, 'API访问是否需要密钥')
 }
 
+# 可选配置项：缺失时使用默认值，不会要求重新初始化
+_optional_configs = {
+    'METADATA_PROCESS_NUM': (0, '视频时长解析使用进程数，若为0则在入库线程中解析'),
+    'METADATA_BATCH_SIZE': (16, '视频时长解析每批交给单个进程的文件数'),
+    'PUSH_VIDEO_BATCH_SIZE': (64, '视频入库每批写入数据库的数量'),
+    'DANDANPLAY_API_URL': ('https://api.dandanplay.net', 'DanDanPlay API 地址'),
+    'API_CONNECT_TIMEOUT': (5, 'DanDanPlay API 连接超时秒数'),
+    'API_READ_TIMEOUT': (30, 'DanDanPlay API 读取超时秒数'),
+    'API_MAX_RETRIES': (5, 'DanDanPlay API 请求失败后的最大重试次数'),
+    'API_RATE_LIMIT': (20, 'DanDanPlay API 每秒最大请求数，若为0则不限速'),
+    'MATCH_VIDEO_BATCH_SIZE': (32, '视频批量匹配每批数量（最大32），若为0则逐个匹配'),
+    'NETWORK_ENGINE': ('thread', '匹配与弹幕下载的网络引擎，可选 thread 或 asyncio（需安装 aiohttp，未安装时回退到 thread）'),
+    'ASYNC_CONCURRENCY': (64, 'asyncio 引擎的最大并发请求数'),
+    'DANMU_CACHE_PATH': ('danmu_cache', '渲染后弹幕缓存存放路径，相对于数据根路径'),
+    'DANMU_CACHE_SIZE': (32, '内存中缓存的渲染后弹幕数量，若为0则仅使用磁盘缓存'),
+    'DANMU_CACHE_GZIP': (True, '渲染后弹幕缓存是否使用gzip压缩'),
+    'DANMU_STORAGE': ('json', '弹幕存储格式，可选 json（原始数据）或 binary（紧凑的列式二进制格式，支持按时间段读取）'),
+    'DANMU_REFRESH_INTERVAL': (21600, '增量刷新弹幕时，距上次刷新不足该秒数的剧集将被跳过'),
+    'DANMU_SCHEDULER_ENABLE': (True, 'API 服务运行时是否在后台预取与刷新弹幕'),
+    'DANMU_SCHEDULER_INTERVAL': (600, '后台预取与刷新弹幕的间隔秒数'),
+    'DANMU_REFRESH_WATCHED_DAYS': (7, '后台刷新弹幕时，仅刷新该天数内观看过的剧集'),
+    'DANMU_WAIT_TIMEOUT': (10, '即时获取弹幕时请求的最长等待秒数，超时返回 202 由客户端重试'),
+    'THUMBNAIL_QUEUE_WORKERS': (2, 'API 服务即时创建缩略图时同时运行的 ffmpeg 进程数'),
+    'THUMBNAIL_WAIT_TIMEOUT': (3, '即时创建缩略图时请求的最长等待秒数，超时返回 202 由客户端重试'),
+    'THUMBNAIL_FFMPEG_THREADS': (1, '每个 ffmpeg 缩略图进程使用的线程数，若为0则由 ffmpeg 自动决定'),
+    'THUMBNAIL_EXTRA_SIZES': ([], '同一次解码中额外生成的缩略图尺寸列表，如 ["800*450", "200*112"]'),
+    'SPRITE_INTERVAL': (10, '拖动预览雪碧图中相邻两帧的间隔秒数'),
+    'SPRITE_TILE_SIZE': ('160*90', '拖动预览雪碧图中每帧的尺寸'),
+    'SPRITE_COLUMNS': (10, '拖动预览雪碧图每张的列数'),
+    'SPRITE_ROWS': (10, '拖动预览雪碧图每张的行数'),
+    'WATCH_FLUSH_INTERVAL': (10, '观看记录在内存中合并后写入数据库的间隔秒数'),
+    'SERVER_MODE': ('development', 'API 服务的运行方式，可选 development（Flask 开发服务器）或 production（多进程 gunicorn，需安装 gunicorn）'),
+    'SERVER_WORKERS': (0, '生产模式的工作进程数，为 0 时取 CPU 核心数'),
+    'SERVER_THREADS': (8, '生产模式下每个工作进程的线程数'),
+    'SERVER_BACKLOG': (2048, '生产模式下监听队列的长度'),
+    'SERVER_KEEPALIVE': (5, '生产模式下 Keep-Alive 连接的空闲超时秒数'),
+    'SERVER_TIMEOUT': (60, '生产模式下工作进程无响应多少秒后被重启'),
+    'SERVER_GRACEFUL_TIMEOUT': (30, '生产模式下停止或重载时等待请求完成的秒数'),
+    'TOKEN_CACHE_SIZE': (1024, '已验证 token 的缓存条目数，为 0 时不缓存'),
+    'TOKEN_CACHE_TTL': (300, '有效 token 的缓存秒数，不会超过 token 自身的过期时间'),
+    'TOKEN_NEGATIVE_TTL': (5, '验证失败的 token 的缓存秒数'),
+}
+
 class ConfigNum(click.ParamType):
     name = 'ConfigNum'
 
@@ -39,8 +89,8 @@ class ConfigNum(click.ParamType):
     def convert(self, value: Any, param: Optional[click.Parameter], ctx: Optional[click.Context]) -> Any:
         if not any((value.isdigit(), value == '-1')):
             self.fail('输入有误，请重试')
-        if int(value) not in range(-1, len(_default_configs) + 1):
-            self.fail(f'序号超出范围，请输入0-{len(_default_configs)-1}', param, ctx)
+        if int(value) not in range(-1, len(_defaultConfigs()) + len(_optional_configs) + 1):
+            self.fail(f'序号超出范围，请输入0-{len(_defaultConfigs()) + len(_optional_configs)}', param, ctx)
         value = int(value)
         return super().convert(value, param, ctx)
 
@@ -63,10 +113,51 @@ class Config():
     THUMBNAIL_ENABLE_WEBP: bool
     THUMBNAIL_INSTANT_CREATE: bool
     API_TOKEN_REQUIRED: bool
+    METADATA_PROCESS_NUM: int
+    METADATA_BATCH_SIZE: int
+    PUSH_VIDEO_BATCH_SIZE: int
+    DANDANPLAY_API_URL: str
+    API_CONNECT_TIMEOUT: float
+    API_READ_TIMEOUT: float
+    API_MAX_RETRIES: int
+    API_RATE_LIMIT: float
+    MATCH_VIDEO_BATCH_SIZE: int
+    NETWORK_ENGINE: str
+    ASYNC_CONCURRENCY: int
+    DANMU_CACHE_PATH: str
+    DANMU_CACHE_SIZE: int
+    DANMU_CACHE_GZIP: bool
+    DANMU_STORAGE: str
+    DANMU_REFRESH_INTERVAL: int
+    DANMU_SCHEDULER_ENABLE: bool
+    DANMU_SCHEDULER_INTERVAL: int
+    DANMU_REFRESH_WATCHED_DAYS: int
+    DANMU_WAIT_TIMEOUT: float
+    THUMBNAIL_QUEUE_WORKERS: int
+    THUMBNAIL_WAIT_TIMEOUT: float
+    THUMBNAIL_FFMPEG_THREADS: int
+    THUMBNAIL_EXTRA_SIZES: list
+    SPRITE_INTERVAL: int
+    SPRITE_TILE_SIZE: str
+    SPRITE_COLUMNS: int
+    SPRITE_ROWS: int
+    WATCH_FLUSH_INTERVAL: int
+    SERVER_MODE: str
+    SERVER_WORKERS: int
+    SERVER_THREADS: int
+    SERVER_BACKLOG: int
+    SERVER_KEEPALIVE: int
+    SERVER_TIMEOUT: int
+    SERVER_GRACEFUL_TIMEOUT: int
+    TOKEN_CACHE_SIZE: int
+    TOKEN_CACHE_TTL: int
+    TOKEN_NEGATIVE_TTL: int
 
     _config: dict = {}
 
     def __init__(self):
+        for i, j in _optional_configs.items():
+            setattr(self, i, j[0])
         os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
         try:
             with open(CONFIG_PATH, 'r') as c:
@@ -89,6 +180,11 @@ class Config():
         self.DB_PATH = os.path.join(self.DATA_PATH, self.DB_PATH)
         self.DANMU_PATH = os.path.join(self.DATA_PATH, self.DANMU_PATH)
         self.THUMBNAIL_PATH = os.path.join(self.DATA_PATH, self.THUMBNAIL_PATH)
+        self.DANMU_CACHE_PATH = os.path.join(self.DATA_PATH, self.DANMU_CACHE_PATH)
+        if isinstance(self.THUMBNAIL_EXTRA_SIZES, str):
+            # `config` 命令写入的是字符串，如 "800*450, 200*112"
+            _sizes = yaml.safe_load(self.THUMBNAIL_EXTRA_SIZES)
+            self.THUMBNAIL_EXTRA_SIZES = _sizes if isinstance(_sizes, list) else [each.strip() for each in self.THUMBNAIL_EXTRA_SIZES.split(',') if each.strip()]
         self.THUMBNAIL_SUFFIX = '.webp' if self.THUMBNAIL_ENABLE_WEBP else '.jpg'
         self.THUMBNAIL_FORMAT = 'webp' if self.THUMBNAIL_ENABLE_WEBP else 'mjpeg'
         self.ONCE_SECRET = secrets.token_hex(32)
@@ -99,10 +195,41 @@ class Config():
         assert self.DANMU_DOWNLOAD_THREAD_NUM >= 1, '`DANMU_DOWNLOAD_THREAD_NUM` 至少为 1'
         assert isinstance(self.THUMBNAIL_ENABLE_WEBP, bool), '`THUMBNAIL_ENABLE_WEBP` 必须是布尔值'
         assert self.THUMBNAIL_THREAD_NUM >= 1, '`THUMBNAIL_THREAD_NUM` 至少为 1'
+        assert self.METADATA_PROCESS_NUM >= 0, '`METADATA_PROCESS_NUM` 至少为 0'
+        assert self.METADATA_BATCH_SIZE >= 1, '`METADATA_BATCH_SIZE` 至少为 1'
+        assert self.PUSH_VIDEO_BATCH_SIZE >= 1, '`PUSH_VIDEO_BATCH_SIZE` 至少为 1'
+        assert self.API_MAX_RETRIES >= 0, '`API_MAX_RETRIES` 至少为 0'
+        assert self.API_RATE_LIMIT >= 0, '`API_RATE_LIMIT` 至少为 0'
+        assert 0 <= self.MATCH_VIDEO_BATCH_SIZE <= 32, '`MATCH_VIDEO_BATCH_SIZE` 应在 0-32 之间'
+        assert self.NETWORK_ENGINE in ('thread', 'asyncio'), '`NETWORK_ENGINE` 应为 thread 或 asyncio'
+        assert self.ASYNC_CONCURRENCY >= 1, '`ASYNC_CONCURRENCY` 至少为 1'
+        assert self.DANMU_CACHE_SIZE >= 0, '`DANMU_CACHE_SIZE` 至少为 0'
+        assert isinstance(self.DANMU_CACHE_GZIP, bool), '`DANMU_CACHE_GZIP` 必须是布尔值'
+        assert self.DANMU_STORAGE in ('json', 'binary'), '`DANMU_STORAGE` 应为 json 或 binary'
+        assert self.DANMU_REFRESH_INTERVAL >= 0, '`DANMU_REFRESH_INTERVAL` 至少为 0'
+        assert isinstance(self.DANMU_SCHEDULER_ENABLE, bool), '`DANMU_SCHEDULER_ENABLE` 必须是布尔值'
+        assert self.DANMU_SCHEDULER_INTERVAL >= 1, '`DANMU_SCHEDULER_INTERVAL` 至少为 1'
+        assert self.DANMU_REFRESH_WATCHED_DAYS >= 0, '`DANMU_REFRESH_WATCHED_DAYS` 至少为 0'
+        assert self.DANMU_WAIT_TIMEOUT >= 0, '`DANMU_WAIT_TIMEOUT` 至少为 0'
+        assert self.THUMBNAIL_QUEUE_WORKERS >= 1, '`THUMBNAIL_QUEUE_WORKERS` 至少为 1'
+        assert self.THUMBNAIL_WAIT_TIMEOUT >= 0, '`THUMBNAIL_WAIT_TIMEOUT` 至少为 0'
+        assert self.THUMBNAIL_FFMPEG_THREADS >= 0, '`THUMBNAIL_FFMPEG_THREADS` 至少为 0'
+        assert isinstance(self.THUMBNAIL_EXTRA_SIZES, list), '`THUMBNAIL_EXTRA_SIZES` 必须是列表'
+        assert self.SPRITE_INTERVAL >= 1, '`SPRITE_INTERVAL` 至少为 1'
+        assert self.SPRITE_COLUMNS >= 1 and self.SPRITE_ROWS >= 1, '`SPRITE_COLUMNS` 与 `SPRITE_ROWS` 至少为 1'
+        assert self.WATCH_FLUSH_INTERVAL >= 1, '`WATCH_FLUSH_INTERVAL` 至少为 1'
+        assert self.SERVER_MODE in ('development', 'production'), '`SERVER_MODE` 应为 development 或 production'
+        assert self.SERVER_WORKERS >= 0, '`SERVER_WORKERS` 至少为 0'
+        assert self.SERVER_THREADS >= 1, '`SERVER_THREADS` 至少为 1'
+        assert self.SERVER_BACKLOG >= 1, '`SERVER_BACKLOG` 至少为 1'
+        assert self.SERVER_KEEPALIVE >= 0, '`SERVER_KEEPALIVE` 至少为 0'
+        assert self.SERVER_TIMEOUT >= 0 and self.SERVER_GRACEFUL_TIMEOUT >= 0, '`SERVER_TIMEOUT` 与 `SERVER_GRACEFUL_TIMEOUT` 至少为 0'
+        assert self.TOKEN_CACHE_SIZE >= 0, '`TOKEN_CACHE_SIZE` 至少为 0'
+        assert self.TOKEN_CACHE_TTL >= 0 and self.TOKEN_NEGATIVE_TTL >= 0, '`TOKEN_CACHE_TTL` 与 `TOKEN_NEGATIVE_TTL` 至少为 0'
 
     def implicitCheck(self) -> Tuple[bool, str]:
         # 检查配置是否齐全
-        _difference = tuple(c for c in _default_configs if c not in set(self._config))
+        _difference = tuple(c for c in _defaultConfigs() if c not in set(self._config))
         if not len(_difference) == 0:
             return False, '配置缺失：\n' + '、 '.join(_difference) + '请运行 `dandanplay-python init` 重新进行初始化。\n'
         if self._config['API_TOKEN_REQUIRED'] and self._config.get('API_TOKEN', None) is None and os.environ.get('CONFIGING', 'False') != 'True':
@@ -129,14 +256,13 @@ class Config():
 
     def edit(self):
         api_token = ('API_TOKEN', (self._config.get('API_TOKEN', None), 'API访问密钥'))
-        # var_dump(list(enumerate(_default_configs.items()))); var_dump(api_token);exit()
-        click.echo('\n'.join(f"{n} - {j[1][1].split('，')[0]}：{self._config[j[0]]}" for n, j in (*enumerate(_default_configs.items()), (len(_default_configs), api_token))) + '\n')
+        _items = (*_defaultConfigs().items(), *_optional_configs.items(), api_token)
+        click.echo('\n'.join(f"{n} - {j[1][1].split('，')[0]}：{self._config.get(j[0], j[1][0])}" for n, j in enumerate(_items)) + '\n')
         num = click.prompt('请输入配置项前的编号进行选择，输入-1退出', default=-1, show_default=False, value_proc=ConfigNum())
         click.clear()
         if num == -1:
             click.echo('已退出配置！')
             return
-        _items = (*_default_configs.items(), api_token)
         value = click.prompt(_items[num][1][1], default=_items[num][1][0], type=AbsPath() if os.path.isabs(f'{_items[num][1][0]}') else None)
         self._config[_items[num][0]] = value
         self.dump()
@@ -145,6 +271,14 @@ class Config():
         os.environ['CONFIGING'] = 'False'
 
 
+_config_lock = threading.Lock()
+
 
-if __name__ == 'DanDanPlayPython.config':
-    CONFIG = Config()
+def __getattr__(name: str) -> Any:
+    '''`CONFIG` 在首次访问时才创建（读取配置文件并校验），之后缓存在模块中'''
+    if name != 'CONFIG':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _config_lock:
+        if 'CONFIG' not in globals():
+            globals()['CONFIG'] = Config()
+    return globals()['CONFIG']
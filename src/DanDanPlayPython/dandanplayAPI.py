@@ -1,51 +1,44 @@
-import html
 import json
 import os
-import threading
+import tempfile
 import time
-import xml.etree.cElementTree as ET
-from typing import List, Optional, Sequence, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
 
 import requests
 import tqdm
-import urllib3
 
+from .client import getClient
 from .config import CONFIG
-from .database import addBindingsIntoDB, getAllUnBindedVideos
-from .unit import universeThread, videoBaseInfoTuple, videoBindInfoTuple
+from .danmuStore import parseComment, readDanmuStore, writeDanmuStore
+from .database import addBindingsIntoDB, getAllUnBindedVideos, getDanmuStates, updateDanmuStates
+from .unit import universeExecutor, videoBaseInfoTuple, videoBindInfoTuple
 
-from var_dump import var_dump
 
-
-urllib3.disable_warnings()
-
-
-def queryDandanPlay(_videoBaseInfoTuple: videoBaseInfoTuple) -> Tuple[bool, Optional[Union[videoBindInfoTuple, Tuple[videoBindInfoTuple, ...]]]]:
-    '''If matched, return a tuple of (True, videoBindInfoTuple),\n 
-    otherwise return a tuple of (False, Tuple[videoBindInfoTuple] | None)
-    '''
-    _apiurl = 'https://api.dandanplay.net/api/v2/match'
-    _data = {
+def generateMatchRequest(_videoBaseInfoTuple: videoBaseInfoTuple) -> dict:
+    return {
         "fileName": _videoBaseInfoTuple.fileName,
         "fileHash": _videoBaseInfoTuple.hash,
         "fileSize": _videoBaseInfoTuple.fileSize,
         "videoDuration": _videoBaseInfoTuple.videoDuration,
         "matchMode": "hashAndFileName"
     }
-    for _ in range(3):
-        #TODO: Logging
-        try:
-            _context = requests.post(_apiurl, json=_data, verify=False)
-            _dict = json.loads(html.unescape(_context.content.decode('utf-8')))
-            break
-        except requests.exceptions.ConnectTimeout:
-            time.sleep(1)
-            continue
-        except json.JSONDecodeError:
-            time.sleep(1)
-            continue
-    else:
+
+
+def queryDandanPlay(_videoBaseInfoTuple: videoBaseInfoTuple) -> Tuple[bool, Optional[Union[videoBindInfoTuple, Tuple[videoBindInfoTuple, ...]]]]:
+    '''If matched, return a tuple of (True, videoBindInfoTuple),\n 
+    otherwise return a tuple of (False, Tuple[videoBindInfoTuple] | None)
+    '''
+    #TODO: Logging
+    try:
+        _dict = getClient().requestJSON('POST', '/api/v2/match', json=generateMatchRequest(_videoBaseInfoTuple))
+    except (requests.exceptions.RequestException, json.JSONDecodeError):
         return False, None
+    return parseMatchResponse(_dict)
+
+
+def parseMatchResponse(_dict: dict) -> Tuple[bool, Optional[Union[videoBindInfoTuple, Tuple[videoBindInfoTuple, ...]]]]:
+    '''Returns: the same as `queryDandanPlay`'''
     if not _dict['success']:
         raise LookupError(_dict['errorMessage'])
     if _dict['isMatched']:
@@ -54,93 +47,210 @@ def queryDandanPlay(_videoBaseInfoTuple: videoBaseInfoTuple) -> Tuple[bool, Opti
         return False, tuple(videoBindInfoTuple(**eachMatch) for eachMatch in _dict['matches'])
 
 
-def singleThreadDownloadDanmu(_from: int, with_related:bool, ch_convert:int, skips:List, eachVideoBindInfoTuple:videoBindInfoTuple, danmu_file_path) -> None:
-    for _ in range(3):
-        try:
-            _apiurl = f'https://api.dandanplay.net/api/v2/comment/{eachVideoBindInfoTuple.episodeId}?from={_from}&withRelated={with_related}&chConvert={ch_convert}'
-            _rep = requests.get(_apiurl, verify=False)
-            _rep.json()
-            break
-        except requests.exceptions.Timeout:
-            continue
-        except requests.exceptions.InvalidJSONError:
-            continue
-    else:
-        skips.append(eachVideoBindInfoTuple)
-        return
+def batchQueryDandanPlay(_videoBaseInfoTuples: Sequence[videoBaseInfoTuple]) -> Dict[str, Optional[videoBindInfoTuple]]:
+    '''Match at most 32 videos in one request,\n
+    return a dict of {hash: videoBindInfoTuple | None}, the batch API only returns exact matches.\n
+    Raise if the whole batch failed'''
+    _dict = getClient().requestJSON('POST', '/api/v2/match/batch', json={'requests': [generateMatchRequest(eachTuple) for eachTuple in _videoBaseInfoTuples]})
+    if not _dict['success']:
+        raise LookupError(_dict['errorMessage'])
+    return {
+        eachResult['fileHash']: videoBindInfoTuple(**{i: j for i, j in eachResult['matchResult'].items() if i in videoBindInfoTuple._fields})
+        if eachResult.get('success') and eachResult.get('matchResult') else None
+        for eachResult in _dict['results']
+    }
+
+
+def getDanmuFilePath(episodeId: int) -> str:
+    '''Return the danmu file path of the episode according to `DANMU_STORAGE`'''
+    return os.path.join(CONFIG.DANMU_PATH, f'{episodeId}.ddb' if CONFIG.DANMU_STORAGE == 'binary' else f'{episodeId}.json')
+
+
+def _writeFileAtomic(file_path: str, context: str) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(context)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def saveDanmu(episodeId: int, content: bytes, danmu_file_path: str, merge: bool = False) -> bool:
+    '''Write the danmu response to the file atomically and record its `DanmuState`,\n
+    return False if the content is not valid JSON or failed to write.\n
+    merge: If True, only the comments not in the existing file are appended.\n
+    If the path ends with `.ddb`, the comments are written in the binary store format'''
     try:
-        _context = _rep.content.decode('utf-8')
-        with open(danmu_file_path, 'w', encoding='utf-8') as f:
-            f.write(_context)
+        _context = content.decode('utf-8')
+        _comments = json.loads(_context)['comments']
+        merge = merge and os.path.exists(danmu_file_path)
+        if danmu_file_path.endswith('.ddb'):
+            _records = [parseComment(eachDanmu) for eachDanmu in _comments]
+            if merge:
+                _existing = list(readDanmuStore(danmu_file_path))
+                _cids = {_record[0] for _record in _existing}
+                _records = [_record for _record in _records if _record[0] not in _cids]
+                _news, _records = len(_records), _existing + _records
+            if not merge or _news:
+                writeDanmuStore(danmu_file_path, _records)
+            _cids = {_record[0] for _record in _records}
+        else:
+            if merge:
+                with open(danmu_file_path, 'r', encoding='utf-8') as f:
+                    _existing = json.load(f)['comments']
+                _cids = {eachDanmu.get('cid', 0) for eachDanmu in _existing}
+                _comments = [eachDanmu for eachDanmu in _comments if eachDanmu.get('cid', 0) not in _cids]
+                _news, _comments = len(_comments), _existing + _comments
+                _context = json.dumps({'count': len(_comments), 'comments': _comments}, ensure_ascii=False)
+            if not merge or _news:
+                _writeFileAtomic(danmu_file_path, _context)
+            _cids = {eachDanmu.get('cid', 0) for eachDanmu in _comments}
+        updateDanmuStates(((episodeId, max(_cids, default=0), len(_cids), int(time.time())),))
     except Exception:
-        skips.append(eachVideoBindInfoTuple)
+        return False
+    return True
+
+
+def getDanmuRequestFrom(eachVideoBindInfoTuple: videoBindInfoTuple, _from: int, incremental: bool) -> Tuple[int, bool]:
+    '''Returns: [0] the `from` parameter of the request, [1] whether the response should be merged into the existing file'''
+    if not incremental or not os.path.exists(getDanmuFilePath(eachVideoBindInfoTuple.episodeId)):
+        return _from, False
+    _state = getDanmuStates((eachVideoBindInfoTuple.episodeId,)).get(eachVideoBindInfoTuple.episodeId)
+    return (_from, True) if _state is None else (max(_from, _state[0]), True)
+
+
+def singleThreadDownloadDanmu(_from: int, with_related:bool, ch_convert:int, eachVideoBindInfoTuple:videoBindInfoTuple, danmu_file_path, incremental: bool = False) -> bool:
+    '''Return True if the danmu file is written, otherwise False.\n
+    incremental: If True, only request the comments newer than the stored ones and merge them'''
+    _from, merge = getDanmuRequestFrom(eachVideoBindInfoTuple, _from, incremental)
+    try:
+        _rep = getClient().request('GET', f'/api/v2/comment/{eachVideoBindInfoTuple.episodeId}', params={'from': _from, 'withRelated': with_related, 'chConvert': ch_convert})
+    except requests.exceptions.RequestException:
+        return False
+    return saveDanmu(eachVideoBindInfoTuple.episodeId, _rep.content, danmu_file_path, merge)
 
 
-def multiThreadDownloadDanmuFromDandanPlay(_videoBindInfoTuple:Sequence[videoBindInfoTuple], _from: int, with_related: bool, ch_convert: int, update:bool, show_progress:bool) -> Tuple[bool, Tuple]:
-    locks = [threading.Lock() for _ in range(CONFIG.THUMBNAIL_THREAD_NUM)]
+def multiThreadDownloadDanmuFromDandanPlay(_videoBindInfoTuple:Sequence[videoBindInfoTuple], _from: int, with_related: bool, ch_convert: int, update:bool, show_progress:bool, incremental: bool = False) -> Tuple[bool, Tuple]:
     tqdm_obj = tqdm.tqdm(_videoBindInfoTuple) if show_progress else None
-    skips:List[videoBindInfoTuple] = []
-    for eachVideoBindInfoTuple in _videoBindInfoTuple:
-        danmu_file_path = os.path.join(CONFIG.DANMU_PATH, f'{eachVideoBindInfoTuple.episodeId}.json')
-        _name = f'{eachVideoBindInfoTuple.animeTitle} - {eachVideoBindInfoTuple.episodeTitle}'
-        if(not update and os.path.exists(danmu_file_path)):
-            if tqdm_obj is not None:
-                tqdm_obj.set_description(_name)  # type: ignore
-                tqdm_obj.update()
-            continue
-        while all(lock.locked() for lock in locks):
-            time.sleep(0.1)
-        lock = [lock for lock in locks if not lock.locked()][0]
-        universeThread(_name, singleThreadDownloadDanmu, lock, _from, with_related, ch_convert, skips, eachVideoBindInfoTuple, danmu_file_path, tqdm_obj=tqdm_obj).start()
-    [lock.acquire(blocking=True) for lock in locks]
-    return bool(skips), tuple(skips)
+    futures = []
+    with universeExecutor(CONFIG.DANMU_DOWNLOAD_THREAD_NUM, tqdm_obj) as executor:
+        for eachVideoBindInfoTuple in _videoBindInfoTuple:
+            danmu_file_path = getDanmuFilePath(eachVideoBindInfoTuple.episodeId)
+            _name = f'{eachVideoBindInfoTuple.animeTitle} - {eachVideoBindInfoTuple.episodeTitle}'
+            if(not update and os.path.exists(danmu_file_path)):
+                executor.progress(_name)
+                continue
+            futures.append((eachVideoBindInfoTuple, executor.submit(_name, singleThreadDownloadDanmu, _from, with_related, ch_convert, eachVideoBindInfoTuple, danmu_file_path, incremental)))
+    skips = tuple(eachVideoBindInfoTuple for eachVideoBindInfoTuple, future in futures if future.exception() is not None or not future.result())
+    return not bool(skips), skips
 
 # TODO: Add Logging
-def downloadDanmuFromDandanPlay(_videoBindInfoTuple: Union[videoBindInfoTuple, Sequence[videoBindInfoTuple]], _from: int = 0, with_related: bool = True, ch_convert: int = 1, update: bool = False, show_progress: bool = False) -> Tuple[bool, Tuple]:
+def downloadDanmuFromDandanPlay(_videoBindInfoTuple: Union[videoBindInfoTuple, Sequence[videoBindInfoTuple]], _from: int = 0, with_related: bool = True, ch_convert: int = 1, update: bool = False, show_progress: bool = False, incremental: bool = False) -> Tuple[bool, Tuple]:
     '''Download danmu from Dandanplay,\n
     with_related: If True, download related danmu.\n
-    ch_convert: 0: no convert, 1: convert to simple chinese, 2: convert to traditional chinese
+    ch_convert: 0: no convert, 1: convert to simple chinese, 2: convert to traditional chinese\n
+    incremental: If True, the existing danmu files are refreshed by only fetching the comments newer than the stored ones (implies `update`)
     '''
     if isinstance(_videoBindInfoTuple, videoBindInfoTuple):
         _videoBindInfoTuple = (_videoBindInfoTuple,)
+    update = update or incremental
 
+    from .asyncEngine import asyncDownloadDanmuFromDandanPlay, asyncEngineEnabled
+    if asyncEngineEnabled() and len(_videoBindInfoTuple) > 1:
+        return asyncDownloadDanmuFromDandanPlay(_videoBindInfoTuple, _from, with_related, ch_convert, update, show_progress, incremental)
     if CONFIG.DANMU_DOWNLOAD_THREAD_NUM != 1:
-        return multiThreadDownloadDanmuFromDandanPlay(_videoBindInfoTuple, _from, with_related, ch_convert, update, show_progress)
+        return multiThreadDownloadDanmuFromDandanPlay(_videoBindInfoTuple, _from, with_related, ch_convert, update, show_progress, incremental)
     if show_progress:
         _videoBindInfoTuple = tqdm.tqdm(_videoBindInfoTuple)  # type: ignore
     skips: List[videoBindInfoTuple] = []
     for eachVideoBindInfoTuple in _videoBindInfoTuple:
         if show_progress:
             _videoBindInfoTuple.set_description(f'{eachVideoBindInfoTuple.animeTitle} - {eachVideoBindInfoTuple.episodeTitle}')  # type: ignore
-        danmu_file_path = os.path.join(CONFIG.DANMU_PATH, f'{eachVideoBindInfoTuple.episodeId}.json')
+        danmu_file_path = getDanmuFilePath(eachVideoBindInfoTuple.episodeId)
         if(not update and os.path.exists(danmu_file_path)):
             continue
-        singleThreadDownloadDanmu(_from, with_related, ch_convert, skips, eachVideoBindInfoTuple, danmu_file_path)
+        if not singleThreadDownloadDanmu(_from, with_related, ch_convert, eachVideoBindInfoTuple, danmu_file_path, incremental):
+            skips.append(eachVideoBindInfoTuple)
     return not bool(skips), tuple(skips)
 
 
+def getEpisodesToRefresh(_videoBindInfoTuple: Sequence[videoBindInfoTuple], min_interval: Optional[int] = None) -> Tuple[videoBindInfoTuple, ...]:
+    '''Return the episodes (deduplicated) which are not refreshed within `min_interval` seconds (default: `DANMU_REFRESH_INTERVAL`),\n
+    they are refreshed by `downloadDanmuFromDandanPlay(..., incremental=True)`'''
+    min_interval = CONFIG.DANMU_REFRESH_INTERVAL if min_interval is None else min_interval
+    _episodes = {eachVideoBindInfoTuple.episodeId: eachVideoBindInfoTuple for eachVideoBindInfoTuple in _videoBindInfoTuple}
+    _states = getDanmuStates(tuple(_episodes))
+    _now = int(time.time())
+    return tuple(eachVideoBindInfoTuple for episodeId, eachVideoBindInfoTuple in _episodes.items() if episodeId not in _states or _now - _states[episodeId][2] >= min_interval)
+
+
 def multiThreadBindVideosIfIsMached(each_video_baseinfo_group: Sequence[videoBaseInfoTuple], tqdm_obj: Optional[tqdm.tqdm] = None) -> Tuple[List[Tuple[str, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]]:
     '''Returns: \n[0]: List[Tuple[str, videoBindInfoTuple]], \n[1]: List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], \n[2]: List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]'''
-    def singleThread(_videoBaseInfoTuple: videoBaseInfoTuple, videoBindInfoTuples: List, binded_list: List, need_manual_bind_list: List) -> None:
-        _is_matched, _matches = queryDandanPlay(_videoBaseInfoTuple)
+    with universeExecutor(CONFIG.MATCH_VIDEO_THREAD_NUM, tqdm_obj) as executor:
+        futures = [(each_video_baseinfo, executor.submit(each_video_baseinfo.fileName, queryDandanPlay, each_video_baseinfo)) for each_video_baseinfo in each_video_baseinfo_group]
+    return classifyMatchResults((each_video_baseinfo, future.result() if future.exception() is None else (False, None)) for each_video_baseinfo, future in futures)
+
+
+def classifyMatchResults(results: Iterable[Tuple[videoBaseInfoTuple, Tuple[bool, Optional[Union[videoBindInfoTuple, Tuple[videoBindInfoTuple, ...]]]]]]) -> Tuple[List[Tuple[str, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]]:
+    '''results: (videoBaseInfoTuple, return value of `queryDandanPlay`)\n
+    Returns: the same as `multiThreadBindVideosIfIsMached`'''
+    video_bind_infos: List[Tuple[str, videoBindInfoTuple]] = []
+    binded_videos: List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]] = []
+    need_manual_bind_videos: List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]] = []
+    for each_video_baseinfo, (_is_matched, _matches) in results:
         if _is_matched:
-            videoBindInfoTuples.append((_videoBaseInfoTuple.hash, _matches))
-            binded_list.append((_videoBaseInfoTuple, _matches))  # type: ignore
+            video_bind_infos.append((each_video_baseinfo.hash, _matches))  # type: ignore
+            binded_videos.append((each_video_baseinfo, _matches))  # type: ignore
         else:
-            need_manual_bind_list.append((_videoBaseInfoTuple, _matches))
+            need_manual_bind_videos.append((each_video_baseinfo, _matches))  # type: ignore
+    return video_bind_infos, binded_videos, need_manual_bind_videos
+
+
+def singleThreadBindVideosIfIsMached(each_video_baseinfo_group: Sequence[videoBaseInfoTuple], tqdm_obj: Optional[tqdm.tqdm] = None) -> Tuple[List[Tuple[str, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]]:
+    '''Returns: the same as `multiThreadBindVideosIfIsMached`'''
     video_bind_infos: List[Tuple[str, videoBindInfoTuple]] = []
     binded_videos: List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]] = []
     need_manual_bind_videos: List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]] = []
-    locks = [threading.Lock() for _ in range(CONFIG.MATCH_VIDEO_THREAD_NUM)]
     for each_video_baseinfo in each_video_baseinfo_group:
-        while all(lock.locked() for lock in locks):
-            time.sleep(0.1)
-        lock = [lock for lock in locks if not lock.locked()][0]
-        universeThread(each_video_baseinfo.fileName, singleThread, lock, each_video_baseinfo, video_bind_infos, binded_videos, need_manual_bind_videos, tqdm_obj=tqdm_obj).start()
-    [lock.acquire(blocking=True) for lock in locks]
+        if tqdm_obj is not None:
+            tqdm_obj.set_description(f'{each_video_baseinfo.fileName}')
+            tqdm_obj.update()
+        _is_matched, _matches = queryDandanPlay(each_video_baseinfo)
+        if _is_matched:
+            binded_videos.append((each_video_baseinfo, _matches))  # type: ignore
+            video_bind_infos.append((each_video_baseinfo.hash, _matches))  # type: ignore
+        else:
+            need_manual_bind_videos.append((each_video_baseinfo, _matches))  # type: ignore
     return video_bind_infos, binded_videos, need_manual_bind_videos
 
 
+def perFileBindVideosIfIsMached(each_video_baseinfo_group: Sequence[videoBaseInfoTuple], tqdm_obj: Optional[tqdm.tqdm] = None) -> Tuple[List[Tuple[str, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]]:
+    from .asyncEngine import asyncBindVideosIfIsMached, asyncEngineEnabled
+    if asyncEngineEnabled():
+        return asyncBindVideosIfIsMached(each_video_baseinfo_group, tqdm_obj)
+    if CONFIG.MATCH_VIDEO_THREAD_NUM == 1:
+        return singleThreadBindVideosIfIsMached(each_video_baseinfo_group, tqdm_obj)
+    return multiThreadBindVideosIfIsMached(each_video_baseinfo_group, tqdm_obj)
+
+
+def batchBindVideosIfIsMached(each_video_baseinfo_group: Sequence[videoBaseInfoTuple], tqdm_obj: Optional[tqdm.tqdm] = None) -> Tuple[List[Tuple[str, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, videoBindInfoTuple]], List[Tuple[videoBaseInfoTuple, Tuple[videoBindInfoTuple]]]]:
+    '''Match the group by the batch API, the videos not matched exactly are matched per file to get the candidates.\n
+    If the batch request failed, fall back to per-file matching for the whole group.\n
+    Returns: the same as `multiThreadBindVideosIfIsMached`'''
+    try:
+        _results = batchQueryDandanPlay(each_video_baseinfo_group)
+    except (requests.exceptions.RequestException, json.JSONDecodeError, LookupError, KeyError, TypeError):
+        return perFileBindVideosIfIsMached(each_video_baseinfo_group, tqdm_obj)
+    binded_videos = [(each_video_baseinfo, _results[each_video_baseinfo.hash]) for each_video_baseinfo in each_video_baseinfo_group if _results.get(each_video_baseinfo.hash) is not None]
+    if tqdm_obj is not None and binded_videos:
+        tqdm_obj.set_description(binded_videos[-1][0].fileName)
+        tqdm_obj.update(len(binded_videos))
+    video_bind_infos, _binded_videos, need_manual_bind_videos = perFileBindVideosIfIsMached(tuple(each_video_baseinfo for each_video_baseinfo in each_video_baseinfo_group if _results.get(each_video_baseinfo.hash) is None), tqdm_obj)
+    return [(each_video_baseinfo.hash, _match) for each_video_baseinfo, _match in binded_videos] + video_bind_infos, binded_videos + _binded_videos, need_manual_bind_videos  # type: ignore
+
+
 # TODO: Add Logging
 def bindVideosIfIsMatched(show_progress:bool = False, only_ignore:bool = False) -> Tuple[tuple, tuple]:
     '''Try to search the not-binded videos in the DB,\n
@@ -154,80 +264,138 @@ def bindVideosIfIsMatched(show_progress:bool = False, only_ignore:bool = False)
         eachBaseInfo) for eachBaseInfo in getAllUnBindedVideos(only_ignore)]
     tqdm_obj = tqdm.tqdm(all_videos) if show_progress else None
 
-    for each_video_baseinfo_group in [all_videos[i:i + CONFIG.MATCH_VIDEO_SPLIT_NUM] for i in range(0, len(all_videos), CONFIG.MATCH_VIDEO_SPLIT_NUM)]:
-        if CONFIG.MATCH_VIDEO_THREAD_NUM == 1:
-            videoBindInfoTuples: List[Tuple[str, videoBindInfoTuple]] = []
-            for each_video_baseinfo in each_video_baseinfo_group:
-                if show_progress:
-                    tqdm_obj.set_description(f'{each_video_baseinfo.fileName}')  # type: ignore
-                    tqdm_obj.update()  # type: ignore
-
-                _is_matched, _matches = queryDandanPlay(each_video_baseinfo)
-                if _is_matched:
-                    binded_videos.append((each_video_baseinfo, _matches))
-                    videoBindInfoTuples.append((each_video_baseinfo.hash, _matches))  # type: ignore
-                else:
-                    need_manual_bind_videos.append((each_video_baseinfo, _matches))
+    # 批量匹配时每批提交一次
+    _split_num = CONFIG.MATCH_VIDEO_BATCH_SIZE if CONFIG.MATCH_VIDEO_BATCH_SIZE > 0 else CONFIG.MATCH_VIDEO_SPLIT_NUM
+    for each_video_baseinfo_group in [all_videos[i:i + _split_num] for i in range(0, len(all_videos), _split_num)]:
+        if CONFIG.MATCH_VIDEO_BATCH_SIZE > 0:
+            videoBindInfoTuples, binded_video, need_manual_bind_video = batchBindVideosIfIsMached(each_video_baseinfo_group, tqdm_obj=tqdm_obj)
         else:
-            videoBindInfoTuples, binded_video, need_manual_bind_video = multiThreadBindVideosIfIsMached(
-                each_video_baseinfo_group, tqdm_obj=tqdm_obj)
-            binded_videos += binded_video
-            need_manual_bind_videos += need_manual_bind_video
+            videoBindInfoTuples, binded_video, need_manual_bind_video = perFileBindVideosIfIsMached(each_video_baseinfo_group, tqdm_obj=tqdm_obj)
+        binded_videos += binded_video
+        need_manual_bind_videos += need_manual_bind_video
         addBindingsIntoDB(videoBindInfoTuples)
     return tuple(binded_videos), tuple(need_manual_bind_videos)
 
 
-def covert2XML(episodeId: int) -> str:
-    root = ET.Element('i', {'xmlns:xsd': 'http://www.w3.org/2001/XMLSchema', 'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance'})
-    ET.SubElement(root, 'chatserver').text = 'chat.bilibili.com'
-    ET.SubElement(root, 'chatid').text = '10000'
-    ET.SubElement(root, 'mission').text = '0'
-    ET.SubElement(root, 'maxlimit').text = '8000'
-    ET.SubElement(root, 'source').text = 'e-r'
-    ET.SubElement(root, 'ds').text = '931869000'
-    ET.SubElement(root, 'de').text = '937654881'
-    ET.SubElement(root, 'max_count').text = '8000'
-    with open(os.path.join(CONFIG.DANMU_PATH, f'{episodeId}.json'), 'r', encoding='utf-8') as f:
-        _json = json.loads(f.read())
-        for eachDanmu in _json['comments']:
-            parameters = eachDanmu['p'].split(',')
-            ET.SubElement(root, 'd', {'p':f'{parameters[0]},{parameters[1]},25,{parameters[2]},-639093600,0,0,0'}).text = eachDanmu['m']
-    return ET.tostring(root, encoding="utf-8", xml_declaration=True).decode("utf-8")
+def iterDanmuComments(episodeId: int, chunk_size: int = 65536) -> Iterator[dict]:
+    '''Yield the comments of the danmu file one by one, only a chunk of the file is kept in memory'''
+    danmu_file_path = getDanmuFilePath(episodeId)
+    if danmu_file_path.endswith('.ddb'):
+        for _cid, _time, _mode, _color, _uid, _text in readDanmuStore(danmu_file_path):
+            yield {'cid': _cid, 'p': f'{_time:.2f},{_mode},{_color},{_uid}', 'm': _text}
+        return
+    decoder = json.JSONDecoder()
+    with open(danmu_file_path, 'r', encoding='utf-8') as f:
+        buffer, _key = '', -1
+        while True:
+            _chunk = f.read(chunk_size)
+            if not _chunk:
+                return
+            buffer += _chunk
+            if _key == -1:
+                _key = buffer.find('"comments"')
+            _start = -1 if _key == -1 else buffer.find('[', _key)
+            if _start != -1:
+                break
+        buffer, index = buffer[_start + 1:], 0
+        while True:
+            while index < len(buffer) and buffer[index] in ' \t\r\n,':
+                index += 1
+            if index < len(buffer) and buffer[index] == ']':
+                return
+            try:
+                eachDanmu, _end = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError:
+                _chunk = f.read(chunk_size)
+                if not _chunk:
+                    raise
+                buffer, index = buffer[index:] + _chunk, 0
+                continue
+            index = _end
+            yield eachDanmu
 
 
-def covert2JSON(episodeId: int) -> str:
-    with open(os.path.join(CONFIG.DANMU_PATH, f'{episodeId}.json'), 'r', encoding='utf-8') as f:
-        _json = json.loads(f.read())
-        _list = [[float(eachDanmu['p'].split(',')[0]), 1 if int(eachDanmu['p'].split(',')[1]) == 5 else 0, int(eachDanmu['p'].split(',')[2]), eachDanmu['p'].split(',')[3], eachDanmu['m']] for eachDanmu in _json['comments']]
-        return json.dumps({'code':0, 'data':_list})
+def _batched(chunks: Iterable[str], batch_size: int = 256) -> Iterator[str]:
+    _batch: List[str] = []
+    for chunk in chunks:
+        _batch.append(chunk)
+        if len(_batch) >= batch_size:
+            yield ''.join(_batch)
+            _batch.clear()
+    if _batch:
+        yield ''.join(_batch)
 
 
-def covertDanmu(episodeId: int, type:str) -> str:
-    '''type: "DanDanPlay-Android" or "Web"'''
+def _streamDanmuXML(episodeId: int) -> Iterator[str]:
+    yield ("<?xml version='1.0' encoding='utf-8'?>\n"
+           '<i xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+           '<chatserver>chat.bilibili.com</chatserver><chatid>10000</chatid><mission>0</mission><maxlimit>8000</maxlimit>'
+           '<source>e-r</source><ds>931869000</ds><de>937654881</de><max_count>8000</max_count>')
+    for eachDanmu in iterDanmuComments(episodeId):
+        parameters = eachDanmu['p'].split(',', 3)
+        yield f'<d p={quoteattr(f"{parameters[0]},{parameters[1]},25,{parameters[2]},-639093600,0,0,0")}>{escape(eachDanmu["m"])}</d>'
+    yield '</i>'
+
+
+def _streamDanmuJSON(episodeId: int) -> Iterator[str]:
+    yield '{"code": 0, "data": ['
+    _separator = ''
+    for eachDanmu in iterDanmuComments(episodeId):
+        parameters = eachDanmu['p'].split(',', 4)
+        yield _separator + json.dumps([float(parameters[0]), 1 if int(parameters[1]) == 5 else 0, int(parameters[2]), parameters[3], eachDanmu['m']])
+        _separator = ', '
+    yield ']}'
+
+
+def streamDanmu(episodeId: int, type: str) -> Iterator[str]:
+    '''type: "DanDanPlay-Android" or "Web"\n
+    Yield the converted danmu in chunks without building the whole document'''
     if type == 'DanDanPlay-Android':
-        return covert2XML(episodeId)
+        return _batched(_streamDanmuXML(episodeId))
     elif type == 'Web':
-        return covert2JSON(episodeId)
+        return _batched(_streamDanmuJSON(episodeId))
     else:
         raise Exception('type error')
 
 
+def streamDanmuRange(episodeId: int, start: float, end: float) -> Iterator[str]:
+    '''Yield the comments whose time is in [start, end) in the "Web" format.\n
+    The binary store is searched by bisection, the JSON file is filtered while streaming'''
+    danmu_file_path = getDanmuFilePath(episodeId)
+    if danmu_file_path.endswith('.ddb'):
+        _records = readDanmuStore(danmu_file_path, start, end)
+    else:
+        _records = (_record for _record in map(parseComment, iterDanmuComments(episodeId)) if start <= _record[1] < end)
+
+    def encode() -> Iterator[str]:
+        yield '{"code": 0, "data": ['
+        _separator = ''
+        for _cid, _time, _mode, _color, _uid, _text in _records:
+            yield _separator + json.dumps([round(_time, 2), 1 if _mode == 5 else 0, _color, _uid, _text])
+            _separator = ', '
+        yield ']}'
+    return _batched(encode())
+
+
+def covert2XML(episodeId: int) -> str:
+    return ''.join(streamDanmu(episodeId, 'DanDanPlay-Android'))
+
+
+def covert2JSON(episodeId: int) -> str:
+    return ''.join(streamDanmu(episodeId, 'Web'))
+
+
+def covertDanmu(episodeId: int, type:str) -> str:
+    '''type: "DanDanPlay-Android" or "Web"'''
+    return ''.join(streamDanmu(episodeId, type))
+
+
 def searchDanDanPlay(key_word:str) -> Tuple[bool, Tuple[videoBindInfoTuple, ...]]:
     '''Iuput a key word, and return the result from dandanplay-api. \n\nReturn: hasMore: bool, Tuple[videoBindInfoTuple]'''
-    _apiurl = f'https://api.dandanplay.net/api/v2/search/episodes?anime={html.escape(key_word)}&episode='
-    for _ in range(3):
-        #TODO: Logging
-        try:
-            _context = requests.get(_apiurl, verify=False)
-            _dict = json.loads(html.unescape(_context.content.decode('utf-8')))
-            break
-        except requests.exceptions.ConnectTimeout:
-            time.sleep(1)
-            continue
-        except requests.exceptions.InvalidJSONError:
-            time.sleep(1)
-            continue
-    else:
+    #TODO: Logging
+    try:
+        _dict = getClient().requestJSON('GET', '/api/v2/search/episodes', params={'anime': key_word, 'episode': ''})
+    except (requests.exceptions.RequestException, json.JSONDecodeError):
         return False, () #type: ignore
     _hasMore:bool = _dict['hasMore']
     _videoBindInfoTuples = tuple(videoBindInfoTuple(_eachDict['animeId'], _episodes['episodeId'], _eachDict['animeTitle'], _episodes['episodeTitle'], _eachDict['type'], _eachDict['typeDescription']) for _eachDict in _dict['animes'] for _episodes in _eachDict['episodes'])
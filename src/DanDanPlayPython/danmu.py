@@ -0,0 +1,133 @@
+import gzip
+import os
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Iterator, Optional, Tuple
+
+from .config import CONFIG
+from .dandanplayAPI import getDanmuFilePath, streamDanmu
+from .unit import perProcess
+
+DANMU_MIMETYPES = {'DanDanPlay-Android': 'application/xml', 'Web': 'application/json'}
+_SUFFIXES = {'DanDanPlay-Android': 'xml', 'Web': 'json'}
+
+renderedDanmuTuple = namedtuple('renderedDanmuTuple', 'etag, mimetype, gzipped, data')
+
+
+def _sourceVersion(episodeId: int) -> Optional[Tuple[int, int]]:
+    '''Return (mtime_ns, size) of the danmu file, None if it does not exist'''
+    try:
+        _stat = os.stat(getDanmuFilePath(episodeId))
+    except FileNotFoundError:
+        return None
+    return _stat.st_mtime_ns, _stat.st_size
+
+
+def _etag(episodeId: int, type: str, version: Tuple[int, int]) -> str:
+    return f'{episodeId}-{_SUFFIXES[type]}-{version[0]:x}-{version[1]:x}'
+
+
+class danmuRenderCache():
+    '''渲染后弹幕的两级缓存：磁盘上按 (episodeId, type, 源文件 mtime) 保存序列化结果（可选 gzip 压缩），\n
+    内存中再以 LRU 保留最近使用的条目。未命中时边流式渲染边写入磁盘缓存。\n
+    源文件重新下载后 mtime 改变，旧缓存随之失效并被清理'''
+
+    def __init__(self, cache_path: Optional[str] = None, max_entries: Optional[int] = None, compress: Optional[bool] = None):
+        self.cache_path = CONFIG.DANMU_CACHE_PATH if cache_path is None else cache_path
+        self.max_entries: int = CONFIG.DANMU_CACHE_SIZE if max_entries is None else max_entries
+        self.compress: bool = CONFIG.DANMU_CACHE_GZIP if compress is None else compress
+        self._entries: 'OrderedDict[Tuple[int, str], renderedDanmuTuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._render_locks: dict = {}
+
+    def etag(self, episodeId: int, type: str) -> Optional[str]:
+        '''Return the ETag of the current danmu file without rendering it, None if the file does not exist'''
+        version = _sourceVersion(episodeId)
+        return None if version is None else _etag(episodeId, type, version)
+
+    def _diskPath(self, episodeId: int, type: str, etag: str) -> str:
+        return os.path.join(self.cache_path, f'{etag}.{_SUFFIXES[type]}{".gz" if self.compress else ""}')
+
+    def _remember(self, key: Tuple[int, str], entry: renderedDanmuTuple) -> renderedDanmuTuple:
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _pruneDisk(self, episodeId: int, type: str, keep: str) -> None:
+        _prefix = f'{episodeId}-{_SUFFIXES[type]}-'
+        try:
+            _names = os.listdir(self.cache_path)
+        except FileNotFoundError:
+            return
+        for _name in _names:
+            if _name.startswith(_prefix) and os.path.join(self.cache_path, _name) != keep:
+                try:
+                    os.remove(os.path.join(self.cache_path, _name))
+                except FileNotFoundError:
+                    pass
+
+    def _renderLock(self, key: Tuple[int, str]) -> threading.Lock:
+        with self._lock:
+            return self._render_locks.setdefault(key, threading.Lock())
+
+    def lookup(self, episodeId: int, type: str, etag: Optional[str] = None) -> Optional[renderedDanmuTuple]:
+        '''type: "DanDanPlay-Android" or "Web"\n
+        Return the cached rendering from memory or disk, None if it is not rendered yet or the danmu file does not exist'''
+        key = (episodeId, type)
+        etag = self.etag(episodeId, type) if etag is None else etag
+        if etag is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.etag == etag:
+                self._entries.move_to_end(key)
+                return entry
+        try:
+            with open(self._diskPath(episodeId, type, etag), 'rb') as f:
+                return self._remember(key, renderedDanmuTuple(etag, DANMU_MIMETYPES[type], self.compress, f.read()))
+        except FileNotFoundError:
+            return None
+
+    def stream(self, episodeId: int, type: str, etag: str) -> Iterator[bytes]:
+        '''Yield the rendered danmu in chunks, and write it into the disk cache at the same time.\n
+        Only one request per episode writes the cache, the others just stream'''
+        render_lock = self._renderLock((episodeId, type))
+        if not render_lock.acquire(blocking=False):
+            for chunk in streamDanmu(episodeId, type):
+                yield chunk.encode('utf-8')
+            return
+        try:
+            disk_path = self._diskPath(episodeId, type, etag)
+            os.makedirs(self.cache_path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    sink = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6) if self.compress else f
+                    for chunk in streamDanmu(episodeId, type):
+                        data = chunk.encode('utf-8')
+                        sink.write(data)
+                        yield data
+                    sink.close()
+                # 渲染期间源文件被替换时不写入磁盘，避免以旧 ETag 保存新内容
+                if self.etag(episodeId, type) == etag:
+                    os.replace(tmp_path, disk_path)
+                    self._pruneDisk(episodeId, type, disk_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        finally:
+            render_lock.release()
+
+
+_cache = perProcess(danmuRenderCache)
+
+
+def getDanmuCache() -> danmuRenderCache:
+    '''Return the shared render cache of the current process'''
+    return _cache.get()
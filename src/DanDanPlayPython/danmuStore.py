@@ -0,0 +1,161 @@
+'''紧凑的二进制弹幕存储（.ddb）
+
+文件布局（小端序）：
+    头部      <4sIIII> magic, 弹幕数 n, 用户数 u, 文本区字节数, 用户区字节数，补齐到 24 字节
+    cid       int64[n]
+    time      float32[n]   按时间升序
+    color     uint32[n]
+    uid       uint32[n]    用户表下标
+    text_off  uint32[n + 1]
+    uid_off   uint32[u + 1]
+    mode      uint8[n]
+    文本区    UTF-8
+    用户区    UTF-8
+各列均按自身宽度对齐，可直接由 mmap 映射读取。
+'''
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Tuple
+
+_MAGIC = b'DDB1'
+_HEADER = struct.Struct('<4sIIII')
+_HEADER_SIZE = 24
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+# (cid, time, mode, color, uid, text)
+danmuRecord = Tuple[int, float, int, int, str, str]
+
+
+def parseComment(eachDanmu: dict) -> danmuRecord:
+    '''Convert a comment of the upstream JSON into a record'''
+    parameters = eachDanmu['p'].split(',', 3)
+    return int(eachDanmu.get('cid', 0)), float(parameters[0]), int(parameters[1]), int(parameters[2]), parameters[3] if len(parameters) > 3 else '', eachDanmu['m']
+
+
+def _column(typecode: str, values: Iterable) -> bytes:
+    _array = array(typecode, values)
+    if not _LITTLE_ENDIAN:
+        _array.byteswap()
+    return _array.tobytes()
+
+
+def writeDanmuStore(path: str, records: Iterable[danmuRecord]) -> None:
+    '''Write the records into `path` atomically'''
+    _records = sorted(records, key=lambda record: record[1])
+    uids: dict = {}
+    texts = [record[5].encode('utf-8') for record in _records]
+    uid_indexes = [uids.setdefault(record[4], len(uids)) for record in _records]
+    uid_blobs = [uid.encode('utf-8') for uid in uids]
+    text_offsets, uid_offsets = [0], [0]
+    for text in texts:
+        text_offsets.append(text_offsets[-1] + len(text))
+    for uid in uid_blobs:
+        uid_offsets.append(uid_offsets[-1] + len(uid))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(_records), len(uids), text_offsets[-1], uid_offsets[-1]).ljust(_HEADER_SIZE, b'\0'))
+            f.write(_column('q', (record[0] for record in _records)))
+            f.write(_column('f', (record[1] for record in _records)))
+            f.write(_column('I', (record[3] for record in _records)))
+            f.write(_column('I', uid_indexes))
+            f.write(_column('I', text_offsets))
+            f.write(_column('I', uid_offsets))
+            f.write(bytes(record[2] & 0xFF for record in _records))
+            f.write(b''.join(texts))
+            f.write(b''.join(uid_blobs))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class danmuStore():
+    '''只读打开 .ddb 文件，各列通过 mmap 按需读取，可用作上下文管理器'''
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        if self._mmap is None:
+            raise ValueError(f'{path} is not a danmu store')
+        columns: List = []
+        try:
+            if self._mmap[:4] != _MAGIC:
+                raise ValueError(f'{path} is not a danmu store')
+            _, self.count, self.uid_count, text_size, uid_size = _HEADER.unpack_from(self._mmap)
+            n, u = self.count, self.uid_count
+            offset = _HEADER_SIZE
+            for typecode, size, length in (('q', 8, n), ('f', 4, n), ('I', 4, n), ('I', 4, n), ('I', 4, n + 1), ('I', 4, u + 1), ('B', 1, n)):
+                columns.append(self._view(offset, typecode, size, length))
+                offset += size * length
+            if offset + text_size + uid_size > len(self._mmap):
+                raise ValueError(f'{path} is truncated')
+        except BaseException:
+            # 文件损坏或被截断时释放已建立的视图并关闭映射
+            for _column in columns:
+                if isinstance(_column, memoryview):
+                    _column.release()
+            self._mmap.close()
+            self._mmap = None
+            raise
+        self.cids, self.times, self.colors, self.uids, self._text_offsets, self._uid_offsets, self.modes = columns
+        self._text_start = offset
+        self._uid_start = offset + text_size
+        self._uid_cache: dict = {}
+
+    def _view(self, offset: int, typecode: str, size: int, length: int):
+        _view = memoryview(self._mmap)[offset:offset + size * length]  # type: ignore
+        if _LITTLE_ENDIAN or size == 1:
+            return _view.cast(typecode)
+        _array = array(typecode, _view)
+        _array.byteswap()
+        return _array
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        for _column in (self.cids, self.times, self.colors, self.uids, self._text_offsets, self._uid_offsets, self.modes):
+            if isinstance(_column, memoryview):
+                _column.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def text(self, index: int) -> str:
+        return self._mmap[self._text_start + self._text_offsets[index]:self._text_start + self._text_offsets[index + 1]].decode('utf-8')  # type: ignore
+
+    def uid(self, index: int) -> str:
+        uid_index = self.uids[index]
+        if uid_index not in self._uid_cache:
+            self._uid_cache[uid_index] = self._mmap[self._uid_start + self._uid_offsets[uid_index]:self._uid_start + self._uid_offsets[uid_index + 1]].decode('utf-8')  # type: ignore
+        return self._uid_cache[uid_index]
+
+    def record(self, index: int) -> danmuRecord:
+        return self.cids[index], self.times[index], self.modes[index], self.colors[index], self.uid(index), self.text(index)
+
+    def indexRange(self, start: float, end: float) -> range:
+        '''Return the indexes of the comments whose time is in [start, end)'''
+        return range(bisect_left(self.times, start), bisect_left(self.times, end))
+
+    def records(self, start: float = float('-inf'), end: float = float('inf')) -> Iterator[danmuRecord]:
+        for index in self.indexRange(start, end):
+            yield self.record(index)
+
+
+def readDanmuStore(path: str, start: float = float('-inf'), end: float = float('inf')) -> Iterator[danmuRecord]:
+    '''Yield the records in [start, end) of the file'''
+    with danmuStore(path) as store:
+        yield from store.records(start, end)
@@ -1,197 +1,452 @@
-import os
-import sqlite3
-import time
-from contextlib import closing
-from typing import Optional, Sequence, Tuple
-
-# from var_dump import var_dump
-from .config import CONFIG
-from .unit import videoBaseInfoTuple, videoBindInfoTuple
-
-
-def initDB():
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("CREATE TABLE IF NOT EXISTS Video (hash TEXT PRIMARY KEY, fileName TEXT, filePath TEXT, fileSize TEXT, videoDuration TEXT, lastWatchTime INTEGER DEFAULT -1, ignore BOOLEAN DEFAULT 0)")
-            cursor.execute("CREATE TABLE IF NOT EXISTS Binding (hash TEXT PRIMARY KEY, animeId INTEGER, episodeId INTEGER, animeTitle TEXT, episodeTitle TEXT, type TEXT, typeDescription TEXT)")
-            cursor.execute("CREATE TABLE IF NOT EXISTS Auth (username TEXT PRIMARY KEY, password TEXT)")
-            connection.commit()
-
-
-def clearDB(part: str = 'all') -> None:
-    '''part: 'all' or 'video' or 'binding'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            if part in {'all', 'video'}:
-                cursor.execute("DELETE FROM Video")
-            if part in {'all', 'binding'}:
-                cursor.execute("DELETE FROM Binding")
-            connection.commit()
-
-
-def addVideoIntoDB(hash: str, fileName: str, filePath: str, fileSize: str, videoDuration: str) -> None:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("INSERT OR IGNORE INTO Video(hash, fileName, filePath, fileSize, videoDuration) VALUES (?, ?, ?, ?, ?)", (hash, fileName, filePath, fileSize, videoDuration))
-            connection.commit()
-
-
-def addVideosIntoDB(videos: Sequence[Tuple[str, str, str, str, str]]) -> None:
-    '''eachTuple: [0] hash: str, [1] fileName: str, [2] filePath: str, [3] fileSize: str, [4] videoDuration: str'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            for video in videos:
-                cursor.execute("INSERT OR IGNORE INTO Video(hash, fileName, filePath, fileSize, videoDuration) VALUES (?, ?, ?, ?, ?)", video)
-            connection.commit()
-
-
-def addBindingIntoDB(hash: str, _videoBindInfoTuple: videoBindInfoTuple) -> None:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("INSERT OR IGNORE INTO Binding VALUES (?, ?, ?, ?, ?, ?, ?)", (hash, *_videoBindInfoTuple[:6]))
-            connection.commit()
-
-
-def addBindingsIntoDB(bindings: Sequence[Tuple[str, videoBindInfoTuple]]) -> None:
-    '''eachTuple: [0] hash, [1] videoBindInfoTuple'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            for binding in bindings:
-                cursor.execute("INSERT OR IGNORE INTO Binding VALUES (?, ?, ?, ?, ?, ?, ?)", (binding[0], *(binding[1][:6])))
-            connection.commit()
-
-
-def getVideoFromDB(hash: str) -> Optional[videoBaseInfoTuple]:
-    '''videoBindInfoTuple: [0] hash, [1] fileName, [2] filePath, [3] fileSize, [4] videoDuration'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video WHERE hash=?", (hash,))
-            _fetch = cursor.fetchone()
-            return videoBaseInfoTuple._make(_fetch[:5]) if _fetch is not None else None
-
-
-def getAllVideos() -> Tuple[videoBaseInfoTuple, ...]:
-    '''videoBindInfoTuple: [0] hash, [1] fileName, [2] filePath, [3] fileSize, [4] videoDuration'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video")
-            return tuple(videoBaseInfoTuple._make(eachTuple[:5]) for eachTuple in cursor.fetchall())
-
-
-def checkIfVideoBinded(hash: str) -> bool:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Binding WHERE hash=?", (hash,))
-            return cursor.fetchone() is None
-
-
-def getAllBindedVideos() -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
-    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video JOIN Binding Using(hash)")
-            return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in cursor.fetchall())
-
-
-def getSpecificAnimeBindedVideos(animeId: int) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
-    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video JOIN Binding Using(hash) WHERE animeId=?", (animeId,))
-            _fetch = cursor.fetchall()
-            if _fetch is None:
-                return ()
-            return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in _fetch)
-
-
-def getSpecificEpisodeBindedVideos(episodeId: int) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
-    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video JOIN Binding Using(hash) WHERE episodeId=?", (episodeId,))
-            _fetch = cursor.fetchall()
-            if _fetch is None:
-                return ()
-            return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in _fetch)
-
-
-def getSpecificBindedVideo(hash: str) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int]]:
-    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video JOIN Binding Using(hash) WHERE hash=?", (hash,))
-            _fetch = cursor.fetchone()
-            if _fetch is None:
-                return ()# type: ignore
-            return (videoBaseInfoTuple(*_fetch[:5]), videoBindInfoTuple(*_fetch[-6:]), _fetch[5]),
-
-
-def getAllUnBindedVideos(including_ignore:bool = False) -> Tuple[videoBaseInfoTuple, ...]:
-    '''videoBaseInfoTuple: [0] hash, [1] fileName, [2] filePath, [3] fileSize, [4] videoDuration'''
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Video WHERE hash NOT IN (SELECT hash FROM Binding) and ignore=?", (1 if including_ignore else 0,))
-            return tuple(videoBaseInfoTuple._make(eachTuple[:5]) for eachTuple in cursor.fetchall())
-
-
-def getBindingFromDB(hash: str) -> Optional[videoBindInfoTuple]:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Binding WHERE hash=?", (hash,))
-            _fetch = cursor.fetchone()
-            return videoBindInfoTuple(*_fetch[1:]) if _fetch is not None else None
-
-
-def getLastWatchTime(hash: str) -> int:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT lastWatchTime FROM Video WHERE hash=?", (hash,))
-            return cursor.fetchone()[0] if cursor.fetchone() is not None else -1
-
-
-# time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1657941885))
-def updateLastWatchTime(hash: str, lastWatchTime: int) -> None:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("UPDATE Video SET lastWatchTime=? WHERE hash=?", (lastWatchTime, hash))
-            connection.commit()
-
-
-def clearBrokenVideo() -> Tuple[videoBaseInfoTuple, ...]:
-    broken_videoBaseInfoTuples = tuple(eachTuple for eachTuple in getAllVideos() if not os.path.exists(eachTuple.filePath))
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            for broken_videoBaseInfoTuples in broken_videoBaseInfoTuples:
-                cursor.execute("DELETE FROM Video WHERE hash=?", (broken_videoBaseInfoTuples.hash,))
-                cursor.execute("DELETE FROM Binding WHERE hash=?", (broken_videoBaseInfoTuples.hash,))
-                cursor.execute("DELETE FROM Binding WHERE Binding.hash NOT IN (SELECT Video.hash FROM Video)", (broken_videoBaseInfoTuples.hash,))
-            connection.commit()
-    return broken_videoBaseInfoTuples
-
-
-def ignoreVideo(hash: str, state:bool = True) -> None:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("UPDATE Video SET ignore=? WHERE hash=?", (1 if state else 0, hash))
-            connection.commit()
-
-
-def vaildUserIfExists(user: str) -> bool:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Auth WHERE username=?", (user,))
-            return cursor.fetchone() is not None
-
-
-def vaildPassword(user: str, password: str) -> bool:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("SELECT * FROM Auth WHERE username=? AND password=?", (user, password))
-            return cursor.fetchone() is not None
-
-
-def regUser(user: str, password: str) -> None:
-    with closing(sqlite3.connect(CONFIG.DB_PATH)) as connection:
-        with closing(connection.cursor()) as cursor:
-            cursor.execute("INSERT INTO Auth VALUES (?, ?)", (user, password))
-            connection.commit()
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Set, Tuple
+
+# from var_dump import var_dump
+from .config import CONFIG
+from .unit import perProcess, videoBaseInfoTuple, videoBindInfoTuple
+
+# 每个连接建立时执行，WAL 模式下读写互不阻塞，NORMAL 同步级别在 WAL 下仍可保证一致性
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16384",  # 16 MiB
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    "PRAGMA temp_store=MEMORY",
+)
+_BUSY_TIMEOUT = 30
+_CACHED_STATEMENTS = 256
+
+# 第 n 项为从版本 n 升级到版本 n+1 所执行的语句，版本号保存在 `PRAGMA user_version`
+_MIGRATIONS: Tuple[Tuple[str, ...], ...] = (
+    (
+        "CREATE TABLE IF NOT EXISTS Video (hash TEXT PRIMARY KEY, fileName TEXT, filePath TEXT, fileSize TEXT, videoDuration TEXT, lastWatchTime INTEGER DEFAULT -1, ignore BOOLEAN DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS Binding (hash TEXT PRIMARY KEY, animeId INTEGER, episodeId INTEGER, animeTitle TEXT, episodeTitle TEXT, type TEXT, typeDescription TEXT)",
+        "CREATE TABLE IF NOT EXISTS Auth (username TEXT PRIMARY KEY, password TEXT)",
+    ),
+    (
+        "CREATE TABLE Video_v2 (hash TEXT PRIMARY KEY, fileName TEXT, filePath TEXT, fileSize INTEGER, videoDuration INTEGER, lastWatchTime INTEGER DEFAULT -1, ignore BOOLEAN DEFAULT 0)",
+        "INSERT INTO Video_v2 SELECT hash, fileName, filePath, CAST(fileSize AS INTEGER), CAST(videoDuration AS INTEGER), lastWatchTime, ignore FROM Video",
+        "DROP TABLE Video",
+        "ALTER TABLE Video_v2 RENAME TO Video",
+        "CREATE INDEX IF NOT EXISTS idx_Video_filePath ON Video(filePath)",
+        "CREATE INDEX IF NOT EXISTS idx_Video_ignore ON Video(ignore)",
+        "CREATE INDEX IF NOT EXISTS idx_Binding_animeId ON Binding(animeId)",
+        "CREATE INDEX IF NOT EXISTS idx_Binding_episodeId ON Binding(episodeId)",
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS ScanState (filePath TEXT PRIMARY KEY, inode INTEGER, mtime INTEGER, size INTEGER, hash TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_ScanState_inode_size ON ScanState(inode, size)",
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS DanmuState (episodeId INTEGER PRIMARY KEY, maxCid INTEGER, count INTEGER, lastRefreshTime INTEGER)",
+    ),
+    (
+        # 媒体库版本号：Video/Binding 的任何写入（包括其它进程）都由触发器递增，初值取建表时间以免重建数据库后与旧值重复
+        "CREATE TABLE IF NOT EXISTS LibraryState (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER)",
+        "INSERT OR IGNORE INTO LibraryState VALUES (0, CAST(strftime('%s', 'now') AS INTEGER) * 1000)",
+        *(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_generation AFTER {event} ON {table} BEGIN UPDATE LibraryState SET generation = generation + 1; END"
+          for table in ('Video', 'Binding') for event in ('INSERT', 'UPDATE', 'DELETE')),
+    ),
+    (
+        # 媒体库分页与筛选：按 (animeId, episodeId, hash) 做键集分页，按 lastWatchTime 做范围筛选
+        "DROP INDEX IF EXISTS idx_Binding_animeId",
+        "CREATE INDEX IF NOT EXISTS idx_Binding_animeId_episodeId ON Binding(animeId, episodeId, hash)",
+        "CREATE INDEX IF NOT EXISTS idx_Video_lastWatchTime ON Video(lastWatchTime)",
+    ),
+    (
+        # 新列追加在 Video 末尾，不影响 `SELECT * FROM Video JOIN Binding` 按位置取值
+        "ALTER TABLE Video ADD COLUMN playCount INTEGER DEFAULT 0",
+        "ALTER TABLE Video ADD COLUMN lastPosition REAL DEFAULT 0",
+    ),
+)
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+class connectionManager():
+    '''每个线程持有一个长连接，连接在首次使用时创建并设置 `_PRAGMAS`；\n
+    语句缓存由 `sqlite3` 的 `cached_statements` 提供，已结束线程的连接会在下次建连时关闭'''
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._pid = os.getpid()
+        self._migrated = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=_BUSY_TIMEOUT, cached_statements=_CACHED_STATEMENTS, check_same_thread=False)
+        for pragma in _PRAGMAS:
+            connection.execute(pragma)
+        if not self._migrated:
+            migrateDB(connection)
+            self._migrated = True
+        with self._lock:
+            for ident, (thread, _connection) in tuple(self._connections.items()):
+                if not thread.is_alive():
+                    _connection.close()
+                    del self._connections[ident]
+            self._connections[threading.get_ident()] = (threading.current_thread(), connection)
+        return connection
+
+    def get(self) -> sqlite3.Connection:
+        if os.getpid() != self._pid:
+            # fork 之后不可复用父进程的连接，直接丢弃而不关闭
+            self._local, self._connections, self._pid = threading.local(), {}, os.getpid()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def closeAll(self) -> None:
+        with self._lock:
+            for _, connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+# 数据库路径变化时重新创建
+_connection_manager = perProcess(lambda: connectionManager(CONFIG.DB_PATH), stale=lambda manager: manager.db_path != CONFIG.DB_PATH)
+
+
+def getConnectionManager() -> connectionManager:
+    '''Return the shared connection manager of the current process'''
+    return _connection_manager.get()
+
+
+@contextmanager
+def dbCursor(commit: bool = False) -> Iterator[sqlite3.Cursor]:
+    '''commit: 若为 True，正常退出时提交，异常时回滚'''
+    connection = getConnectionManager().get()
+    with closing(connection.cursor()) as cursor:
+        try:
+            yield cursor
+        except BaseException:
+            if commit:
+                connection.rollback()
+            raise
+        if commit:
+            connection.commit()
+
+
+def migrateDB(connection: sqlite3.Connection) -> int:
+    '''依次执行尚未应用的 `_MIGRATIONS`，整个升级过程在同一事务中完成，返回升级前的版本号'''
+    with closing(connection.cursor()) as cursor:
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return SCHEMA_VERSION
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # 加写锁后重新读取，避免与其它进程重复升级
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            for _version, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version={_version}")
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+    return version
+
+
+def initDB():
+    migrateDB(getConnectionManager().get())
+
+
+def clearDB(part: str = 'all') -> None:
+    '''part: 'all' or 'video' or 'binding'''
+    with dbCursor(commit=True) as cursor:
+        if part in {'all', 'video'}:
+            cursor.execute("DELETE FROM Video")
+            cursor.execute("DELETE FROM ScanState")
+        if part in {'all', 'binding'}:
+            cursor.execute("DELETE FROM Binding")
+
+
+def addVideoIntoDB(hash: str, fileName: str, filePath: str, fileSize: int, videoDuration: int) -> None:
+    with dbCursor(commit=True) as cursor:
+        cursor.execute("INSERT OR IGNORE INTO Video(hash, fileName, filePath, fileSize, videoDuration) VALUES (?, ?, ?, ?, ?)", (hash, fileName, filePath, fileSize, videoDuration))
+
+
+def addVideosIntoDB(videos: Sequence[Tuple[str, str, str, int, int]]) -> None:
+    '''eachTuple: [0] hash: str, [1] fileName: str, [2] filePath: str, [3] fileSize: int, [4] videoDuration: int'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("INSERT OR IGNORE INTO Video(hash, fileName, filePath, fileSize, videoDuration) VALUES (?, ?, ?, ?, ?)", videos)
+
+
+def addBindingIntoDB(hash: str, _videoBindInfoTuple: videoBindInfoTuple) -> None:
+    with dbCursor(commit=True) as cursor:
+        cursor.execute("INSERT OR IGNORE INTO Binding VALUES (?, ?, ?, ?, ?, ?, ?)", (hash, *_videoBindInfoTuple[:6]))
+
+
+def addBindingsIntoDB(bindings: Sequence[Tuple[str, videoBindInfoTuple]]) -> None:
+    '''eachTuple: [0] hash, [1] videoBindInfoTuple'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("INSERT OR IGNORE INTO Binding VALUES (?, ?, ?, ?, ?, ?, ?)", ((binding[0], *(binding[1][:6])) for binding in bindings))
+
+
+def getVideoFromDB(hash: str) -> Optional[videoBaseInfoTuple]:
+    '''videoBindInfoTuple: [0] hash, [1] fileName, [2] filePath, [3] fileSize, [4] videoDuration'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video WHERE hash=?", (hash,))
+        _fetch = cursor.fetchone()
+        return videoBaseInfoTuple._make(_fetch[:5]) if _fetch is not None else None
+
+
+def getAllVideos() -> Tuple[videoBaseInfoTuple, ...]:
+    '''videoBindInfoTuple: [0] hash, [1] fileName, [2] filePath, [3] fileSize, [4] videoDuration'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video")
+        return tuple(videoBaseInfoTuple._make(eachTuple[:5]) for eachTuple in cursor.fetchall())
+
+
+def getVideoCount() -> int:
+    with dbCursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM Video")
+        return cursor.fetchone()[0]
+
+
+def getVideoHashesByPaths(video_paths: Sequence[str]) -> Dict[str, str]:
+    '''Return a dict of {filePath: hash} for the paths in `video_paths` which are already in the DB'''
+    hashes: Dict[str, str] = {}
+    with dbCursor() as cursor:
+        for i in range(0, len(video_paths), 500):
+            _chunk = video_paths[i:i + 500]
+            cursor.execute(f"SELECT filePath, hash FROM Video WHERE filePath IN ({', '.join('?' * len(_chunk))})", tuple(_chunk))
+            hashes.update(cursor.fetchall())
+    return hashes
+
+
+def getExistVideoPaths(video_paths: Sequence[str]) -> Set[str]:
+    '''Return the paths in `video_paths` which are already in the DB'''
+    return set(getVideoHashesByPaths(video_paths))
+
+
+def deleteVideosByHashes(hashes: Sequence[str]) -> None:
+    '''Delete the videos and their bindings'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("DELETE FROM Video WHERE hash=?", ((hash,) for hash in hashes))
+        cursor.executemany("DELETE FROM Binding WHERE hash=?", ((hash,) for hash in hashes))
+        cursor.executemany("DELETE FROM ScanState WHERE hash=?", ((hash,) for hash in hashes))
+
+
+def updateVideoFileSizes(sizes: Sequence[Tuple[str, int]]) -> None:
+    '''eachTuple: [0] filePath, [1] fileSize'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("UPDATE Video SET fileSize=? WHERE filePath=? AND fileSize<>?", ((size, each_path, size) for each_path, size in sizes))
+
+
+def moveVideoPaths(moves: Sequence[Tuple[str, str, str]]) -> None:
+    '''eachTuple: [0] old filePath, [1] new filePath, [2] new fileName'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("UPDATE Video SET filePath=?, fileName=? WHERE filePath=?", ((new_path, new_name, old_path) for old_path, new_path, new_name in moves))
+
+
+def getScanStates(folder_path: str) -> Dict[str, Tuple[int, int, int, str]]:
+    '''Return a dict of {filePath: (inode, mtime, size, hash)} for the files under `folder_path`,\n
+    the states whose video is no longer in the DB are left out, so the files are pushed again'''
+    _prefix = os.path.join(folder_path, '')
+    with dbCursor() as cursor:
+        # 以主键做前缀范围查询：[prefix, prefix 末字符 + 1)
+        cursor.execute("SELECT ScanState.filePath, inode, mtime, size, Video.hash FROM ScanState JOIN Video ON Video.filePath = ScanState.filePath "
+                       "WHERE ScanState.filePath >= ? AND ScanState.filePath < ?", (_prefix, f'{_prefix[:-1]}{chr(ord(_prefix[-1]) + 1)}'))
+        return {eachTuple[0]: eachTuple[1:] for eachTuple in cursor.fetchall()}
+
+
+def updateScanStates(states: Sequence[Tuple[str, int, int, int, str]]) -> None:
+    '''eachTuple: [0] filePath, [1] inode, [2] mtime, [3] size, [4] hash'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("INSERT OR REPLACE INTO ScanState VALUES (?, ?, ?, ?, ?)", states)
+
+
+def deleteScanStates(file_paths: Sequence[str]) -> None:
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("DELETE FROM ScanState WHERE filePath=?", ((each_path,) for each_path in file_paths))
+
+
+def getDanmuStates(episodeIds: Sequence[int]) -> Dict[int, Tuple[int, int, int]]:
+    '''Return a dict of {episodeId: (maxCid, count, lastRefreshTime)} for the episodes which have been downloaded'''
+    states: Dict[int, Tuple[int, int, int]] = {}
+    with dbCursor() as cursor:
+        for i in range(0, len(episodeIds), 500):
+            _chunk = episodeIds[i:i + 500]
+            cursor.execute(f"SELECT episodeId, maxCid, count, lastRefreshTime FROM DanmuState WHERE episodeId IN ({', '.join('?' * len(_chunk))})", tuple(_chunk))
+            states.update((eachTuple[0], eachTuple[1:]) for eachTuple in cursor.fetchall())
+    return states
+
+
+def updateDanmuStates(states: Sequence[Tuple[int, int, int, int]]) -> None:
+    '''eachTuple: [0] episodeId, [1] maxCid, [2] count, [3] lastRefreshTime'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("INSERT OR REPLACE INTO DanmuState VALUES (?, ?, ?, ?)", states)
+
+
+def checkIfVideoBinded(hash: str) -> bool:
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Binding WHERE hash=?", (hash,))
+        return cursor.fetchone() is None
+
+
+def getAllBindedVideos() -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
+    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video JOIN Binding Using(hash)")
+        return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in cursor.fetchall())
+
+
+def getSpecificAnimeBindedVideos(animeId: int) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
+    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video JOIN Binding Using(hash) WHERE animeId=?", (animeId,))
+        _fetch = cursor.fetchall()
+        if _fetch is None:
+            return ()
+        return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in _fetch)
+
+
+def queryBindedVideos(animeId: Optional[int] = None, watched_after: Optional[int] = None, watched_before: Optional[int] = None, unwatched: bool = False,
+                      sort: str = 'episode', after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
+    '''sort: 'episode' orders by (animeId, episodeId, hash), 'hash' orders by hash\n
+    watched_after/watched_before: lastWatchTime in [watched_after, watched_before)\n
+    after: the sort key of the last row of the previous page, see `bindedVideoSortKey`\n
+    Return: the same as `getAllBindedVideos`'''
+    conditions, parameters = [], []
+    if animeId is not None:
+        conditions.append("animeId=?")
+        parameters.append(animeId)
+    if watched_after is not None:
+        conditions.append("lastWatchTime>=?")
+        parameters.append(watched_after)
+    if watched_before is not None:
+        conditions.append("lastWatchTime<?")
+        parameters.append(watched_before)
+    if unwatched:
+        conditions.append("lastWatchTime<0")
+    # hash 需限定为 Binding.hash，否则无法沿用 Binding 上的索引顺序
+    _columns = "animeId, episodeId, Binding.hash" if sort == 'episode' else "hash"
+    if after is not None:
+        conditions.append(f"({_columns}) > ({', '.join('?' * len(after))})")
+        parameters.extend(after)
+    _sql = f"SELECT * FROM Video JOIN Binding Using(hash){' WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY {_columns}"
+    if limit is not None:
+        _sql += " LIMIT ?"
+        parameters.append(limit)
+    with dbCursor() as cursor:
+        cursor.execute(_sql, parameters)
+        return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in cursor.fetchall())
+
+
+def bindedVideoSortKey(bindedVideo: Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], sort: str = 'episode') -> tuple:
+    '''Return the keyset of a row returned by `queryBindedVideos`'''
+    if sort == 'episode':
+        return bindedVideo[1].animeId, bindedVideo[1].episodeId, bindedVideo[0].hash
+    return bindedVideo[0].hash,
+
+
+def getSpecificEpisodeBindedVideos(episodeId: int) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int], ...]:
+    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video JOIN Binding Using(hash) WHERE episodeId=?", (episodeId,))
+        _fetch = cursor.fetchall()
+        if _fetch is None:
+            return ()
+        return tuple((videoBaseInfoTuple(*eachTuple[:5]), videoBindInfoTuple(*eachTuple[-6:]), eachTuple[5]) for eachTuple in _fetch)
+
+
+def getSpecificBindedVideo(hash: str) -> Tuple[Tuple[videoBaseInfoTuple, videoBindInfoTuple, int]]:
+    '''Return: [0] videoBaseInfoTuple, [1] videoBindInfoTuple, [2] lastWatchTime'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video JOIN Binding Using(hash) WHERE hash=?", (hash,))
+        _fetch = cursor.fetchone()
+        if _fetch is None:
+            return ()# type: ignore
+        return (videoBaseInfoTuple(*_fetch[:5]), videoBindInfoTuple(*_fetch[-6:]), _fetch[5]),
+
+
+def getAllUnBindedVideos(including_ignore:bool = False) -> Tuple[videoBaseInfoTuple, ...]:
+    '''videoBaseInfoTuple: [0] hash, [1] fileName, [2] filePath, [3] fileSize, [4] videoDuration'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Video WHERE hash NOT IN (SELECT hash FROM Binding) and ignore=?", (1 if including_ignore else 0,))
+        return tuple(videoBaseInfoTuple._make(eachTuple[:5]) for eachTuple in cursor.fetchall())
+
+
+def getBindingFromDB(hash: str) -> Optional[videoBindInfoTuple]:
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Binding WHERE hash=?", (hash,))
+        _fetch = cursor.fetchone()
+        return videoBindInfoTuple(*_fetch[1:]) if _fetch is not None else None
+
+
+def getLibraryGeneration() -> int:
+    '''Return the generation of the library, it changes after every write to Video or Binding'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT generation FROM LibraryState")
+        return cursor.fetchone()[0]
+
+
+def getLastWatchTime(hash: str) -> int:
+    with dbCursor() as cursor:
+        cursor.execute("SELECT lastWatchTime FROM Video WHERE hash=?", (hash,))
+        _fetch = cursor.fetchone()
+        return _fetch[0] if _fetch is not None else -1
+
+
+# time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1657941885))
+def updateLastWatchTime(hash: str, lastWatchTime: int) -> None:
+    with dbCursor(commit=True) as cursor:
+        cursor.execute("UPDATE Video SET lastWatchTime=? WHERE hash=?", (lastWatchTime, hash))
+
+
+def getWatchState(hash: str) -> Optional[Tuple[int, int, float]]:
+    '''Return: [0] lastWatchTime, [1] playCount, [2] lastPosition'''
+    with dbCursor() as cursor:
+        cursor.execute("SELECT lastWatchTime, playCount, lastPosition FROM Video WHERE hash=?", (hash,))
+        return cursor.fetchone()
+
+
+def updateWatchStates(states: Sequence[Tuple[str, int, int, Optional[float]]]) -> None:
+    '''eachTuple: [0] hash, [1] lastWatchTime, [2] plays to add, [3] lastPosition, None to keep it\n
+    All the states are written in one transaction'''
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("UPDATE Video SET lastWatchTime=MAX(lastWatchTime, ?), playCount=playCount+?, lastPosition=COALESCE(?, lastPosition) WHERE hash=?",
+                           ((lastWatchTime, plays, lastPosition, hash) for hash, lastWatchTime, plays, lastPosition in states))
+
+
+def clearBrokenVideo() -> Tuple[videoBaseInfoTuple, ...]:
+    broken_videoBaseInfoTuples = tuple(eachTuple for eachTuple in getAllVideos() if not os.path.exists(eachTuple.filePath))
+    with dbCursor(commit=True) as cursor:
+        cursor.executemany("DELETE FROM Video WHERE hash=?", ((eachTuple.hash,) for eachTuple in broken_videoBaseInfoTuples))
+        cursor.executemany("DELETE FROM Binding WHERE hash=?", ((eachTuple.hash,) for eachTuple in broken_videoBaseInfoTuples))
+        # 删除扫描记录，文件重新出现时（如网络共享重新挂载）由扫描重新加入
+        cursor.executemany("DELETE FROM ScanState WHERE filePath=?", ((eachTuple.filePath,) for eachTuple in broken_videoBaseInfoTuples))
+        cursor.execute("DELETE FROM Binding WHERE Binding.hash NOT IN (SELECT Video.hash FROM Video)")
+    return broken_videoBaseInfoTuples
+
+
+def ignoreVideo(hash: str, state:bool = True) -> None:
+    with dbCursor(commit=True) as cursor:
+        cursor.execute("UPDATE Video SET ignore=? WHERE hash=?", (1 if state else 0, hash))
+
+
+def vaildUserIfExists(user: str) -> bool:
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Auth WHERE username=?", (user,))
+        return cursor.fetchone() is not None
+
+
+def vaildPassword(user: str, password: str) -> bool:
+    with dbCursor() as cursor:
+        cursor.execute("SELECT * FROM Auth WHERE username=? AND password=?", (user, password))
+        return cursor.fetchone() is not None
+
+
+def regUser(user: str, password: str) -> None:
+    with dbCursor(commit=True) as cursor:
+        cursor.execute("INSERT INTO Auth VALUES (?, ?)", (user, password))
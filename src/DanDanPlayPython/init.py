@@ -3,9 +3,8 @@ import os
 from shutil import which
 
 import click
-from var_dump import var_dump
 
-from .config import CONFIG, _default_configs
+from .config import CONFIG, _defaultConfigs
 from .database import initDB
 from .unit import AbsPath
 
@@ -28,7 +27,7 @@ def initConfig():
             default=eachConfig[1][0],
             type=AbsPath() if os.path.isabs(f'{eachConfig[1][0]}') else None
         )
-        for eachConfig in _default_configs.items()
+        for eachConfig in _defaultConfigs().items()
     }
     _user_configs['API_TOKEN'] = click.prompt('请输入API访问密钥', type=str) if _user_configs['API_TOKEN_REQUIRED'] else None
     os.environ['INITING'] = 'False'
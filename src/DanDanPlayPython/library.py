@@ -0,0 +1,44 @@
+import gzip
+import threading
+from collections import namedtuple
+from typing import Callable, Optional
+
+from .database import getLibraryGeneration
+from .unit import perProcess
+
+librarySnapshotTuple = namedtuple('librarySnapshotTuple', 'etag, data, gzipped_data')
+
+
+class librarySnapshot():
+    '''媒体库的内存快照：保存序列化后的 JSON 及其 gzip 压缩结果，以数据库中的媒体库版本号作为 ETag；\n
+    版本号未变时直接返回快照，变化后由首个请求重建，其余请求等待同一次重建'''
+
+    def __init__(self, render: Callable[[], bytes]):
+        self.render = render
+        self._snapshot: Optional[librarySnapshotTuple] = None
+        self._lock = threading.Lock()
+
+    def etag(self) -> str:
+        '''Return the ETag of the current library without rendering it'''
+        return f'library-{getLibraryGeneration():x}'
+
+    def get(self, etag: Optional[str] = None) -> librarySnapshotTuple:
+        etag = self.etag() if etag is None else etag
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.etag == etag:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.etag != etag:
+                # 先取版本号再渲染：渲染期间发生的写入会使下次请求的版本号不同，从而再次重建
+                data = self.render()
+                snapshot = self._snapshot = librarySnapshotTuple(etag, data, gzip.compress(data, compresslevel=6))
+            return snapshot
+
+
+_snapshot = perProcess(librarySnapshot)
+
+
+def getLibrarySnapshot(render: Callable[[], bytes]) -> librarySnapshot:
+    '''Return the shared library snapshot of the current process, `render` is only used when it is created'''
+    return _snapshot.get(render)
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+from .config import CONFIG
+from .dandanplayAPI import (getDanmuFilePath, getEpisodesToRefresh,
+                            singleThreadDownloadDanmu)
+from .database import getAllBindedVideos, getDanmuStates
+from .unit import perProcess, singleFlight, videoBindInfoTuple
+
+
+class danmuScheduler():
+    '''API 服务进程内的弹幕后台调度：\n
+    定期预取新绑定或最近观看过但尚无弹幕的剧集，并增量刷新最近观看过的剧集；\n
+    首轮以弹幕记录与弹幕文件判断新绑定：从未下载过弹幕的剧集（包括停机期间绑定的）视为新绑定；\n
+    同一剧集的并发获取（包括请求处理中的即时获取）合并为一次下载'''
+
+    def __init__(self, interval: Optional[int] = None, watched_days: Optional[int] = None, max_workers: Optional[int] = None):
+        self.interval: int = CONFIG.DANMU_SCHEDULER_INTERVAL if interval is None else interval
+        self.watched_days: int = CONFIG.DANMU_REFRESH_WATCHED_DAYS if watched_days is None else watched_days
+        self._executor = ThreadPoolExecutor(CONFIG.DANMU_DOWNLOAD_THREAD_NUM if max_workers is None else max_workers, thread_name_prefix='danmu')
+        self._flights = singleFlight(self._executor)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 上一轮时已绑定的剧集，None 表示尚未运行过，首轮由 `_seedKnownEpisodes` 生成
+        self._known_episodes: Optional[Set[int]] = None
+
+    def _download(self, _videoBindInfoTuple: videoBindInfoTuple, incremental: bool) -> bool:
+        return singleThreadDownloadDanmu(0, True, 1, _videoBindInfoTuple, getDanmuFilePath(_videoBindInfoTuple.episodeId), incremental)
+
+    def fetch(self, _videoBindInfoTuple: videoBindInfoTuple, incremental: bool = False) -> 'Future[bool]':
+        '''Download the danmu of the episode in background, the concurrent calls for the same episode share one future'''
+        return self._flights.submit(_videoBindInfoTuple.episodeId, self._download, _videoBindInfoTuple, incremental)
+
+    def _seedKnownEpisodes(self, episodeIds: Sequence[int]) -> Set[int]:
+        '''The episodes whose danmu has been downloaded before, by the DanmuState table or the danmu file'''
+        return set(getDanmuStates(episodeIds)) | {episodeId for episodeId in episodeIds if os.path.exists(getDanmuFilePath(episodeId))}
+
+    def tick(self) -> Tuple[int, int]:
+        '''Run one round and wait for it, returns: [0] prefetched episodes, [1] episodes failed to refresh'''
+        _now = int(time.time())
+        _episodes: Dict[int, videoBindInfoTuple] = {}
+        _watched: Dict[int, videoBindInfoTuple] = {}
+        for _, _videoBindInfoTuple, _lastWatchTime in getAllBindedVideos():
+            _episodes.setdefault(_videoBindInfoTuple.episodeId, _videoBindInfoTuple)
+            if _lastWatchTime >= _now - self.watched_days * 86400:
+                _watched.setdefault(_videoBindInfoTuple.episodeId, _videoBindInfoTuple)
+        _known = self._seedKnownEpisodes(tuple(_episodes)) if self._known_episodes is None else self._known_episodes
+        _prefetch = {episodeId: _videoBindInfoTuple for episodeId, _videoBindInfoTuple in _episodes.items()
+                     if (episodeId in _watched or episodeId not in _known) and not os.path.exists(getDanmuFilePath(episodeId))}
+        _futures = {episodeId: self.fetch(_videoBindInfoTuple) for episodeId, _videoBindInfoTuple in _prefetch.items()}
+        # 刷新同样经过 `fetch`，与请求处理中的即时获取合并，同一剧集同时只有一次下载
+        _refresh = [self.fetch(_videoBindInfoTuple, incremental=True) for _videoBindInfoTuple in getEpisodesToRefresh(tuple(_videoBindInfoTuple for episodeId, _videoBindInfoTuple in _watched.items() if episodeId not in _prefetch))]
+        wait([*_futures.values(), *_refresh])
+        # 预取失败的剧集下一轮仍视为新绑定
+        self._known_episodes = set(_episodes) - {episodeId for episodeId, future in _futures.items() if future.exception() is not None or not future.result()}
+        return len(_prefetch), sum(1 for future in _refresh if future.exception() is not None or not future.result())
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            # TODO: Logging
+            try:
+                self.tick()
+            except Exception:
+                pass
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='danmu-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=False)
+
+
+_scheduler = perProcess(danmuScheduler)
+
+
+def getDanmuScheduler() -> danmuScheduler:
+    '''Return the shared scheduler of the current process, the background loop is started by `start`'''
+    return _scheduler.get()
@@ -0,0 +1,86 @@
+'''生产模式：以 gunicorn 的 pre-fork 模型运行 API 服务
+
+主进程只负责监听与管理工作进程，不导入 Flask 应用；数据库连接、缓存与后台线程都在工作进程中创建。
+弹幕后台调度只在持有调度锁的一个工作进程中运行，该进程退出后由其它工作进程接替。
+向主进程发送 SIGHUP 可平滑重载工作进程，SIGTERM 会等待进行中的请求完成后退出。
+'''
+import os
+import threading
+from typing import Optional
+
+from .config import CONFIG
+from .database import getConnectionManager, initDB
+
+try:
+    from gunicorn.app.base import BaseApplication
+    _GUNICORN_AVAILABLE = True
+except ImportError:  # 可选依赖：pip install DanDanPlayPython[server]
+    BaseApplication = object  # type: ignore
+    _GUNICORN_AVAILABLE = False
+
+_SCHEDULER_LOCK_FILE = 'scheduler.lock'
+
+
+def productionServerAvailable() -> bool:
+    return _GUNICORN_AVAILABLE
+
+
+def _runSchedulerWhenLeader() -> None:
+    '''阻塞直到取得调度锁，然后在本进程中启动弹幕后台调度；锁在进程退出时由系统释放'''
+    import fcntl
+    fd = os.open(os.path.join(CONFIG.DATA_PATH, _SCHEDULER_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    from .scheduler import getDanmuScheduler
+    getDanmuScheduler().start()
+
+
+def postWorkerInit(worker) -> None:
+    if CONFIG.DANMU_SCHEDULER_ENABLE:
+        threading.Thread(target=_runSchedulerWhenLeader, name='scheduler-leader', daemon=True).start()
+
+
+def workerExit(server, worker) -> None:
+    '''工作进程退出前写入缓冲中的观看记录'''
+    from .watch import peekWatchBuffer
+    # 未记录过观看的进程不必创建缓冲区
+    _buffer = peekWatchBuffer()
+    if _buffer is not None:
+        _buffer.stop()
+
+
+class productionServer(BaseApplication):
+    '''以 gthread 工作进程运行 Flask 应用，应用在各工作进程中导入'''
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from .app import app
+        return app
+
+
+def runProduction(host: str = '0.0.0.0', port: int = 5000, workers: Optional[int] = None, threads: Optional[int] = None) -> None:
+    '''workers/threads: None to use `SERVER_WORKERS`/`SERVER_THREADS`'''
+    if not _GUNICORN_AVAILABLE:
+        raise RuntimeError('生产模式需要 gunicorn：pip install DanDanPlayPython[server]')
+    # 在 fork 之前完成数据库升级，并关闭主进程的连接，避免工作进程继承
+    initDB()
+    getConnectionManager().closeAll()
+    workers = workers or CONFIG.SERVER_WORKERS or os.cpu_count() or 1
+    productionServer({
+        'bind': f'[{host}]:{port}' if ':' in host else f'{host}:{port}',
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': threads or CONFIG.SERVER_THREADS,
+        'backlog': CONFIG.SERVER_BACKLOG,
+        'keepalive': CONFIG.SERVER_KEEPALIVE,
+        'timeout': CONFIG.SERVER_TIMEOUT,
+        'graceful_timeout': CONFIG.SERVER_GRACEFUL_TIMEOUT,
+        'post_worker_init': postWorkerInit,
+        'worker_exit': workerExit,
+    }).run()
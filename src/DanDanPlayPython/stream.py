@@ -0,0 +1,193 @@
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+from flask import Request, Response
+from werkzeug.http import http_date
+from werkzeug.wsgi import wrap_file
+
+from .database import getVideoFromDB
+from .unit import perProcess
+
+# 分块读取时每次读取的字节数
+STREAM_CHUNK_SIZE = 256 * 1024
+# 多段请求的段数上限，超过时忽略 Range 返回整个文件
+MAX_RANGES = 16
+PATH_CACHE_SIZE = 1024
+# 路径缓存的有效期，文件被移动或删除时会提前失效
+PATH_CACHE_TTL = 300
+
+
+def parseRange(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    '''Parse the Range header into [start, end) byte ranges, sorted and merged\n
+    Return None if there is no Range header or it is invalid (the whole file should be sent), [] if it is not satisfiable'''
+    if not header:
+        return None
+    units, _, specs = header.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not first:
+                # 后缀范围：最后 n 个字节
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                start, end = max(0, size - suffix), size
+                if suffix == 0:
+                    continue
+            else:
+                start = int(first)
+                end = size if not last else min(size, int(last) + 1)
+                if start < 0 or (last and int(last) < start):
+                    return None
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def readFileRange(file_path: str, start: int, end: int, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    '''Yield [start, end) of the file in chunks of at most `chunk_size` bytes'''
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+class videoPathCache():
+    '''hash → (文件路径, 过期时间) 的 LRU 缓存，避免每个 Range 请求都查询数据库；\n
+    文件不存在时（被移动或删除）重新查询数据库'''
+
+    def __init__(self, max_entries: int = PATH_CACHE_SIZE, ttl: int = PATH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, hash: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(hash)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[hash]
+                return None
+            self._entries.move_to_end(hash)
+            return entry[0]
+
+    def _remember(self, hash: str, file_path: str) -> None:
+        with self._lock:
+            self._entries[hash] = (file_path, time.monotonic() + self.ttl)
+            self._entries.move_to_end(hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def resolve(self, hash: str) -> Optional[Tuple[str, os.stat_result]]:
+        '''Return (filePath, stat) of the video, None if it is not in the DB or the file does not exist'''
+        file_path = self._lookup(hash)
+        if file_path is not None:
+            try:
+                return file_path, os.stat(file_path)
+            except FileNotFoundError:
+                with self._lock:
+                    self._entries.pop(hash, None)
+        _videoBaseInfoTuple = getVideoFromDB(hash)
+        if _videoBaseInfoTuple is None:
+            return None
+        try:
+            _stat = os.stat(_videoBaseInfoTuple.filePath)
+        except FileNotFoundError:
+            return None
+        self._remember(hash, _videoBaseInfoTuple.filePath)
+        return _videoBaseInfoTuple.filePath, _stat
+
+
+_cache = perProcess(videoPathCache)
+
+
+def getVideoPathCache() -> videoPathCache:
+    '''Return the shared path cache of the current process'''
+    return _cache.get()
+
+
+def _multipartRanges(file_path: str, ranges: List[Tuple[int, int]], size: int, mimetype: str, boundary: str) -> Tuple[int, Iterator[bytes]]:
+    '''Return (Content-Length, body) of a multipart/byteranges response'''
+    heads = [f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{end - 1}/{size}\r\n\r\n'.encode('ascii') for start, end in ranges]
+    tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+    def body() -> Iterator[bytes]:
+        for head, (start, end) in zip(heads, ranges):
+            yield head
+            yield from readFileRange(file_path, start, end)
+        yield tail
+    return sum(len(head) for head in heads) + sum(end - start for start, end in ranges) + len(tail), body()
+
+
+def streamResponse(request: Request, file_path: str, _stat: os.stat_result) -> Response:
+    '''Serve the file with Range/If-Range support. Ranges that reach the end of the file (or any single range under gunicorn)
+    are passed to `wsgi.file_wrapper`, so servers which support it can use `os.sendfile`; the other ranges are read in bounded chunks'''
+    size = _stat.st_size
+    etag = f'{_stat.st_ino:x}-{_stat.st_mtime_ns:x}-{size:x}'
+    last_modified = int(_stat.st_mtime)
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    ranges = parseRange(request.headers.get('Range'), size)
+    if ranges is not None and 'If-Range' in request.headers:
+        # If-Range 与当前文件不符时忽略 Range，返回整个文件
+        if_range = request.if_range
+        if (if_range.etag is not None and if_range.etag != etag) or (if_range.date is not None and int(if_range.date.timestamp()) != last_modified) or (if_range.etag is None and if_range.date is None):
+            ranges = None
+    if ranges is not None and len(ranges) > MAX_RANGES:
+        ranges = None
+
+    if ranges == []:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+    elif ranges is not None and len(ranges) > 1:
+        boundary = uuid.uuid4().hex
+        length, body = _multipartRanges(file_path, ranges, size, mimetype, boundary)
+        response = Response(body, status=206, mimetype=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
+        response.content_length = length
+    else:
+        start, end = (0, size) if ranges is None else ranges[0]
+        # gunicorn 按 Content-Length 截断 file_wrapper，可对有界范围同样使用 sendfile
+        if end == size or request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn/'):
+            f = open(file_path, 'rb')
+            f.seek(start)
+            body = wrap_file(request.environ, f, STREAM_CHUNK_SIZE)
+        else:
+            body = readFileRange(file_path, start, end)
+        response = Response(body, status=200 if ranges is None else 206, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = end - start
+        if ranges is not None:
+            response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Last-Modified'] = http_date(last_modified)
+    response.set_etag(etag)
+    return response
@@ -1,30 +1,178 @@
+import contextlib
+import hashlib
+import mmap
 import os
 import threading
 from collections import namedtuple
-from typing import Any, Callable, Optional
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generic, Hashable, Optional, TypeVar
 
 import click
-import tqdm
+
+if TYPE_CHECKING:
+    # 仅用于类型标注，避免 config 等轻量模块在导入时加载 tqdm
+    import tqdm
 
 # from var_dump import var_dump
 
 videoBaseInfoTuple = namedtuple('videoBaseInfoTuple', 'hash, fileName, filePath, fileSize, videoDuration')
 videoBindInfoTuple = namedtuple('videoBindInfoTuple', 'animeId, episodeId, animeTitle, episodeTitle, type, typeDescription, shift', defaults=(0,))
+scanEntryTuple = namedtuple('scanEntryTuple', 'filePath, inode, mtime, size')
+scanResultTuple = namedtuple('scanResultTuple', 'added, removed, changed, moved')
 
+_T = TypeVar('_T')
 
-class universeThread(threading.Thread):
-    def __init__(self, name: str, func: Callable, lock: threading.Lock, *args, tqdm_obj: Optional[tqdm.tqdm] = None, **kw):
-        threading.Thread.__init__(self)
-        self.name, self.func, self.lock, self.tqdm_obj, self.args, self.kw = name, func, lock, tqdm_obj, args, kw
+HASH_HEAD_SIZE = 16777216  # 16 * 1024 * 1024
+_HASH_CHUNK_SIZE = 1048576  # 1 MiB
+_hash_local = threading.local()
 
-    def run(self):
-        self.lock.acquire()
-        if self.tqdm_obj is not None:
-            self.tqdm_obj.set_description(self.name)
-        self.func(*self.args, **self.kw)
+
+def _fadvise(fd: int, length: int, advice_name: str) -> None:
+    advice = getattr(os, advice_name, None)
+    if advice is None:
+        return
+    with contextlib.suppress(OSError):
+        os.posix_fadvise(fd, 0, length, advice)
+
+
+def _readintoMD5(f, length: int) -> str:
+    # 每个线程复用一块 1 MiB 缓冲区，并行哈希时内存占用为 线程数 * 1 MiB
+    buffer = getattr(_hash_local, 'buffer', None)
+    if buffer is None:
+        buffer = _hash_local.buffer = memoryview(bytearray(_HASH_CHUNK_SIZE))
+    md5 = hashlib.md5()
+    while length > 0:
+        n = f.readinto(buffer[:min(length, _HASH_CHUNK_SIZE)])
+        if not n:
+            break
+        md5.update(buffer[:n])
+        length -= n
+    return md5.hexdigest().upper()
+
+
+def hashFileHead(file_path: str, size: int = HASH_HEAD_SIZE, use_mmap: bool = False) -> str:
+    '''Return the upper-case md5 of the first `size` bytes of the file.\n
+    use_mmap: 使用 mmap 零拷贝读取，否则使用复用缓冲区的 readinto；读取完成后通知内核丢弃这部分页缓存，避免挤占串流所用的缓存'''
+    with open(file_path, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        length = min(os.fstat(fd).st_size, size)
+        _fadvise(fd, length, 'POSIX_FADV_SEQUENTIAL')
+        try:
+            if use_mmap and length > 0:
+                with contextlib.suppress(OSError, ValueError):
+                    with mmap.mmap(fd, length, access=mmap.ACCESS_READ) as _mmap:
+                        return hashlib.md5(_mmap).hexdigest().upper()  # type: ignore
+            return _readintoMD5(f, length)
+        finally:
+            _fadvise(fd, length, 'POSIX_FADV_DONTNEED')
+
+
+class universeExecutor():
+    '''有界线程池：`submit` 在排队任务已满时阻塞（背压），每个任务返回一个 `Future`，\n
+    任务异常保存在各自的 `Future` 中，进度统一在任务结束时上报给 `tqdm_obj`'''
+
+    def __init__(self, max_workers: int, tqdm_obj: Optional['tqdm.tqdm'] = None, queue_size: Optional[int] = None):
+        self.tqdm_obj = tqdm_obj
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # 同时在执行或排队中的任务数上限，默认为线程数的两倍
+        self._slots = threading.BoundedSemaphore(max_workers + (max_workers if queue_size is None else queue_size))
+        self._progress_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _run(self, name: str, func: Callable, args: tuple, kw: dict) -> Any:
         if self.tqdm_obj is not None:
+            with self._progress_lock:
+                self.tqdm_obj.set_description(name)
+        return func(*args, **kw)
+
+    def _done(self, _future: Future) -> None:
+        self._slots.release()
+        self.progress()
+
+    def progress(self, name: Optional[str] = None) -> None:
+        '''上报一次进度，跳过的任务也应调用此方法'''
+        if self.tqdm_obj is None:
+            return
+        with self._progress_lock:
+            if name is not None:
+                self.tqdm_obj.set_description(name)
             self.tqdm_obj.update()
-        self.lock.release()
+
+    def submit(self, name: str, func: Callable, *args, **kw) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, name, func, args, kw)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class singleFlight():
+    '''同一 key 的并发调用只执行一次：执行期间再次提交的调用方共享同一个 `Future`，结束后 key 即被释放'''
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self._futures: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, func: Callable, *args, **kw) -> Future:
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(func, *args, **kw)
+            self._futures[key] = future
+        future.add_done_callback(lambda _future: self._forget(key, _future))
+        return future
+
+    def _forget(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def inFlight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._futures
+
+
+class perProcess(Generic[_T]):
+    '''每个进程一个共享实例：首次 `get` 时由 `factory` 创建，多个线程同时首次调用也只创建一次；\n
+    fork 之后子进程不复用父进程的实例（其中的连接、线程与锁在子进程中不可用），而是在首次 `get` 时重新创建'''
+
+    def __init__(self, factory: Callable[..., _T], stale: Optional[Callable[[_T], bool]] = None):
+        '''stale: 返回 True 时丢弃已有实例并重新创建'''
+        self.factory, self.stale = factory, stale
+        self._instance: Optional[_T] = None
+        self._pid = -1
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # fork 时锁可能正被父进程的其它线程持有，子进程中换用新锁
+            os.register_at_fork(after_in_child=self._afterFork)
+
+    def _afterFork(self) -> None:
+        self._lock = threading.Lock()
+
+    def get(self, *args, **kw) -> _T:
+        '''Return the instance of the current process, `args` and `kw` are only passed to `factory` when it is created'''
+        with self._lock:
+            if self._instance is None or self._pid != os.getpid() or (self.stale is not None and self.stale(self._instance)):
+                self._instance, self._pid = self.factory(*args, **kw), os.getpid()
+            return self._instance
+
+    def peek(self) -> Optional[_T]:
+        '''Return the instance of the current process without creating it, None if it has not been created'''
+        with self._lock:
+            return self._instance if self._pid == os.getpid() else None
 
 
 class AbsPath(click.ParamType):
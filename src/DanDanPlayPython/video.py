@@ -1,177 +1,635 @@
-import hashlib
-import mimetypes
-import os
-import pathlib
-import subprocess
-import threading
-import time
-from typing import Iterable, List, Optional, Sequence, Tuple, Union
-
-import tqdm
-from pymediainfo import MediaInfo
-
-from .config import CONFIG
-from .database import addVideosIntoDB, getAllVideos, getAllBindedVideos
-from .unit import universeThread, videoBaseInfoTuple
-
-# from var_dump import var_dump
-
-
-
-def checkIfVideo(file_path: str) -> bool:
-    if not os.path.isfile(file_path):
-        return False
-    try:
-        guess = mimetypes.guess_type(file_path)[0]
-        return guess.startswith('video') if guess is not None else False
-    except FileNotFoundError:
-        return False
-
-
-def fiddlerVideosFromFiles(files: Iterable) -> Tuple[Tuple, Tuple]:
-    '''input: a list of file path\n
-    output: a tuple of (video_paths, not_video_paths)'''
-    return tuple(file for file in files if checkIfVideo(file)), tuple(file for file in files if not checkIfVideo(file))
-
-
-def fiddlerExistVideoPaths(video_paths: Iterable) -> Tuple:
-    '''input: a list of file path\n
-    output: a Tuple of video_paths which not in the DB'''
-    exists = {exist_path[2] for exist_path in getAllVideos()}
-    return tuple(paths for paths in video_paths if paths not in exists)
-
-
-def getVideoHash(video_path: str) -> str:
-    'path must exist'
-    try:
-        with open(video_path, "rb") as f:
-            # 16 * 1024 * 1024 = 16777216
-            return hashlib.md5(f.read(16777216)).hexdigest().upper()
-    except FileNotFoundError:
-        return ''
-
-
-def getVideoDuration(video_path: str) -> int:
-    '''path must exist'''
-    try:
-        _videoinfo = MediaInfo.parse(video_path)
-    except FileNotFoundError:
-        return -1
-    return int(float(_videoinfo.video_tracks[0].duration)/1000)  # type: ignore
-
-
-def getFileName(path: str, with_extension: bool = False) -> str:
-    '''path must exist'''
-    try:
-        return pathlib.Path(path).name if with_extension else pathlib.Path(path).stem
-    except FileNotFoundError:
-        return ''
-
-
-def getFileSize(path):
-    '''path must exist'''
-    try:
-        return os.path.getsize(path)
-    except FileNotFoundError:
-        return -1
-
-
-def getVideoBasicInformation(each_path: str, callback_list:list = None) -> Tuple[str, str, str, str]: # type: ignore
-    '''Return a tuple of (hash, duration, size)'''
-    _hash = getVideoHash(each_path)
-    _duration = getVideoDuration(each_path)
-    _filename = getFileName(each_path)
-    _size = getFileSize(each_path)
-    if callback_list is not None:
-        callback_list.append((_hash, _filename, each_path, f'{_size}', f'{_duration}'))
-    return _hash, f'{_duration}', _filename, f'{_size}'
-
-
-def getVideosFromPath(folderPath: str) -> List[str]:
-    '''Return a list of video file names in the path, including subfolders'''
-    file_list: List[str] = []
-    for root, _, files in os.walk(folderPath):
-        file_list += (os.path.join(root, path) for path in files if checkIfVideo(os.path.join(root, path)))
-    return file_list
-
-def mulitThreadPushVideoBaseInfo2DB(video_paths:Sequence[str], tqdm_obj:Optional[tqdm.tqdm]) -> Tuple[Tuple[str, str, str, str, str], ...]:
-    information_list:List[Tuple[str, str, str, str, str]] = []
-    locks = [threading.Lock() for _ in range(CONFIG.PUSH_VIDEO_THREAD_NUM)]
-    for each_path in video_paths:
-        while all(lock.locked() for lock in locks):
-            time.sleep(0.1)
-        lock = [lock for lock in locks if not lock.locked()][0]
-        _filename = getFileName(each_path)
-        universeThread(_filename, getVideoBasicInformation, lock, each_path, callback_list=information_list, tqdm_obj=tqdm_obj).start()
-    [lock.acquire(blocking=True) for lock in locks]
-    return tuple(information_list)
-
-def pushVideoBaseInfo2DB(video_path: Union[str, Sequence[str]], path_is_prechecked: bool = False, show_progress: bool = False, is_dir: bool = False) -> Tuple[bool, Tuple]:
-    '''video_path can be a string of single path or a list of path\n
-    If success, return True, otherwise return False, and the failed path(s)'''
-    if is_dir:
-        if isinstance(video_path, str):
-            video_path = (video_path,)
-        video_path = [each_video_path for each_dir in video_path for each_video_path in getVideosFromPath(each_dir)]# type: ignore
-        path_is_prechecked = True
-    if isinstance(video_path, str):
-        video_path = (video_path,)
-    video_path = fiddlerExistVideoPaths(video_path)
-    if not path_is_prechecked:
-        video_path, failed_path = fiddlerVideosFromFiles(video_path)
-    else:
-        failed_path = ()
-    tqdm_obj = tqdm.tqdm(video_path) if show_progress else None
-    if CONFIG.PUSH_VIDEO_THREAD_NUM == 1:
-        information_list: List[Tuple[str, str, str, str, str]] = []
-        for each_path in video_path:
-            _hash, _duration, _filename, _size = getVideoBasicInformation(each_path)
-            information_list.append((_hash, _filename, each_path, _size, _duration))
-            if show_progress:
-                tqdm_obj.set_description(_filename)  # type: ignore
-                tqdm_obj.update()  # type: ignore
-    else:
-        information_list = mulitThreadPushVideoBaseInfo2DB(video_path, tqdm_obj)# type: ignore
-    addVideosIntoDB(information_list)
-    return not bool(failed_path), failed_path
-
-
-def multiThreadCreateThumbnail(_videoBaseInfoTuples:Sequence[videoBaseInfoTuple], size:str = '400*225', show_progress:bool = False, cover:bool = False) -> None:
-    locks = [threading.Lock() for _ in range(CONFIG.THUMBNAIL_THREAD_NUM)]
-    tqdm_obj = tqdm.tqdm(_videoBaseInfoTuples) if show_progress else None
-    for eachTuple in _videoBaseInfoTuples:
-        img_path = os.path.join(CONFIG.THUMBNAIL_PATH, f'{eachTuple.hash}{CONFIG.THUMBNAIL_SUFFIX}')
-        if(not cover and os.path.exists(img_path)):
-            if show_progress:
-                tqdm_obj.set_description(f'{eachTuple.fileName}')  # type: ignore
-                tqdm_obj.update()  # type: ignore
-            continue
-        video_path:str = eachTuple.filePath
-        timing:int = int(float(eachTuple.videoDuration)/5)
-        args = [CONFIG.FFMPEG_PATH, '-loglevel', 'quiet', '-ss', f'{timing}', '-i', video_path, '-y', '-f', CONFIG.THUMBNAIL_FORMAT, '-t', '1', '-r', '1', '-s', size, img_path]
-        while all(lock.locked() for lock in locks):
-            time.sleep(0.1)
-        lock = [lock for lock in locks if not lock.locked()][0]
-        universeThread(eachTuple.fileName, subprocess.run, lock, args, tqdm_obj=tqdm_obj).start()
-    [lock.acquire(blocking=True) for lock in locks]
-
-
-def createThumbnail(_videoBaseInfoTuple: Optional[Union[videoBaseInfoTuple, Sequence[videoBaseInfoTuple]]] == None, size:str = '400*225', show_progress:bool = False, cover:bool = False) -> None: # type: ignore
-    if _videoBaseInfoTuple is None:
-        _videoBaseInfoTuple = tuple(each[0] for each in getAllBindedVideos())
-    if isinstance(_videoBaseInfoTuple, videoBaseInfoTuple):
-        _videoBaseInfoTuple = (_videoBaseInfoTuple,)
-    if show_progress:
-        _videoBaseInfoTuple = tqdm.tqdm(_videoBaseInfoTuple)
-    if CONFIG.THUMBNAIL_THREAD_NUM == 1:
-        for eachTuple in _videoBaseInfoTuple:
-            if show_progress:
-                _videoBaseInfoTuple.set_description(f'{eachTuple.fileName}')# type: ignore
-            img_path = os.path.join(CONFIG.THUMBNAIL_PATH, f'{eachTuple.hash}{CONFIG.THUMBNAIL_SUFFIX}')
-            if(not cover and os.path.exists(img_path)):
-                continue
-            video_path:str = eachTuple.filePath
-            timing:int = int(float(eachTuple.videoDuration)/5)
-            subprocess.call([CONFIG.FFMPEG_PATH, '-loglevel', 'quiet', '-ss', f'{timing}', '-i', video_path, '-y', '-f', CONFIG.THUMBNAIL_FORMAT, '-t', '1', '-r', '1', '-s', size, img_path])
-    else:
-        multiThreadCreateThumbnail(_videoBaseInfoTuple, size, show_progress, cover)
+import functools
+import mimetypes
+import multiprocessing
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import tqdm
+
+from .config import CONFIG
+from .database import (addVideosIntoDB, deleteScanStates, deleteVideosByHashes,
+                       getAllBindedVideos, getExistVideoPaths, getScanStates,
+                       getVideoHashesByPaths, moveVideoPaths, updateScanStates,
+                       updateVideoFileSizes)
+from .unit import (hashFileHead, perProcess, scanEntryTuple, scanResultTuple,
+                   singleFlight, universeExecutor, videoBaseInfoTuple)
+
+# from var_dump import var_dump
+
+
+
+def guessIfVideo(file_path: str) -> bool:
+    '''Only guess by the file name, without touching the file'''
+    guess = mimetypes.guess_type(file_path)[0]
+    return guess.startswith('video') if guess is not None else False
+
+
+def checkIfVideo(file_path: str) -> bool:
+    if not os.path.isfile(file_path):
+        return False
+    try:
+        return guessIfVideo(file_path)
+    except FileNotFoundError:
+        return False
+
+
+def fiddlerVideosFromFiles(files: Iterable) -> Tuple[Tuple, Tuple]:
+    '''input: a list of file path\n
+    output: a tuple of (video_paths, not_video_paths)'''
+    return tuple(file for file in files if checkIfVideo(file)), tuple(file for file in files if not checkIfVideo(file))
+
+
+def fiddlerExistVideoPaths(video_paths: Iterable) -> Tuple:
+    '''input: a list of file path\n
+    output: a Tuple of video_paths which not in the DB'''
+    video_paths = tuple(video_paths)
+    exists = getExistVideoPaths(video_paths)
+    return tuple(paths for paths in video_paths if paths not in exists)
+
+
+def getVideoHash(video_path: str) -> str:
+    'path must exist'
+    try:
+        return hashFileHead(video_path)
+    except FileNotFoundError:
+        return ''
+
+
+def getVideoDuration(video_path: str) -> int:
+    '''path must exist'''
+    # pymediainfo 导入较慢，仅在解析时导入
+    from pymediainfo import MediaInfo
+    try:
+        _videoinfo = MediaInfo.parse(video_path)
+    except FileNotFoundError:
+        return -1
+    return int(float(_videoinfo.video_tracks[0].duration)/1000)  # type: ignore
+
+
+def _probeDurationBatch(video_paths: Sequence[str]) -> List[Tuple[str, Optional[int]]]:
+    '''Run in the process pool, return None for the files which failed to parse'''
+    results: List[Tuple[str, Optional[int]]] = []
+    for each_path in video_paths:
+        try:
+            results.append((each_path, getVideoDuration(each_path)))
+        except Exception:
+            results.append((each_path, None))
+    return results
+
+
+class metadataProber():
+    '''视频时长解析后端：`METADATA_PROCESS_NUM` 为 0 时在调用线程中逐个解析，\n
+    否则按 `METADATA_BATCH_SIZE` 分批交给进程池，结果按完成顺序流式返回；\n
+    MediaInfo 崩溃导致进程池损坏时，重建进程池并逐个重试受影响的文件，仍然崩溃的文件返回 None'''
+
+    def __init__(self, process_num: Optional[int] = None, batch_size: Optional[int] = None):
+        self.process_num: int = CONFIG.METADATA_PROCESS_NUM if process_num is None else process_num
+        self.batch_size: int = CONFIG.METADATA_BATCH_SIZE if batch_size is None else batch_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _getPool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 入库时还有其它线程在运行，使用 spawn 避免 fork 继承被持有的锁
+            self._pool = ProcessPoolExecutor(self.process_num, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _retry(self, batch: Sequence[str]) -> Iterator[Tuple[str, Optional[int]]]:
+        for each_path in batch:
+            pool = self._getPool()
+            try:
+                yield from pool.submit(_probeDurationBatch, (each_path,)).result()
+            except BrokenProcessPool:
+                self._discard(pool)
+                yield each_path, None
+            except Exception:
+                yield each_path, None
+
+    def _collect(self, pending: Dict[Future, Tuple[Sequence[str], ProcessPoolExecutor]]) -> Iterator[Tuple[str, Optional[int]]]:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            batch, pool = pending.pop(future)
+            try:
+                yield from future.result()
+            except BrokenProcessPool:
+                self._discard(pool)
+                yield from self._retry(batch)
+            except Exception:
+                # 其它异常只影响这一批文件，不中断整个解析
+                yield from ((each_path, None) for each_path in batch)
+
+    def probe(self, video_paths: Iterable[str]) -> Iterator[Tuple[str, Optional[int]]]:
+        '''Yield (path, duration) in completion order'''
+        if self.process_num == 0:
+            for each_path in video_paths:
+                yield from _probeDurationBatch((each_path,))
+            return
+        pending: Dict[Future, Tuple[Sequence[str], ProcessPoolExecutor]] = {}
+        batch: List[str] = []
+        for each_path in video_paths:
+            batch.append(each_path)
+            if len(batch) < self.batch_size:
+                continue
+            pool = self._getPool()
+            pending[pool.submit(_probeDurationBatch, batch)] = (batch, pool)
+            batch = []
+            # 每个进程最多排队两批，保持结果持续流出
+            while len(pending) >= self.process_num * 2:
+                yield from self._collect(pending)
+        if batch:
+            pool = self._getPool()
+            pending[pool.submit(_probeDurationBatch, batch)] = (batch, pool)
+        while pending:
+            yield from self._collect(pending)
+
+
+def getFileName(path: str, with_extension: bool = False) -> str:
+    '''path must exist'''
+    try:
+        return pathlib.Path(path).name if with_extension else pathlib.Path(path).stem
+    except FileNotFoundError:
+        return ''
+
+
+def getFileSize(path) -> int:
+    '''path must exist'''
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return -1
+
+
+def getVideoBasicInformation(each_path: str, with_duration: bool = True) -> Tuple[str, int, str, int]:
+    '''Return a tuple of (hash, duration, filename, size)\n
+    with_duration: If False, duration is -1 and should be filled by `metadataProber`'''
+    _hash = getVideoHash(each_path)
+    _duration = getVideoDuration(each_path) if with_duration else -1
+    _filename = getFileName(each_path)
+    _size = getFileSize(each_path)
+    return _hash, _duration, _filename, _size
+
+
+def getVideoInsertTuple(each_path: str, with_duration: bool = True) -> Tuple[str, str, str, int, int]:
+    '''Return a tuple of (hash, fileName, filePath, fileSize, videoDuration)'''
+    _hash, _duration, _filename, _size = getVideoBasicInformation(each_path, with_duration)
+    return _hash, _filename, each_path, _size, _duration
+
+
+def getVideosFromPath(folderPath: str) -> List[str]:
+    '''Return a list of video file names in the path, including subfolders'''
+    file_list: List[str] = []
+    for root, _, files in os.walk(folderPath):
+        file_list += (os.path.join(root, path) for path in files if checkIfVideo(os.path.join(root, path)))
+    return file_list
+
+def walkVideoFiles(folderPath: str) -> Iterator[scanEntryTuple]:
+    '''Yield the fingerprint of every video file in the path, including subfolders, with one stat per video file'''
+    stack = [folderPath]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif guessIfVideo(entry.name) and entry.is_file():
+                        _stat = entry.stat()
+                        yield scanEntryTuple(entry.path, _stat.st_ino, _stat.st_mtime_ns, _stat.st_size)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+
+
+def _hashEntries(entries: Sequence[scanEntryTuple]) -> Dict[str, str]:
+    '''Return {filePath: hash} of the entries, the files which can not be read are left out'''
+    if not entries:
+        return {}
+    with ThreadPoolExecutor(max_workers=CONFIG.PUSH_VIDEO_THREAD_NUM) as executor:
+        hashes = dict(zip((entry.filePath for entry in entries), executor.map(getVideoHash, (entry.filePath for entry in entries))))
+    return {each_path: _hash for each_path, _hash in hashes.items() if _hash}
+
+
+def scanLibrary(folder_paths: Union[str, Sequence[str]]) -> scanResultTuple:
+    '''Compare the files under `folder_paths` with the ScanState table.\n
+    Moved / renamed files (same inode, size and mtime, or same head hash when only the mtime differs) are re-pointed in the DB without rehashing,
+    files already in the DB without a ScanState are adopted.
+    Files whose fingerprint changed are rehashed: if the hash is unchanged the DB row is kept with its watch state and binding,
+    otherwise the old video and its binding are removed and the file is pushed again.
+    The videos and bindings of removed files are deleted, unless their folder is missing or has no video at all (e.g. an unmounted share).\n
+    Return: scanResultTuple(added: Tuple[scanEntryTuple], removed: Tuple[str], changed: Tuple[scanEntryTuple], moved: Tuple[Tuple[str, str]])'''
+    if isinstance(folder_paths, str):
+        folder_paths = (folder_paths,)
+    roots = tuple(os.path.abspath(each_path) for each_path in folder_paths)
+    known_by_root = {root: getScanStates(root) for root in roots}
+    known: Dict[str, Tuple[int, int, int, str]] = {}
+    for states in known_by_root.values():
+        known.update(states)
+    seen = set()
+    available_roots = set()
+    new_entries: List[scanEntryTuple] = []
+    touched: List[scanEntryTuple] = []
+    for root in roots:
+        for entry in walkVideoFiles(root):
+            available_roots.add(root)
+            if entry.filePath in seen:
+                continue
+            seen.add(entry.filePath)
+            state = known.get(entry.filePath)
+            if state is None:
+                new_entries.append(entry)
+            elif tuple(state[:3]) != (entry.inode, entry.mtime, entry.size):
+                touched.append(entry)
+    # 目录不存在或其中没有任何视频时多半是网络共享未挂载，保留其中的视频
+    removed = {each_path: state for root in available_roots for each_path, state in known_by_root[root].items() if each_path not in seen}
+    removed_fingerprints = {(state[0], state[2]): each_path for each_path, state in removed.items()}
+    # 删除后 inode 可能被新文件复用：mtime 也相同才直接视为移动，否则比较头部哈希
+    candidates = [(removed_fingerprints.pop((entry.inode, entry.size)), entry) for entry in new_entries if (entry.inode, entry.size) in removed_fingerprints]
+    candidate_hashes = _hashEntries(tuple(entry for old_path, entry in candidates if removed[old_path][1] != entry.mtime))
+    moved: List[Tuple[str, scanEntryTuple, str]] = []
+    for old_path, entry in candidates:
+        _hash = removed[old_path][3]
+        if removed[old_path][1] == entry.mtime or candidate_hashes.get(entry.filePath) == _hash:
+            moved.append((old_path, entry, _hash))
+            del removed[old_path]
+    moved_paths = {entry.filePath for _, entry, _ in moved}
+    unmoved = tuple(entry for entry in new_entries if entry.filePath not in moved_paths)
+    exist_hashes = getVideoHashesByPaths(tuple(entry.filePath for entry in (*unmoved, *touched)))
+    added = tuple(entry for entry in unmoved if entry.filePath not in exist_hashes)
+    # 指纹变化（touch、保持大小的标签编辑等）不一定意味着内容变化：哈希不变时原地更新，保留观看记录与绑定
+    touched_hashes = _hashEntries(touched)
+    unchanged = tuple(entry for entry in touched if entry.filePath in touched_hashes and touched_hashes[entry.filePath] == exist_hashes.get(entry.filePath))
+    changed = tuple(entry for entry in touched if entry.filePath in touched_hashes and touched_hashes[entry.filePath] != exist_hashes.get(entry.filePath))
+    moveVideoPaths(tuple((old_path, entry.filePath, getFileName(entry.filePath)) for old_path, entry, _ in moved))
+    updateVideoFileSizes(tuple((entry.filePath, entry.size) for entry in unchanged))
+    deleteVideosByHashes((*(exist_hashes[entry.filePath] for entry in changed if entry.filePath in exist_hashes), *(state[3] for state in removed.values())))
+    deleteScanStates((*removed, *(old_path for old_path, _, _ in moved)))
+    updateScanStates((
+        *((*entry, _hash) for _, entry, _hash in moved),
+        *((*entry, exist_hashes[entry.filePath]) for entry in (*unmoved, *unchanged) if entry.filePath in exist_hashes),
+    ))
+    return scanResultTuple(added, tuple(removed), changed, tuple((old_path, entry.filePath) for old_path, entry, _ in moved))
+
+
+class ingestPipeline():
+    '''入库流水线：路径 → 过滤 → 哈希（线程池）→ 时长解析（线程或进程池）→ 写入线程分批提交\n
+    各阶段之间使用有界队列衔接，结果在扫描过程中即分批写入数据库，内存占用不随视频数量增长'''
+
+    def __init__(self, tqdm_obj: Optional[tqdm.tqdm] = None, fingerprints: Optional[Dict[str, scanEntryTuple]] = None, batch_size: Optional[int] = None):
+        self.tqdm_obj = tqdm_obj
+        self.fingerprints = {} if fingerprints is None else fingerprints
+        self.batch_size: int = CONFIG.PUSH_VIDEO_BATCH_SIZE if batch_size is None else batch_size
+        self.probe_in_process = CONFIG.METADATA_PROCESS_NUM > 0
+        self.written = 0
+        self._failed: List[str] = []
+        self._lock = threading.Lock()
+        self._probing: Dict[str, Tuple[str, str, str, int, int]] = {}
+        self._probe_queue: queue.Queue = queue.Queue(maxsize=CONFIG.METADATA_PROCESS_NUM * CONFIG.METADATA_BATCH_SIZE * 2 + 1)
+        self._write_queue: queue.Queue = queue.Queue(maxsize=self.batch_size * 2)
+        self._probe_closed = False
+        self._error: Optional[BaseException] = None
+
+    def _fail(self, each_path: str) -> None:
+        with self._lock:
+            self._failed.append(each_path)
+
+    def _filter(self, video_paths: Iterable[str], path_is_prechecked: bool) -> Iterator[Tuple[str, bool]]:
+        '''Yield (path, is_new), the paths which are not videos are marked as failed'''
+        seen = set()
+        video_paths = iter(video_paths)
+        while True:
+            _chunk = tuple(each_path for _, each_path in zip(range(500), video_paths) if each_path not in seen)
+            if not _chunk:
+                return
+            seen.update(_chunk)
+            exists = getExistVideoPaths(_chunk)
+            for each_path in _chunk:
+                if each_path in exists:
+                    yield each_path, False
+                elif not path_is_prechecked and not checkIfVideo(each_path):
+                    self._fail(each_path)
+                    yield each_path, False
+                else:
+                    yield each_path, True
+
+    def _hashed(self, each_path: str, future: Future) -> None:
+        if future.exception() is not None:
+            self._fail(each_path)
+            return
+        if not self.probe_in_process:
+            self._write_queue.put(future.result())
+            return
+        with self._lock:
+            self._probing[each_path] = future.result()
+        self._probe_queue.put(each_path)
+
+    def _probePaths(self) -> Iterator[str]:
+        yield from iter(self._probe_queue.get, None)
+        self._probe_closed = True
+
+    def _probeWorker(self) -> None:
+        try:
+            with metadataProber() as prober:
+                for each_path, _duration in prober.probe(self._probePaths()):
+                    with self._lock:
+                        information = self._probing.pop(each_path)
+                    if _duration is None:
+                        self._fail(each_path)
+                        continue
+                    self._write_queue.put((*information[:4], _duration))
+        except BaseException as e:
+            # 解析线程意外退出时继续消费队列直到结束标记，避免上游在有界队列上永久阻塞，错误在 `run` 结束时抛出
+            if self._error is None:
+                self._error = e
+            if not self._probe_closed:
+                for _ in self._probePaths():
+                    pass
+            with self._lock:
+                lost, self._probing = tuple(self._probing), {}
+            for each_path in lost:
+                self._fail(each_path)
+
+    def _flush(self, batch: List[Tuple[str, str, str, int, int]]) -> None:
+        if not batch or self._error is not None:
+            return
+        try:
+            addVideosIntoDB(batch)
+            if self.fingerprints:
+                updateScanStates(tuple((*self.fingerprints[information[2]], information[0]) for information in batch if information[0] and information[2] in self.fingerprints))
+            self.written += len(batch)
+        except BaseException as e:
+            # 出错后继续消费队列，避免上游阻塞，错误在 `run` 结束时抛出
+            self._error = e
+
+    def _writeWorker(self) -> None:
+        batch: List[Tuple[str, str, str, int, int]] = []
+        while True:
+            try:
+                information = self._write_queue.get(timeout=1)
+            except queue.Empty:
+                # 空闲时也提交，保证慢速扫描时结果及时落盘
+                self._flush(batch)
+                batch = []
+                continue
+            if information is None:
+                self._flush(batch)
+                return
+            batch.append(information)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+
+    def run(self, video_paths: Iterable[str], path_is_prechecked: bool = False) -> Tuple[str, ...]:
+        '''Return the failed paths'''
+        writer = threading.Thread(target=self._writeWorker, name='ingestWriter', daemon=True)
+        writer.start()
+        if self.probe_in_process:
+            prober = threading.Thread(target=self._probeWorker, name='ingestProber', daemon=True)
+            prober.start()
+        try:
+            with universeExecutor(CONFIG.PUSH_VIDEO_THREAD_NUM, self.tqdm_obj) as executor:
+                for each_path, is_new in self._filter(video_paths, path_is_prechecked):
+                    if not is_new:
+                        executor.progress(getFileName(each_path))
+                        continue
+                    executor.submit(getFileName(each_path), getVideoInsertTuple, each_path, not self.probe_in_process).add_done_callback(functools.partial(self._hashed, each_path))
+        finally:
+            if self.probe_in_process:
+                self._probe_queue.put(None)
+                prober.join()
+            self._write_queue.put(None)
+            writer.join()
+        if self._error is not None:
+            raise self._error
+        return tuple(self._failed)
+
+
+def pushVideoBaseInfo2DB(video_path: Union[str, Sequence[str]], path_is_prechecked: bool = False, show_progress: bool = False, is_dir: bool = False, on_scan: Optional[Callable[[scanResultTuple], None]] = None) -> Tuple[bool, Tuple]:
+    '''video_path can be a string of single path or a list of path\n
+    on_scan: called with the `scanLibrary` result when `is_dir` is True\n
+    If success, return True, otherwise return False, and the failed path(s)'''
+    fingerprints: Dict[str, scanEntryTuple] = {}
+    if is_dir:
+        _scan_result = scanLibrary(video_path)
+        if on_scan is not None:
+            on_scan(_scan_result)
+        fingerprints = {entry.filePath: entry for entry in (*_scan_result.added, *_scan_result.changed)}
+        video_path = tuple(fingerprints)
+        path_is_prechecked = True
+    if isinstance(video_path, str):
+        video_path = (video_path,)
+    tqdm_obj = tqdm.tqdm(total=len(video_path)) if show_progress else None
+    failed_path = ingestPipeline(tqdm_obj, fingerprints).run(video_path, path_is_prechecked)
+    if tqdm_obj is not None:
+        tqdm_obj.close()
+    return not bool(failed_path), failed_path
+
+
+def parseThumbnailSize(size: str) -> Tuple[int, int]:
+    '''"400*225" or "400x225" -> (400, 225)'''
+    width, height = size.replace('*', 'x').split('x')
+    return int(width), int(height)
+
+
+def getThumbnailPath(hash: str, size: Optional[str] = None) -> str:
+    '''size: None for the main thumbnail, otherwise one of `THUMBNAIL_EXTRA_SIZES`'''
+    if size is None:
+        return os.path.join(CONFIG.THUMBNAIL_PATH, f'{hash}{CONFIG.THUMBNAIL_SUFFIX}')
+    width, height = parseThumbnailSize(size)
+    return os.path.join(CONFIG.THUMBNAIL_PATH, f'{hash}_{width}x{height}{CONFIG.THUMBNAIL_SUFFIX}')
+
+
+def thumbnailCommand(video_path: str, timing: float, outputs: Sequence[Tuple[str, str]]) -> List[str]:
+    '''outputs: (size, output path), all sizes are scaled from one decoded frame.\n
+    Only keyframes are decoded and the input seek is not accurate, so ffmpeg takes the keyframe nearest to `timing` without decoding the frames between'''
+    _threads = f'{CONFIG.THUMBNAIL_FFMPEG_THREADS}'
+    args = [CONFIG.FFMPEG_PATH, '-loglevel', 'quiet', '-threads', _threads, '-skip_frame', 'nokey', '-noaccurate_seek', '-ss', f'{timing}', '-i', video_path, '-an', '-sn', '-dn']
+    if len(outputs) == 1:
+        width, height = parseThumbnailSize(outputs[0][0])
+        return args + ['-vf', f'scale={width}:{height}', '-frames:v', '1', '-threads', _threads, '-f', CONFIG.THUMBNAIL_FORMAT, '-y', outputs[0][1]]
+    _scales = ';'.join(f'[s{i}]scale={width}:{height}[o{i}]' for i, (width, height) in enumerate(parseThumbnailSize(size) for size, _ in outputs))
+    args += ['-filter_complex', f"[0:v]split={len(outputs)}{''.join(f'[s{i}]' for i in range(len(outputs)))};{_scales}"]
+    for i, (_, output_path) in enumerate(outputs):
+        args += ['-map', f'[o{i}]', '-frames:v', '1', '-threads', _threads, '-f', CONFIG.THUMBNAIL_FORMAT, '-y', output_path]
+    return args
+
+
+def generateThumbnail(_videoBaseInfoTuple: videoBaseInfoTuple, size: str = '400*225', extra_sizes: Optional[Sequence[str]] = None, main: bool = True) -> bool:
+    '''Create the main thumbnail and the `extra_sizes` ones (default: `THUMBNAIL_EXTRA_SIZES`) with one ffmpeg run.\n
+    The images are written into temp files and renamed into place, so a half-written image is never served.\n
+    main: If False, only the extra sizes are created\n
+    Return True if the main thumbnail (or the first extra one when `main` is False) is created'''
+    timing:int = int(float(_videoBaseInfoTuple.videoDuration)/5)
+    extra_sizes = CONFIG.THUMBNAIL_EXTRA_SIZES if extra_sizes is None else extra_sizes
+    targets = (*(((size, getThumbnailPath(_videoBaseInfoTuple.hash)),) if main else ()), *((each_size, getThumbnailPath(_videoBaseInfoTuple.hash, each_size)) for each_size in extra_sizes))
+    if not targets:
+        return False
+    outputs: List[Tuple[str, str, str]] = []
+    try:
+        for _size, img_path in targets:
+            fd, tmp_path = tempfile.mkstemp(dir=CONFIG.THUMBNAIL_PATH, prefix='.tmp-', suffix=CONFIG.THUMBNAIL_SUFFIX)
+            os.close(fd)
+            outputs.append((_size, tmp_path, img_path))
+        subprocess.run(thumbnailCommand(_videoBaseInfoTuple.filePath, timing, [(_size, tmp_path) for _size, tmp_path, _ in outputs]))
+        if os.path.getsize(outputs[0][1]) == 0:
+            return False
+        for _, tmp_path, img_path in outputs:
+            if os.path.getsize(tmp_path) != 0:
+                os.replace(tmp_path, img_path)
+        return True
+    finally:
+        for _, tmp_path, _ in outputs:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def multiThreadCreateThumbnail(_videoBaseInfoTuples:Sequence[videoBaseInfoTuple], size:str = '400*225', show_progress:bool = False, cover:bool = False) -> None:
+    tqdm_obj = tqdm.tqdm(_videoBaseInfoTuples) if show_progress else None
+    with universeExecutor(CONFIG.THUMBNAIL_THREAD_NUM, tqdm_obj) as executor:
+        for eachTuple in _videoBaseInfoTuples:
+            if(not cover and os.path.exists(getThumbnailPath(eachTuple.hash))):
+                executor.progress(f'{eachTuple.fileName}')
+                continue
+            executor.submit(eachTuple.fileName, generateThumbnail, eachTuple, size)
+
+
+def createThumbnail(_videoBaseInfoTuple: Optional[Union[videoBaseInfoTuple, Sequence[videoBaseInfoTuple]]] == None, size:str = '400*225', show_progress:bool = False, cover:bool = False) -> None: # type: ignore
+    if _videoBaseInfoTuple is None:
+        _videoBaseInfoTuple = tuple(each[0] for each in getAllBindedVideos())
+    if isinstance(_videoBaseInfoTuple, videoBaseInfoTuple):
+        _videoBaseInfoTuple = (_videoBaseInfoTuple,)
+    if show_progress:
+        _videoBaseInfoTuple = tqdm.tqdm(_videoBaseInfoTuple)
+    if CONFIG.THUMBNAIL_THREAD_NUM == 1:
+        for eachTuple in _videoBaseInfoTuple:
+            if show_progress:
+                _videoBaseInfoTuple.set_description(f'{eachTuple.fileName}')# type: ignore
+            if(not cover and os.path.exists(getThumbnailPath(eachTuple.hash))):
+                continue
+            generateThumbnail(eachTuple, size)
+    else:
+        multiThreadCreateThumbnail(_videoBaseInfoTuple, size, show_progress, cover)
+
+
+def getSpritePath(hash: str) -> str:
+    '''The folder of the sprite sheets and the WebVTT file of the video'''
+    return os.path.join(CONFIG.THUMBNAIL_PATH, f'{hash}_sprite')
+
+
+def getSpriteSheetPath(hash: str, index: int) -> str:
+    return os.path.join(getSpritePath(hash), f'{index:03d}{CONFIG.THUMBNAIL_SUFFIX}')
+
+
+def generateSpriteVTT(hash: str, duration: int) -> str:
+    '''Each cue points to the tile of the frame at its start time: `/api/v1/sprite/<hash>/<sheet>#xywh=x,y,w,h`,\n
+    the token is added into the cue URLs when the file is served'''
+    width, height = parseThumbnailSize(CONFIG.SPRITE_TILE_SIZE)
+    per_sheet = CONFIG.SPRITE_COLUMNS * CONFIG.SPRITE_ROWS
+
+    def timestamp(seconds: int) -> str:
+        return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}.000'
+    cues = ['WEBVTT', '']
+    for i in range((duration + CONFIG.SPRITE_INTERVAL - 1) // CONFIG.SPRITE_INTERVAL):
+        sheet, tile = divmod(i, per_sheet)
+        cues += [f'{timestamp(i * CONFIG.SPRITE_INTERVAL)} --> {timestamp(min((i + 1) * CONFIG.SPRITE_INTERVAL, duration))}',
+                 f'/api/v1/sprite/{hash}/{sheet}#xywh={tile % CONFIG.SPRITE_COLUMNS * width},{tile // CONFIG.SPRITE_COLUMNS * height},{width},{height}', '']
+    return '\n'.join(cues)
+
+
+def generateSprite(_videoBaseInfoTuple: videoBaseInfoTuple) -> bool:
+    '''Create the seek-preview sprite sheets (one frame per `SPRITE_INTERVAL` seconds) and the WebVTT file with one ffmpeg run.\n
+    Unlike the thumbnails all frames are decoded, so each tile is the frame at the start time of its cue rather than the nearest keyframe.\n
+    All files are written into a temp folder which is renamed into place at the end. Return True if created'''
+    duration = int(float(_videoBaseInfoTuple.videoDuration))
+    if duration <= 0:
+        return False
+    width, height = parseThumbnailSize(CONFIG.SPRITE_TILE_SIZE)
+    _threads = f'{CONFIG.THUMBNAIL_FFMPEG_THREADS}'
+    tmp_path = tempfile.mkdtemp(dir=CONFIG.THUMBNAIL_PATH, prefix='.tmp-')
+    try:
+        subprocess.run([CONFIG.FFMPEG_PATH, '-loglevel', 'quiet', '-threads', _threads, '-i', _videoBaseInfoTuple.filePath, '-an', '-sn', '-dn',
+                        '-vf', f'fps=1/{CONFIG.SPRITE_INTERVAL},scale={width}:{height},tile={CONFIG.SPRITE_COLUMNS}x{CONFIG.SPRITE_ROWS}',
+                        '-threads', _threads, '-f', 'image2', '-start_number', '0', '-y', os.path.join(tmp_path, f'%03d{CONFIG.THUMBNAIL_SUFFIX}')])
+        if not os.path.exists(os.path.join(tmp_path, f'000{CONFIG.THUMBNAIL_SUFFIX}')):
+            return False
+        with open(os.path.join(tmp_path, 'index.vtt'), 'w', encoding='utf-8') as f:
+            f.write(generateSpriteVTT(_videoBaseInfoTuple.hash, duration))
+        sprite_path = getSpritePath(_videoBaseInfoTuple.hash)
+        if os.path.exists(sprite_path):
+            shutil.rmtree(sprite_path)
+        os.replace(tmp_path, sprite_path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+
+def createSprites(_videoBaseInfoTuples: Optional[Sequence[videoBaseInfoTuple]] = None, show_progress: bool = False, cover: bool = False) -> None:
+    '''Create the sprite sheets for the videos, default: all binded videos'''
+    if _videoBaseInfoTuples is None:
+        _videoBaseInfoTuples = tuple(each[0] for each in getAllBindedVideos())
+    tqdm_obj = tqdm.tqdm(_videoBaseInfoTuples) if show_progress else None
+    with universeExecutor(CONFIG.THUMBNAIL_THREAD_NUM, tqdm_obj) as executor:
+        for eachTuple in _videoBaseInfoTuples:
+            if(not cover and os.path.exists(getSpritePath(eachTuple.hash))):
+                executor.progress(f'{eachTuple.fileName}')
+                continue
+            executor.submit(eachTuple.fileName, generateSprite, eachTuple)
+
+
+class thumbnailQueue():
+    '''按需生成缩略图的工作队列：同时运行的 ffmpeg 数量不超过 `max_workers`，\n
+    同一视频的并发请求只生成一次并共享同一个 `Future`'''
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self._executor = ThreadPoolExecutor(CONFIG.THUMBNAIL_QUEUE_WORKERS if max_workers is None else max_workers, thread_name_prefix='thumbnail')
+        self._flights = singleFlight(self._executor)
+
+    def _generate(self, _videoBaseInfoTuple: videoBaseInfoTuple, size: Optional[str] = None) -> bool:
+        # 排队期间可能已由其他途径生成
+        if os.path.exists(getThumbnailPath(_videoBaseInfoTuple.hash, size)):
+            return True
+        # 主缩略图已存在而额外尺寸缺失（在添加该尺寸之前生成，或 ffmpeg 的该路输出失败）时只补齐这一尺寸
+        if size is not None and os.path.exists(getThumbnailPath(_videoBaseInfoTuple.hash)):
+            return generateThumbnail(_videoBaseInfoTuple, extra_sizes=(size,), main=False)
+        return generateThumbnail(_videoBaseInfoTuple) and os.path.exists(getThumbnailPath(_videoBaseInfoTuple.hash, size))
+
+    def _generateSprite(self, _videoBaseInfoTuple: videoBaseInfoTuple) -> bool:
+        if os.path.exists(getSpritePath(_videoBaseInfoTuple.hash)):
+            return True
+        return generateSprite(_videoBaseInfoTuple)
+
+    def request(self, _videoBaseInfoTuple: videoBaseInfoTuple, size: Optional[str] = None) -> 'Future[bool]':
+        '''size: None for the main thumbnail, otherwise one of `THUMBNAIL_EXTRA_SIZES`'''
+        return self._flights.submit(_videoBaseInfoTuple.hash if size is None else (_videoBaseInfoTuple.hash, size), self._generate, _videoBaseInfoTuple, size)
+
+    def requestSprite(self, _videoBaseInfoTuple: videoBaseInfoTuple) -> 'Future[bool]':
+        return self._flights.submit(('sprite', _videoBaseInfoTuple.hash), self._generateSprite, _videoBaseInfoTuple)
+
+
+_thumbnail_queue = perProcess(thumbnailQueue)
+
+
+def getThumbnailQueue() -> thumbnailQueue:
+    '''Return the shared thumbnail queue of the current process'''
+    return _thumbnail_queue.get()
@@ -0,0 +1,97 @@
+import atexit
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .config import CONFIG
+from .database import updateWatchStates
+from .unit import perProcess
+
+
+class watchBuffer():
+    '''观看记录的写后缓冲：播放请求只修改内存，同一视频在两次写入之间只保留最新的观看时间与播放位置，\n
+    播放次数累加；首次记录时启动后台线程，每隔 interval 秒在一个事务中写入数据库，停止或进程退出时写入剩余记录'''
+
+    def __init__(self, interval: Optional[int] = None):
+        self.interval: int = CONFIG.WATCH_FLUSH_INTERVAL if interval is None else interval
+        # hash -> [lastWatchTime, plays, lastPosition]
+        self._pending: Dict[str, List] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, hash: str, play: bool = False, position: Optional[float] = None, watch_time: Optional[int] = None) -> None:
+        '''play: count as a new play, only once per hash until the next flush\n
+        position: the playback position in seconds, None to keep the stored one'''
+        watch_time = int(time.time()) if watch_time is None else watch_time
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            state = self._pending.get(hash)
+            if state is None:
+                self._pending[hash] = [watch_time, 1 if play else 0, position]
+                return
+            state[0] = max(state[0], watch_time)
+            # 同一次播放开始时播放器常发出多个从头开始的请求，间隔内只计一次
+            state[1] = state[1] or (1 if play else 0)
+            if position is not None:
+                state[2] = position
+
+    def flush(self) -> int:
+        '''Write the pending records into the DB, returns the count of them'''
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                updateWatchStates(tuple((hash, *state) for hash, state in pending.items()))
+            except Exception:
+                # 写入失败时放回缓冲区，与期间的新记录合并后下次重试
+                with self._lock:
+                    for hash, state in pending.items():
+                        current = self._pending.setdefault(hash, state)
+                        if current is not state:
+                            current[0] = max(current[0], state[0])
+                            current[1] += state[1]
+                            if current[2] is None:
+                                current[2] = state[2]
+                raise
+            return len(pending)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            # TODO: Logging
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        with self._flush_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='watch-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+_buffer = perProcess(watchBuffer)
+
+
+def getWatchBuffer() -> watchBuffer:
+    '''Return the shared watch buffer of the current process, the background flushing is started by `start`'''
+    return _buffer.get()
+
+
+def peekWatchBuffer() -> Optional[watchBuffer]:
+    '''Return the watch buffer of the current process, None if it has not been used'''
+    return _buffer.peek()